@@ -1,10 +1,11 @@
 import threading
 import sounddevice as sd
-from io import BytesIO
 
 from client.RtpPacket import RtpPacket
 from client.ClientRtp import ClientRtp
 from client.Buffer import BufferQueue
+from client.Reassembler import Reassembler
+from client.PlayoutClock import PlayoutClock
 
 BUF_SIZE = 20480
 
@@ -17,10 +18,16 @@ class AudioClientRtp(ClientRtp):
     def __init__(self, addr, *args, **kwargs):
         super(AudioClientRtp, self).__init__(addr, *args, **kwargs)
 
-        # frame rate
-        self.fs = None
+        # payload format, with the frame rate
+        self.format = None
+        # seconds of audio in each chunk
+        self.ptime = 0.04
         # buffer of frames
         self.buffer = BufferQueue()
+        # combine the packets into chunks
+        self.reassembler = Reassembler()
+        # start when enough is buffered, along with the video
+        self.playout = PlayoutClock()
         # mute?
         self.is_mute = False
         # output device
@@ -30,9 +37,14 @@ class AudioClientRtp(ClientRtp):
         """
         Start the sound device, and start to receive RTP packet from server
         """
-        self.out = sd.RawOutputStream(samplerate=self.fs, channels=2, dtype='float32', blocksize=1)
+        # the device consumes a chunk each time
+        self.out = sd.RawOutputStream(
+            samplerate=self.format.rate, channels=self.format.channels, dtype=self.format.dtype,
+            blocksize=int(self.format.rate * self.ptime)
+        )
         self.out.start()
-        self.setInterval(0)
+        # check the buffer twice a chunk when it's drained
+        self.setInterval(self.ptime / 2)
         threading.Thread(target=self.recvRtp, daemon=True).start()
 
     def afterRun(self):
@@ -51,57 +63,61 @@ class AudioClientRtp(ClientRtp):
         """
         Receive RTP packet from server
         """
+        rtpPacket = RtpPacket()
         while self._stopper.is_set():
-            rtpPacket = RtpPacket()
-            byteStream = BytesIO(b'')
-            lastFrameNbr = -1
-            packetBuffer = BufferQueue()
-            while True:
-                try:
-                    data = self.socket.recv(BUF_SIZE)
-                    if not data:
-                        break
-                    rtpPacket.decode(data)
-                    marker = rtpPacket.marker()
-                    currentSeqNbr = rtpPacket.seqNum()
-
-                    lastFrameNbr = rtpPacket.timestamp()
-                    byte = rtpPacket.getPayload()
-                    # put into buffer
-                    packetBuffer.put(currentSeqNbr, byte)
-
-                    if marker == 1:
-                        while True:
-                            seq, byte = packetBuffer.get()
-                            if byte is None:
-                                break
-                            # combine the bytes
-                            byteStream.write(byte)
-                        break
-                except IOError:
+            try:
+                data = self.socket.recv(BUF_SIZE)
+                if not data:
                     continue
-                except AttributeError:
-                    break
-            if lastFrameNbr == -1:
+                rtpPacket.decode(data)
+            except IOError:
+                continue
+            except AttributeError:
+                break
+            if not self.acceptEpoch(Reassembler.getEpoch(rtpPacket.getPayload())):
+                # sent before repositioned
                 continue
-            # put the chunk into buffer
-            self.buffer.put(lastFrameNbr, byteStream.getbuffer())
+            chunkNbr = rtpPacket.timestamp()
+            # combine the bytes
+            chunk = self.reassembler.put(chunkNbr, rtpPacket.getPayload())
+            if chunk is None:
+                continue
+            # put the samples into buffer
+            self.buffer.put(self.getSeq(chunkNbr), self.format.decode(chunk))
 
     def display(self):
         """
         Display the sound
         """
-        seq, chunk = self.buffer.get()
-        if self.is_mute:
-            return
-        if chunk is not None:
-            self.out.write(chunk)
-
-    def setFrameRate(self, fs):
-        self.fs = fs
+        # seconds of each chunk number at the speed
+        unit = self.ptime / abs(self.speedFactor)
+        while self._stopper.is_set():
+            delay = self.playout.poll(self.buffer, unit)
+            if delay is None or delay > self.ptime:
+                # buffering, or not due until the device plays the chunk before
+                return
+            seq, chunk = self.buffer.get()
+            if chunk is None:
+                return
+            # blocks until the device has room for it
+            if not self.is_mute:
+                self.out.write(chunk)
+
+    def setFormat(self, audioFormat):
+        self.format = audioFormat
+
+    def setPtime(self, ptime):
+        """
+        :param ptime: ms of audio in each chunk
+        """
+        self.ptime = ptime / 1000
 
     def clearBuffer(self):
+        """
+        Clear the buffer, and buffer again before playing
+        """
         self.buffer.clear()
+        self.playout.reset()
 
     def mute(self):
         if self.is_mute:
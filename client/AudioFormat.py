@@ -0,0 +1,88 @@
+import struct
+import zlib
+
+# dtype of the sound device of each sample type
+SAMPLES = {
+    'f32': 'float32',
+    's16': 'int16'
+}
+# bytes of each sample
+SAMPLE_SIZE = {
+    'f32': 4,
+    's16': 2
+}
+# flags before each chunk
+FLAGS = struct.Struct('!B')
+# the chunk is compressed by zlib
+COMPRESSED = 0x01
+# the chunk is silent, only n samples are sent
+SILENT = 0x02
+# n samples of each channel of the silent chunk
+SILENCE = struct.Struct('!I')
+
+# preferred format, the rate is the highest one to choose
+DEFAULT_FORMAT = 's16/2/44100/zlib'
+
+
+class AudioFormat:
+    """
+    Payload format of the audio chunks, 'sample/channels/rate[/zlib]'
+    """
+
+    def __init__(self, text):
+        """
+        :param text: 'sample/channels/rate[/zlib]'
+        """
+        fields = text.strip().split('/')
+        self.sample = fields[0]
+        self.channels = int(fields[1])
+        self.rate = int(fields[2])
+        self.compression = len(fields) > 3 and fields[3] == 'zlib'
+        # dtype of the sound device
+        self.dtype = SAMPLES[self.sample]
+
+    def __str__(self):
+        text = '{}/{}/{}'.format(self.sample, self.channels, self.rate)
+        if self.compression:
+            text = text + '/zlib'
+        return text
+
+    @staticmethod
+    def negotiate(preferred, description):
+        """
+        Choose the format nearest to the preferred one from the formats described
+        :param preferred: 'sample/channels/rate[/zlib]', the rate is the highest one to choose
+        :param description: { 'samples': 'f32,s16', 'channels': '2,1', 'rates': '44100,...', 'compression': 'zlib' }
+        :return: AudioFormat, None if the server describes none
+        """
+        if 'samples' not in description.keys():
+            return None
+        preferred = AudioFormat(preferred)
+        samples = description['samples'].split(',')
+        channels = [int(c) for c in description['channels'].split(',')]
+        rates = sorted(int(r) for r in description['rates'].split(','))
+        compression = description.get('compression', '').split(',')
+
+        sample = preferred.sample if preferred.sample in samples else samples[0]
+        channel = preferred.channels if preferred.channels in channels else max(channels)
+        # the highest rate no more than the preferred one
+        rate = max([r for r in rates if r <= preferred.rate] or rates[:1])
+        text = '{}/{}/{}'.format(sample, channel, rate)
+        if preferred.compression and 'zlib' in compression:
+            text = text + '/zlib'
+        return AudioFormat(text)
+
+    def decode(self, payload):
+        """
+        :param payload: bytes of the chunk, [FLAGS][samples], or [FLAGS][SILENCE] if it's silent
+        :return: bytes of the samples interleaved, to write into the sound device
+        """
+        flags, = FLAGS.unpack_from(payload)
+        if flags & SILENT:
+            # fill the chunk with zeros, so that it still takes its time
+            samples, = SILENCE.unpack_from(payload, FLAGS.size)
+            return bytes(samples * self.channels * SAMPLE_SIZE[self.sample])
+        data = memoryview(payload)[FLAGS.size:]
+        if flags & COMPRESSED:
+            return zlib.decompress(data)
+        return bytes(data)
@@ -19,7 +19,8 @@ class BufferQueue:
     """
 
     def __init__(self):
-        self.head = BufferQueueNode(-1, None)
+        # any seq can be put after the head
+        self.head = BufferQueueNode(float('-inf'), None)
         self.tail = BufferQueueNode(-1, None)
         self.head.next = self.tail
         self.tail.prev = self.head
@@ -58,6 +59,24 @@ class BufferQueue:
         self.lock.release()
         return p.seq, p.content
 
+    def peek(self):
+        """
+        Get the first element of the buffer without removing it
+        """
+        with self.lock:
+            if self.length == 0:
+                return -1, None
+            return self.head.next.seq, self.head.next.content
+
+    def getSpan(self):
+        """
+        :return: seq of the last element minus the first one, 0 if empty
+        """
+        with self.lock:
+            if self.length == 0:
+                return 0
+            return self.tail.prev.seq - self.head.next.seq
+
     def searchFromBack(self, seq):
         """
         Find first node such that node.seq <= seq
@@ -1,10 +1,16 @@
 import threading
 from tkinter import *
 import tkinter.messagebox
+from PIL import ImageTk
 import sys; sys.path.append('..')
 
 from client.ClientRtspController import ClientRtspController
 from client.FileExplorer import FileExplorer
+from client.SpriteSheet import SpriteSheet
+from client.AudioFormat import DEFAULT_FORMAT
+
+# speeds can be chosen, negative for reverse
+SPEEDS = [-8, -2, -1, 0.5, 1, 1.5, 2, 4, 8, 16]
 
 
 class Client:
@@ -12,7 +18,7 @@ class Client:
     Client GUI
     """
 
-    def __init__(self, serveraddr, serverport):
+    def __init__(self, serveraddr, serverport, audioFormat=DEFAULT_FORMAT):
         # controls the RTSP
         self.rtspController = None
         # used to search files on the server
@@ -32,11 +38,13 @@ class Client:
         self.fileListBox = None
         self.advanceButton = None
         self.delayButton = None
-        self.qualityButton = None
+        self.qualityVar = None
+        self.qualityMenu = None
         self.muteButton = None
         self.forwardButton = None
         self.backwardButton = None
-        self.speedButton = None
+        self.speedVar = None
+        self.speedMenu = None
         self.fullScreenButton = None
 
         # full screen
@@ -48,16 +56,18 @@ class Client:
 
         # video files available on the server
         self.filenames = []
+        # thumbnails of current video, to preview when scrubbing
+        self.spriteSheet = None
 
         # functions called when receive RTSP response
         self.recvRtspCallback = {}
 
-        self.init(serveraddr, serverport)
+        self.init(serveraddr, serverport, audioFormat)
 
         self.master.mainloop()
 
-    def init(self, serveraddr, serverport):
-        self.rtspController = ClientRtspController(serveraddr, serverport)
+    def init(self, serveraddr, serverport, audioFormat):
+        self.rtspController = ClientRtspController(serveraddr, serverport, audioFormat)
         self.rtspController.setUpdateVideoCallback(self.updateVideo)
         self.rtspController.setWarningBox(tkinter.messagebox)
         self.rtspController.connectToServer()
@@ -105,10 +115,15 @@ class Client:
         self.forwardButton["command"] = self.forward
         self.forwardButton.grid(row=0, column=3, padx=2, pady=2)
 
-        self.speedButton = Button(buttonArea, width=10, padx=3, pady=3)
-        self.speedButton["text"] = "2x"
-        self.speedButton["command"] = self.speedup
-        self.speedButton.grid(row=0, column=4, padx=2, pady=2)
+        self.speedVar = tkinter.StringVar()
+        self.speedMenu = tkinter.OptionMenu(buttonArea, self.speedVar, '')
+        self.speedMenu.config(width=10, padx=3, pady=3)
+        self.speedMenu.grid(row=0, column=4, padx=2, pady=2)
+        menu = self.speedMenu['menu']
+        menu.delete(0, 'end')
+        for speed in SPEEDS:
+            menu.add_command(label='{:g}x'.format(speed), command=lambda s=speed: self.speed(s))
+        self.speedVar.set('1x')
 
         self.muteButton = Button(buttonArea, width=10, padx=3, pady=3)
         self.muteButton["text"] = "Mute"
@@ -125,10 +140,10 @@ class Client:
         self.advanceButton["command"] = self.advance
         self.advanceButton.grid(row=1, column=2, padx=2, pady=2)
 
-        self.qualityButton = Button(buttonArea, width=10, padx=3, pady=3)
-        self.qualityButton["text"] = "Blur"
-        self.qualityButton["command"] = self.blur
-        self.qualityButton.grid(row=1, column=3, padx=2, pady=2)
+        self.qualityVar = tkinter.StringVar()
+        self.qualityMenu = tkinter.OptionMenu(buttonArea, self.qualityVar, '')
+        self.qualityMenu.config(width=10, padx=3, pady=3)
+        self.qualityMenu.grid(row=1, column=3, padx=2, pady=2)
 
         self.fullScreenButton = Button(buttonArea, width=10, padx=3, pady=3)
         self.fullScreenButton["text"] = "Full Screen"
@@ -142,6 +157,7 @@ class Client:
         )
         self.scale.grid(row=0, column=0, columnspan=2, padx=2, pady=2)
         self.scale.bind('<Button-1>', self.clickScaleHandler)
+        self.scale.bind('<B1-Motion>', self.dragScaleHandler)
         self.scale.bind('<ButtonRelease-1>', self.releaseScaleHandler)
 
         self.currentTimeLabelStringVar = tkinter.StringVar()
@@ -239,21 +255,22 @@ class Client:
         """
         self.rtspController.audioTrackAlign(0.5)
 
-    def blur(self):
+    def quality(self, level):
         """
-        Change the quality of the video to blur
+        Change the quality of the video to the level of the ladder
         """
-        self.qualityButton['text'] = 'Normal'
-        self.qualityButton['command'] = self.highDefinition
-        self.rtspController.quality(self.rtspController.BLUR)
+        self.qualityVar.set(self.rtspController.ladder[level])
+        self.rtspController.quality(level)
 
-    def highDefinition(self):
+    def updateQualityMenu(self):
         """
-        Change the quality of the video to HD
+        Show the qualities of the video can be chosen
         """
-        self.qualityButton['text'] = 'Blur'
-        self.qualityButton['command'] = self.blur
-        self.rtspController.quality(self.rtspController.HD)
+        menu = self.qualityMenu['menu']
+        menu.delete(0, 'end')
+        for level, name in enumerate(self.rtspController.ladder):
+            menu.add_command(label=name, command=lambda l=level: self.quality(l))
+        self.qualityVar.set(self.rtspController.ladder[self.rtspController.qualityLevel])
 
     def mute(self):
         """
@@ -277,22 +294,13 @@ class Client:
         """
         self.rtspController.forward(-30)
 
-    def speedup(self):
+    def speed(self, speed):
         """
-        2x speed of the video
+        Change the speed of the video
+        :param speed: speed factor
         """
-        self.speedButton['text'] = '1x'
-        self.speedButton['command'] = self.speedDown
-        self.rtspController.speed(2)
-
-    def speedDown(self):
-        """
-        1x speed of the video
-        """
-        self.speedButton['text'] = '1x'
-        self.speedButton['text'] = '2x'
-        self.speedButton['command'] = self.speedup
-        self.rtspController.speed(1)
+        self.speedVar.set('{:g}x'.format(speed))
+        self.rtspController.speed(speed)
 
     def fullScreen(self):
         """
@@ -357,6 +365,17 @@ class Client:
         """
         self.rtspController.pause()
 
+    def dragScaleHandler(self, _):
+        """
+        Callback when drag the scale bar, preview the position by the sprite sheet
+        """
+        if self.spriteSheet is None:
+            return
+        seconds = self.scale.get() / 1000 * self.videoTime
+        thumbnail = self.spriteSheet.getThumbnail(seconds).resize((480, 270))
+        self.updateVideo(ImageTk.PhotoImage(thumbnail))
+        self.setTimeLabel(self.currentTimeLabelStringVar, int(seconds))
+
     def releaseScaleHandler(self, _):
         """
         Callback when release the scale bar, reposition to corresponding position
@@ -379,6 +398,16 @@ class Client:
         self.rtspController.stop()
         index = self.fileListBox.curselection()[0]
         self.describe(self.filenames[index])
+        self.spriteSheet = None
+        threading.Thread(target=self.loadSprites, args=(self.filenames[index],), daemon=True).start()
+
+    def loadSprites(self, filename):
+        """
+        Get the sprite sheet of the video, once for each video
+        """
+        data = self.fileExplorer.getSprites(filename)
+        if data is not None:
+            self.spriteSheet = SpriteSheet(data)
 
     def updateCurrentTimeLabel(self):
         """
@@ -414,14 +443,17 @@ class Client:
         self.filenames = li[:]
         self.master.title('Stream transport by Zhang Xinwei')
 
-    def rtspRecvCallback(self):
+    def rtspRecvCallback(self, requestCode):
         """
         Callback when receive RTSP response
+        :param requestCode: the request replied
         """
-        self.recvRtspCallback[self.rtspController.requestSent]()
+        if requestCode in self.recvRtspCallback.keys():
+            self.recvRtspCallback[requestCode]()
 
     def getRtspRecvCallbackOfEachState(self):
         def describeCallback():
+            self.updateQualityMenu()
             self.setup()
 
         def setupCallback():
@@ -477,7 +509,9 @@ if __name__ == '__main__':
     parser.add_argument('--host', type=str, default='127.0.0.1')
     # Server RTSP port
     parser.add_argument('--port', type=int, default=554)
+    # preferred payload format of the audio, 'sample/channels/rate[/zlib]', the rate is the highest one to choose
+    parser.add_argument('--audio-format', type=str, default=DEFAULT_FORMAT)
 
     args = vars(parser.parse_args())
 
-    Client(args['host'], args['port'])
+    Client(args['host'], args['port'], args['audio_format'])
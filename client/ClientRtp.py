@@ -1,4 +1,5 @@
 import socket
+import struct
 import threading
 
 
@@ -24,6 +25,15 @@ class ClientRtp(threading.Thread):
         # Default interval to display
         self.interval = 0.04
 
+        # Whether the stream is played in reverse, the later ones are displayed first
+        self.reverse = False
+        # Speed factor, the units skipped or repeated by the server are presented by their numbers
+        self.speedFactor = 1.0
+
+        # Epoch of the position, the packets of the older ones were in flight when repositioned, None if not known
+        self.epoch = None
+        self.epochLock = threading.Lock()
+
     def initSocket(self):
         """
         Init the RTP socket on UDP, and bind the port
@@ -37,12 +47,66 @@ class ClientRtp(threading.Thread):
             except OSError:
                 port += 2
 
+    def joinGroup(self, group, port):
+        """
+        Receive from the multicast group of a live channel instead, before started
+        :param group: address of the group
+        :param port: port the channel is sent to
+        """
+        self.socket.close()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # the other viewers on the host receive it as well
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('', port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
     def closeSocket(self):
         self.socket.close()
         self.socket = None
 
     def setInterval(self, interval):
-        self.interval = interval / 1.5
+        """
+        :param interval: seconds between the checks of the buffer
+        """
+        self.interval = interval
+
+    def setReverse(self, reverse):
+        self.reverse = reverse
+
+    def setSpeed(self, speed):
+        """
+        :param speed: speed factor, negative for reverse
+        """
+        self.speedFactor = speed
+        self.setReverse(speed < 0)
+
+    def acceptEpoch(self, epoch):
+        """
+        Check the epoch of a packet, the buffer is cleared when a newer one comes
+        :param epoch: 0 - 255, wraps around, None if the packet is malformed
+        :return: False if the packet is out of date
+        """
+        if epoch is None:
+            return False
+        with self.epochLock:
+            if self.epoch is None or epoch == self.epoch:
+                self.epoch = epoch
+                return True
+            if not 0 < (epoch - self.epoch) & 0xFF < 128:
+                return False
+            self.epoch = epoch
+            # the units buffered are of the old position
+            self.clearBuffer()
+            self.reassembler.clear()
+            return True
+
+    def getSeq(self, timestamp):
+        """
+        The seq to order the buffer, in the order to display
+        :param timestamp: RTP timestamp
+        """
+        return -timestamp if self.reverse else timestamp
 
     def getPort(self):
         """
@@ -68,6 +132,9 @@ class ClientRtp(threading.Thread):
         """
         self._stopper.clear()
 
+    def clearBuffer(self):
+        raise NotImplementedError
+
     """ Hook functions """
 
     def beforeRun(self):
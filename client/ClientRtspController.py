@@ -1,8 +1,9 @@
 import socket
 import threading
-import time
 from client.VideoClientRtp import VideoClientRtp
 from client.AudioClientRtp import AudioClientRtp
+from client.AudioFormat import AudioFormat, DEFAULT_FORMAT
+from client.RtspParser import RtspParser
 
 
 class ClientRtspController:
@@ -25,11 +26,10 @@ class ClientRtspController:
     TEARDOWN = 4
     SET_PARAMETER = 5
 
-    # Video quality
-    BLUR = 0
+    # Video quality, the default level of the ladder
     HD = 1
 
-    def __init__(self, serveraddr, serverport):
+    def __init__(self, serveraddr, serverport, audioFormat=DEFAULT_FORMAT):
         self.serverAddr = serveraddr
         self.serverPort = serverport
 
@@ -42,6 +42,8 @@ class ClientRtspController:
         self.rtspSeq = 0
         self.sessionid = 0
         self.requestSent = -1
+        # the requests not replied yet, { CSeq: request code }, the replies are matched by CSeq
+        self.pending = {}
         self.teardownAcked = False
 
         self.rtspSocket = None
@@ -50,12 +52,27 @@ class ClientRtspController:
         self.videoRtp = None
         self.videoLength = 0
         self.videoFrameRate = 0
+        # Qualities can be chosen, ['widthxheight@jpeg quality', ...] from low to high
+        self.ladder = []
+        self.qualityLevel = self.HD
+        # Speed factor, negative for reverse
+        self.speedFactor = 1.0
 
-        # Audio RTP stream
+        # Audio RTP stream, None if the video has no audio
         self.audioRtp = None
+        self.hasAudio = True
         self.audioFrameRate = 0
+        # ms of audio in each chunk
+        self.audioPtime = 0
+        # the preferred payload format of the audio, and the one used
+        self.preferredAudioFormat = audioFormat
+        self.audioFormat = None
 
         self.filename = ''
+        # whether it's a live channel, which can't be repositioned, nor changed the speed or the quality
+        self.live = False
+        # (group, port) the live channel is received from, None if sent to the RTP ports
+        self.multicast = None
 
         self.warningBox = None
         self.recvCallback = None
@@ -96,31 +113,56 @@ class ClientRtspController:
         if self.state == self.PREPARE:
             self.sendRtspRequest(self.SETUP)
 
-    def play(self, pos=None):
+    def play(self, pos=None, seek=None):
         """
-        Send PLAY request
+        Send PLAY request, repositioned in place if playing
         :param pos: the start position, None means from 0
+        :param seek: 'forward' or 'backward', where to find the keyframe, None for the nearest one
         """
-        if self.state == self.READY:
+        if self.live:
+            # joins the channel where it is
+            pos = None
+        if self.state == self.PLAYING:
+            # the RTP streams go on, the packets sent before repositioned are discarded by the epoch
+            if pos is not None:
+                if seek is None:
+                    self.sendRtspRequest(self.PLAY, pos=pos)
+                else:
+                    self.sendRtspRequest(self.PLAY, pos=pos, seek=seek)
+        elif self.state == self.READY:
             # Stop and restart the RTP streams
             self.stopRtp()
             self.openRtpPort()
+            if self.multicast is not None:
+                group, port = self.multicast
+                self.videoRtp.joinGroup(group, port)
+                if self.audioRtp is not None:
+                    self.audioRtp.joinGroup(group, port + 2)
+            for rtp in self.getStreams():
+                # the streams restarted go on at the speed of the server
+                rtp.setSpeed(self.speedFactor)
+                # the time to first frame is counted from now
+                rtp.clearBuffer()
 
             self.videoRtp.setDisplay(self.updateVideo)
             self.videoRtp.setInterval(1 / self.videoFrameRate)
             self.videoRtp.setDaemon(True)
             self.videoRtp.start()
 
-            self.audioRtp.setFrameRate(self.audioFrameRate)
-            self.audioRtp.setDaemon(True)
-            self.audioRtp.start()
+            if self.audioRtp is not None:
+                self.audioRtp.setFormat(self.audioFormat)
+                self.audioRtp.setPtime(self.audioPtime)
+                self.audioRtp.setDaemon(True)
+                self.audioRtp.start()
             if pos is None:
                 if self.filename not in self.memory.keys():
                     self.sendRtspRequest(self.PLAY)
                 else:
                     self.sendRtspRequest(self.PLAY, pos=self.memory[self.filename])
-            else:
+            elif seek is None:
                 self.sendRtspRequest(self.PLAY, pos=pos)
+            else:
+                self.sendRtspRequest(self.PLAY, pos=pos, seek=seek)
 
     def pause(self):
         """
@@ -149,42 +191,55 @@ class ClientRtspController:
         Advance / delay the audio track
         :param seconds: positive for advance, and negative for delay
         """
+        if self.live or self.audioRtp is None:
+            return
         self.sendRtspRequest(self.SET_PARAMETER, align=seconds)
         self.audioRtp.clearBuffer()
 
     def quality(self, level):
         """
-        Change video quality
-        :param level: 0 for BLUR and 1 for HD
+        Change video quality, it takes effect from next frame
+        :param level: level of the ladder, 0 for the lowest
         """
+        if self.live:
+            return
+        self.qualityLevel = level
         self.sendRtspRequest(self.SET_PARAMETER, level=level)
 
     def mute(self):
         """
         Mute the audio
         """
-        self.audioRtp.mute()
+        if self.audioRtp is not None:
+            self.audioRtp.mute()
 
     def forward(self, seconds):
         """
         Forward the video, negative seconds for backward
         """
+        if self.live:
+            return
         current = self.getCurrentTime()
         aim = current + seconds
         pos = int(aim / self.getTotalTime() * 1000)
         pos = max(0, pos)
         pos = min(1000, pos)
-        self.pause()
-        time.sleep(0.2)
-        self.play(pos)
+        # reposition at the keyframe in the direction, so that it won't move back when forward
+        self.play(pos, seek='forward' if seconds > 0 else 'backward')
 
     def speed(self, level):
         """
         Change the speed
-        :param level: 1 or 2
+        :param level: speed factor, e.g. 0.5, 1.5 or 16, negative for reverse
         """
+        if self.live:
+            return
         self.sendRtspRequest(self.SET_PARAMETER, speed=level)
-        self.audioRtp.clearBuffer()
+        self.speedFactor = level
+        # the frames buffered are at the old speed, or in the other order
+        for rtp in self.getStreams():
+            rtp.setSpeed(level)
+            rtp.clearBuffer()
 
     def setScreenSize(self, size):
         """
@@ -198,6 +253,7 @@ class ClientRtspController:
         """
         Send RTSP request to the server.
         """
+        body = ''
 
         # Describe request
         if requestCode == self.DESCRIBE and self.state == self.INIT:
@@ -220,17 +276,21 @@ class ClientRtspController:
             # Write the RTSP request to be sent.
             request = 'SETUP ' + self.filename + ' RTSP/1.0\nCSeq: ' + str(
                 self.rtspSeq) + '\nTransport: RTP/UDP; client_port= ' + str(self.videoRtpPort)
+            if self.audioFormat is not None:
+                request = request + '\nAudio-Format: ' + str(self.audioFormat)
 
             # Keep track of the sent request.
             self.requestSent = self.SETUP
 
         # Play request
-        elif requestCode == self.PLAY and self.state == self.READY:
+        elif requestCode == self.PLAY and self.state in (self.READY, self.PLAYING):
             self.rtspSeq += 1
             request = 'PLAY ' + self.filename + ' RTSP/1.0\nCSeq: ' + str(self.rtspSeq) + '\nSession: ' + str(
                 self.sessionid)
             if 'pos' in kwargs.keys():
                 request = request + '\nRange: npt={}'.format(kwargs['pos'])
+            if 'seek' in kwargs.keys():
+                request = request + '\nSeek: {}'.format(kwargs['seek'])
             self.requestSent = self.PLAY
 
         # Pause request
@@ -251,17 +311,22 @@ class ClientRtspController:
             self.rtspSeq += 1
             request = 'SET_PARAMETER ' + self.filename + ' RTSP/1.0\nCSeq: ' + str(self.rtspSeq) + '\nSession: ' + str(
                 self.sessionid)
+            # the parameter is the body
             if 'align' in kwargs.keys():
-                request = request + '\nalign: ' + str(kwargs['align'])
+                body = 'align: ' + str(kwargs['align']) + '\r\n'
             elif 'level' in kwargs.keys():
-                request = request + '\nlevel: ' + str(kwargs['level'])
+                body = 'level: ' + str(kwargs['level']) + '\r\n'
             elif 'speed' in kwargs.keys():
-                request = request + '\nspeed: ' + str(kwargs['speed'])
+                body = 'speed: ' + str(kwargs['speed']) + '\r\n'
             else:
                 return
+            request = request + '\nContent-Length: ' + str(len(body))
         else:
             return
+        self.pending[self.rtspSeq] = requestCode
 
+        # The headers end with an empty line, followed by the body if any
+        request = request.replace('\n', '\r\n') + '\r\n\r\n' + body
         # Send the RTSP request using rtspSocket.
         self.rtspSocket.send(request.encode())
 
@@ -271,63 +336,124 @@ class ClientRtspController:
         """
         Receive RTSP reply from the server.
         """
+        parser = RtspParser()
         while True:
             try:
-                reply = self.rtspSocket.recv(4096)
+                data = self.rtspSocket.recv(4096)
             except OSError:
                 break
-            print('\nreply')
-            print(reply.decode('utf-8'))
-
-            if not reply:
+            if not data:
                 break
-            self.parseRtspReply(reply.decode("utf-8"))
-            self.recvCallback()
-            # Close the RTSP socket upon requesting Teardown
-            if self.requestSent == self.TEARDOWN:
-                self.stopRtp()
-                try:
-                    self.rtspSocket.shutdown(socket.SHUT_RDWR)
-                    self.rtspSocket.close()
-                except OSError:
-                    pass
-                break
-
-    def parseRtspReply(self, data):
+            # the replies split or coalesced by TCP
+            for reply in parser.feed(data):
+                print('\nreply')
+                print(reply[0])
+                requestCode = self.parseRtspReply(reply)
+                self.recvCallback(requestCode)
+                # Close the RTSP socket upon requesting Teardown
+                if requestCode == self.TEARDOWN:
+                    self.stopRtp()
+                    try:
+                        self.rtspSocket.shutdown(socket.SHUT_RDWR)
+                        self.rtspSocket.close()
+                    except OSError:
+                        pass
+                    return
+
+    def parseRtspReply(self, reply):
         """
         Parse the RTSP reply from the server.
-        """
-        lines = str(data).split('\n')
-        seqNum = int(lines[1].split(' ')[1])
-
-        # Process only if the server reply's sequence number is the same as the request's
-        if seqNum == self.rtspSeq:
-            session = int(lines[2].split(' ')[1])
-            # New RTSP session ID
-            if self.sessionid == 0:
-                self.sessionid = session
-
-            # Process only if the session ID is the same
-            if self.sessionid == session:
-                if int(lines[0].split(' ')[1]) == 200:
-                    if self.requestSent == self.DESCRIBE:
-                        self.state = self.PREPARE
-                        infolines = lines[3:]
-                        self.videoLength = int(infolines[2].split(':')[-1])
-                        self.videoFrameRate = int(infolines[3].split(':')[-1])
-                        self.audioFrameRate = int(infolines[6].split(':')[-1])
-                    elif self.requestSent == self.SETUP:
-                        # Update RTSP state.
-                        self.state = self.READY
-                        # Open RTP port.
-                    elif self.requestSent == self.PLAY:
-                        self.state = self.PLAYING
-                    elif self.requestSent == self.PAUSE:
-                        self.state = self.READY
-                        self.stopRtp()
-                    elif self.requestSent == self.TEARDOWN:
-                        self.state = self.INIT
-                        self.teardownAcked = True
+        :param reply: (status line, { header in lower case: value }, body), parsed by RtspParser
+        :return: code of the request replied, None if it's not a request sent
+        """
+        statusLine, headers, body = reply
+        seqNum = int(headers.get('cseq', 0))
+
+        # Process only if the server reply's sequence number is of a request sent
+        requestCode = self.pending.pop(seqNum, None)
+        if requestCode is None:
+            return None
+        session = int(headers.get('session', 0))
+        # New RTSP session ID
+        if self.sessionid == 0:
+            self.sessionid = session
+
+        # Process only if the session ID is the same
+        if self.sessionid == session:
+            if int(statusLine.split(' ')[1]) == 200:
+                if requestCode == self.DESCRIBE:
+                    self.state = self.PREPARE
+                    info = self.parseDescription(body.splitlines())
+                    self.videoLength = int(info['video']['length'])
+                    self.videoFrameRate = int(info['video']['framerate'])
+                    self.ladder = info['video'].get('ladder', '').split(',')
+                    self.qualityLevel = int(info['video'].get('level', self.HD))
+                    # the video may have no audio
+                    self.hasAudio = 'audio' in info.keys()
+                    self.audioFormat = None
+                    if self.hasAudio:
+                        self.audioFrameRate = int(info['audio']['framerate'])
+                        self.audioPtime = float(info['audio'].get('ptime', 1000 / self.videoFrameRate))
+                        self.audioFormat = AudioFormat.negotiate(self.preferredAudioFormat, info['audio'])
+                    self.live = info['video'].get('type') == 'broadcast'
+                elif requestCode == self.SETUP:
+                    # Update RTSP state.
+                    self.state = self.READY
+                    if self.hasAudio:
+                        # the payload format of the audio the server uses
+                        self.audioFormat = AudioFormat(headers.get('audio-format', 'f32/2/{}'.format(self.audioFrameRate)))
+                    self.multicast = self.parseMulticast(headers.get('transport', ''))
+                elif requestCode == self.PLAY:
+                    self.state = self.PLAYING
+                    self.setEpoch(headers.get('epoch', ''))
+                elif requestCode == self.PAUSE:
+                    self.state = self.READY
+                    self.stopRtp()
+                elif requestCode == self.TEARDOWN:
+                    self.state = self.INIT
+                    self.teardownAcked = True
+        return requestCode
+
+    @staticmethod
+    def parseDescription(lines):
+        """
+        Parse the description of the video and audio
+        :param lines: ['m=video 0', 'a=key:value', ..., 'm=audio 0', ...]
+        :return: { 'video': { key: value }, 'audio': { key: value } }
+        """
+        info = {}
+        media = None
+        for line in lines:
+            line = line.strip()
+            if line.startswith('m='):
+                media = line[2:].split(' ')[0]
+                info[media] = {}
+            elif line.startswith('a=') and media is not None:
+                key, _, value = line[2:].partition(':')
+                info[media][key] = value
+        return info
+
+    @staticmethod
+    def parseMulticast(transport):
+        """
+        :param transport: 'RTP/UDP;multicast;destination=group;port=n', of the SETUP reply
+        :return: (group, port), None if not multicast
+        """
+        items = transport.replace(' ', '').split(';')
+        if 'multicast' not in items:
+            return None
+        params = dict(item.split('=') for item in items if '=' in item)
+        return params['destination'], int(params['port'])
+
+    def setEpoch(self, epoch):
+        """
+        Discard the packets sent before repositioned, even if none of the new ones has arrived yet
+        :param epoch: 'video=n;audio=n', of the PLAY reply
+        """
+        epochs = dict(item.split('=') for item in epoch.split(';') if '=' in item)
+        for key, rtp in (('video', self.videoRtp), ('audio', self.audioRtp)):
+            if key in epochs.keys() and rtp is not None:
+                rtp.acceptEpoch(int(epochs[key]))
 
     def openRtpPort(self):
         """
@@ -339,7 +465,7 @@ class ClientRtspController:
                 self.videoRtpPort = self.videoRtp.getPort()
             except OSError:
                 self.warningBox.showwarning('Unable to Bind', 'Unable to bind PORT=%d' % self.videoRtpPort)
-        if self.audioRtp is None:
+        if self.audioRtp is None and self.hasAudio:
             try:
                 self.audioRtp = AudioClientRtp('')
                 self.audioRtpPort = self.audioRtp.getPort()
@@ -351,12 +477,19 @@ class ClientRtspController:
         Stop the RTP
         """
         if self.videoRtp is not None:
+            print('\nPlayout: {}'.format(self.videoRtp.getStats()))
             self.videoRtp.stop()
             self.videoRtp = None
         if self.audioRtp is not None:
             self.audioRtp.stop()
             self.audioRtp = None
 
+    def getStreams(self):
+        """
+        :return: the RTP streams opened, the video, and the audio if the video has any
+        """
+        return [rtp for rtp in (self.videoRtp, self.audioRtp) if rtp is not None]
+
     def setWarningBox(self, box):
         self.warningBox = box
 
@@ -1,9 +1,10 @@
 import socket
+import threading
 
 
 class FileExplorer:
     """
-    Show and search videos on server
+    Show and search videos on server, and get the sprite sheets of them
     """
 
     def __init__(self, host, port, updateCallback):
@@ -11,6 +12,8 @@ class FileExplorer:
         self.serverHost = host
         self.serverPort = port
         self.updateCallback = updateCallback
+        # a request and its response at a time
+        self.lock = threading.Lock()
 
         self.init()
         self.connectToServer()
@@ -34,14 +37,42 @@ class FileExplorer:
         try:
             request = 'SEARCH {}'.format(info)
             print(request)
-            self.socket.send(request.encode())
-            response = self.socket.recv(2048).decode()
+            with self.lock:
+                self.socket.send(request.encode())
+                response = self.socket.recv(2048).decode()
             print(response)
             lines = self.parseResponse(response)
             self.updateCallback(lines)
         except ConnectionAbortedError:
             pass
 
+    def getSprites(self, filename):
+        """
+        Get the sprite sheet of the video
+        :return: bytes of it, None if failed
+        """
+        try:
+            with self.lock:
+                self.socket.send('SPRITES {}'.format(filename).encode())
+                # 'SPRITES length\n' and the data
+                response = b''
+                while b'\n' not in response:
+                    received = self.socket.recv(2048)
+                    if not received:
+                        return None
+                    response += received
+                header, _, data = response.partition(b'\n')
+                length = int(header.split()[1])
+                data = bytearray(data)
+                while len(data) < length:
+                    received = self.socket.recv(65536)
+                    if not received:
+                        return None
+                    data += received
+        except (ConnectionAbortedError, OSError):
+            return None
+        return bytes(data) if length > 0 else None
+
     @staticmethod
     def parseResponse(res):
         lines = res.split('\n')
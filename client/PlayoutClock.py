@@ -0,0 +1,181 @@
+import time
+
+# seconds of media buffered before starting to play, and after the buffer runs dry
+DEFAULT_PREBUFFER = 0.2
+
+
+class PlayoutClock:
+    """
+    Presentation clock of the client, each unit in the buffer is presented at its presentation time,
+    rather than as soon as it arrives, so the media sent ahead by the server is kept as a buffer.
+    The playback starts when enough media is buffered, and starts again the same way if the buffer runs dry.
+    Counts the time to first frame and the stalls
+    """
+
+    def __init__(self, prebuffer=DEFAULT_PREBUFFER, clock=time.monotonic):
+        """
+        :param prebuffer: seconds of media buffered before starting to play
+        :param clock: seconds, monotonic, replaced to simulate
+        """
+        self.prebuffer = prebuffer
+        self.clock = clock
+
+        # (presentation time, clock) the playback starts at, None if buffering
+        self.anchor = None
+        # presentation time of the unit last presented, and the one before it
+        self.last = None
+        self.gap = 0.0
+
+        # when the playback is requested, the time to its first frame is counted
+        self.requested = None
+        # seconds to the first frame of the last request, and the sum of all
+        self.firstFrame = 0.0
+        self.totalFirstFrame = 0.0
+        self.starts = 0
+        # n times and seconds the buffer runs dry, and since when it's dry
+        self.stalls = 0
+        self.stalled = 0.0
+        self.stallStart = None
+
+    def reset(self):
+        """
+        Start to buffer again, used when play, reposition or change the speed
+        """
+        self.anchor = None
+        self.last = None
+        self.stallStart = None
+        self.requested = self.clock()
+
+    def poll(self, buffer, unit):
+        """
+        Decide when to present the unit at the head of the buffer
+        :param buffer: BufferQueue, in the order to present
+        :param unit: seconds of media per seq of the buffer
+        :return: seconds until it's due, 0 to present it now, None if buffering
+        """
+        now = self.clock()
+        seq, _ = buffer.peek()
+        if buffer.length == 0:
+            if self.anchor is not None and self.last is not None:
+                # the media time presented now
+                position = self.anchor[0] + now - self.anchor[1]
+                if position > self.last + max(self.gap, unit) + unit:
+                    # nothing to present after the last one
+                    self.anchor = None
+                    self.stalls += 1
+                    self.stallStart = now
+            return None
+        position = seq * unit
+        if self.anchor is None:
+            if (buffer.getSpan() + 1) * unit < self.prebuffer:
+                return None
+            self.anchor = (position, now)
+            if self.requested is not None:
+                self.firstFrame = now - self.requested
+                self.totalFirstFrame += self.firstFrame
+                self.starts += 1
+                self.requested = None
+            elif self.stallStart is not None:
+                self.stalled += now - self.stallStart
+            self.stallStart = None
+        delay = self.anchor[1] + position - self.anchor[0] - now
+        if delay > 0:
+            return delay
+        if self.last is not None:
+            self.gap = position - self.last
+        self.last = position
+        return 0.0
+
+    def getStats(self):
+        return {
+            'ttff_ms': round(self.firstFrame * 1000, 3),
+            'avg_ttff_ms': round(self.totalFirstFrame / max(self.starts, 1) * 1000, 3),
+            'stalls': self.stalls,
+            'stall_ms': round(self.stalled * 1000, 3)
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    import heapq
+    import random
+    import sys; sys.path.append('..')
+
+    from client.Buffer import BufferQueue
+    from server.PacingClock import PacingClock
+
+    def simulate(lead, burstSpeed, prebuffer, args):
+        """
+        Send the frames by the pacing of the server over a link of limited bandwidth with jitter,
+        and present them by the playout clock, in simulated time
+        :return: stats of the playout
+        """
+        now = [0.0]
+        rand = random.Random(args['seed'])
+        fps = args['fps']
+        frames = int(args['seconds'] * fps)
+        size = args['frame_kbytes'] * 1024
+
+        def bandwidth(t):
+            # bytes/s, drops for a while every period
+            rate = args['mbps'] * 1000 * 1000 / 8
+            if args['dip_every'] > 0 and t % args['dip_every'] > args['dip_every'] - args['dip_seconds']:
+                rate *= args['dip_ratio']
+            return rate
+
+        # sent by the server, queued by the link
+        pacing = PacingClock(lead, float('inf'), burstSpeed, lambda: now[0])
+        arrivals = []
+        linkFree = 0.0
+        for index in range(frames):
+            delay = pacing.getDelay()
+            if delay > 0:
+                now[0] += delay
+            pacing.check(False)
+            pacing.advance(1 / fps)
+            sent = max(now[0], linkFree)
+            linkFree = sent + size / bandwidth(sent)
+            jitter = rand.expovariate(1 / args['jitter']) if args['jitter'] > 0 else 0.0
+            arrival = linkFree + args['rtt'] / 2 + jitter
+            heapq.heappush(arrivals, (arrival, index))
+
+        # presented by the client, which requests it a half round trip before the server starts
+        now[0] = -args['rtt'] / 2
+        playout = PlayoutClock(prebuffer, lambda: now[0])
+        playout.reset()
+        buffer = BufferQueue()
+        presented = 0
+        tick = 1 / fps / 4
+        while presented < frames:
+            while arrivals and arrivals[0][0] <= now[0]:
+                _, index = heapq.heappop(arrivals)
+                buffer.put(index, index)
+            while playout.poll(buffer, 1 / fps) == 0:
+                buffer.get()
+                presented += 1
+            now[0] += tick
+        return playout.getStats()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=120)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--frame-kbytes', type=float, default=30)
+    # bandwidth of the link, and how it drops
+    parser.add_argument('--mbps', type=float, default=8)
+    parser.add_argument('--dip-every', type=float, default=20)
+    parser.add_argument('--dip-seconds', type=float, default=3)
+    parser.add_argument('--dip-ratio', type=float, default=0.4)
+    # round trip and mean jitter of the link, seconds
+    parser.add_argument('--rtt', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = vars(parser.parse_args())
+
+    for name, lead, burstSpeed, prebuffer in [
+        ('real time, no buffer', 0.0, 1.0, 0.0),
+        ('0.5s lead at once', 0.5, 0.0, 0.0),
+        ('0.5s lead at once, prebuffer', 0.5, 0.0, DEFAULT_PREBUFFER),
+        ('2s fast start at 4x, prebuffer', 2.0, 4.0, DEFAULT_PREBUFFER)
+    ]:
+        print('{:32s} {}'.format(name, simulate(lead, burstSpeed, prebuffer, args)))
@@ -0,0 +1,102 @@
+import struct
+from collections import OrderedDict
+
+# type specific (8 bits) and fragment offset (24 bits), total length of the unit,
+# the type specific bits are the epoch of the unit, increased when repositioned
+PAYLOAD_HEADER = struct.Struct('!II')
+PAYLOAD_HEADER_SIZE = PAYLOAD_HEADER.size
+
+# n incomplete units can be kept, the older ones are lost
+MAX_PENDING = 8
+
+
+class Reassembler:
+    """
+    Combine the fragments into frames (or audio chunks), each fragment is placed by its offset,
+    so the fragments can arrive in any order
+    """
+
+    def __init__(self):
+        # timestamp -> [bytearray of the unit, bytes received, offsets received], in the order they start
+        self.pending = OrderedDict()
+
+        # n units completed, and n units lost since some fragments never arrive
+        self.completed = 0
+        self.lost = 0
+
+    def put(self, timestamp, payload):
+        """
+        Place the fragment into its unit
+        :param timestamp: RTP timestamp of the unit
+        :param payload: RTP payload, with the payload header
+        :return: the unit if it's completed by the fragment, None otherwise
+        """
+        if len(payload) < PAYLOAD_HEADER_SIZE:
+            return None
+        word, totalBytes = PAYLOAD_HEADER.unpack_from(payload)
+        offset = word & 0xFFFFFF
+        fragment = memoryview(payload)[PAYLOAD_HEADER_SIZE:]
+        if offset + len(fragment) > totalBytes:
+            return None
+
+        unit = self.pending.get(timestamp)
+        if unit is None or len(unit[0]) != totalBytes:
+            unit = [bytearray(totalBytes), 0, set()]
+            self.pending[timestamp] = unit
+            while len(self.pending) > MAX_PENDING:
+                self.pending.popitem(last=False)
+                self.lost += 1
+        data, received, offsets = unit
+        if offset in offsets:
+            # duplicated
+            return None
+        offsets.add(offset)
+        data[offset:offset + len(fragment)] = fragment
+        unit[1] = received + len(fragment)
+        if unit[1] < totalBytes:
+            return None
+
+        # the units started before it can't be completed any more
+        while True:
+            key, _ = self.pending.popitem(last=False)
+            if key == timestamp:
+                break
+            self.lost += 1
+        self.completed += 1
+        return data
+
+    @staticmethod
+    def getEpoch(payload):
+        """
+        :param payload: RTP payload, with the payload header
+        :return: epoch of the unit, the type specific bits, None if it's too short
+        """
+        if len(payload) < PAYLOAD_HEADER_SIZE:
+            return None
+        return payload[0]
+
+    def clear(self):
+        """
+        Discard the incomplete units
+        """
+        self.pending.clear()
+
+
+if __name__ == '__main__':
+    def test():
+        import random
+
+        reassembler = Reassembler()
+        frame = bytes(random.getrandbits(8) for _ in range(5000))
+        fragments = []
+        for offset in range(0, len(frame), 1452):
+            fragments.append(PAYLOAD_HEADER.pack(offset, len(frame)) + frame[offset:offset + 1452])
+        random.shuffle(fragments)
+        # a fragment of an older frame, which is never completed
+        print(reassembler.put(0, PAYLOAD_HEADER.pack(0, 3000) + bytes(1000)))
+        for fragment in fragments:
+            data = reassembler.put(1, fragment)
+        print(data == frame, reassembler.completed, reassembler.lost)
+
+
+    test()
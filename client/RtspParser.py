@@ -0,0 +1,96 @@
+# max bytes of the start line and the headers of a message
+MAX_HEADER = 16384
+# max bytes of the body of a message
+MAX_BODY = 65536
+
+
+class RtspParser:
+    """
+    Incremental parser of the RTSP responses on a TCP stream. Each response ends at the empty line after the headers,
+    followed by Content-Length bytes of body if any, e.g. the description of DESCRIBE,
+    so that the responses split or coalesced by TCP are parsed the same
+    """
+
+    def __init__(self):
+        # bytes received but not parsed yet
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: bytes received
+        :return: [(start line, { header in lower case: value }, body)] of the messages completed
+        """
+        self.buffer += data
+        messages = []
+        while True:
+            message = self.next()
+            if message is None:
+                return messages
+            messages.append(message)
+
+    def next(self):
+        """
+        Parse the first message in the buffer
+        :return: (start line, headers, body), None if it's not complete yet
+        """
+        # the empty lines between the messages
+        while self.buffer[:2] == b'\r\n' or self.buffer[:1] == b'\n':
+            del self.buffer[:2 if self.buffer[:1] == b'\r' else 1]
+        end, separator = self.findHeaderEnd()
+        if end < 0:
+            if len(self.buffer) > MAX_HEADER:
+                raise ValueError('Header too long')
+            return None
+
+        lines = bytes(self.buffer[:end]).decode('utf-8').replace('\r\n', '\n').split('\n')
+        headers = {}
+        for line in lines[1:]:
+            key, colon, value = line.partition(':')
+            if not colon:
+                raise ValueError('Invalid header: {}'.format(line))
+            headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if not 0 <= length <= MAX_BODY:
+            raise ValueError('Invalid Content-Length: {}'.format(length))
+        start = end + separator
+        if len(self.buffer) < start + length:
+            return None
+        body = bytes(self.buffer[start:start + length]).decode('utf-8')
+        del self.buffer[:start + length]
+        return lines[0].strip(), headers, body
+
+    def findHeaderEnd(self):
+        """
+        :return: (where the headers end, length of the empty line), -1 if not received yet
+        """
+        ends = [(self.buffer.find(separator), len(separator)) for separator in (b'\r\n\r\n', b'\n\n')]
+        ends = [end for end in ends if end[0] >= 0]
+        return min(ends) if ends else (-1, 0)
+
+
+if __name__ == '__main__':
+    def test():
+        import random
+
+        responses = [
+            'RTSP/1.0 200 OK\r\nCSeq: 1\r\nSession: 7\r\nContent-Type: application/sdp\r\nContent-Length: 25\r\n\r\n'
+            'm=video 0\r\na=length:300\r\n',
+            'RTSP/1.0 200 OK\r\nCSeq: 2\r\nSession: 7\r\nAudio-Format: s16/2/44100/zlib\r\n\r\n',
+            'RTSP/1.0 453 Not Enough Bandwidth\r\nCSeq: 3\r\nSession: 7\r\n\r\n'
+        ]
+        stream = ''.join(responses).encode()
+        for _ in range(1000):
+            parser = RtspParser()
+            parsed = []
+            i = 0
+            # split at random, and coalesce
+            while i < len(stream):
+                n = random.randint(1, 40)
+                parsed += parser.feed(stream[i:i + n])
+                i += n
+            assert [headers['cseq'] for _, headers, _ in parsed] == ['1', '2', '3']
+            assert parsed[0][2] == 'm=video 0\r\na=length:300\r\n' and parsed[2][0].split(' ')[1] == '453'
+        print('ok')
+
+    test()
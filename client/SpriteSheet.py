@@ -0,0 +1,46 @@
+import struct
+from io import BytesIO
+from PIL import Image
+
+# magic, thumbnail width, height, columns, rows of each atlas, seconds between the thumbnails, n thumbnails, n atlases
+HEADER = struct.Struct('!4sHHHHfII')
+MAGIC = b'SPRT'
+# bytes of each atlas
+LENGTH = struct.Struct('!I')
+
+
+class SpriteSheet:
+    """
+    Thumbnails of a video got from the server, to preview the position when scrubbing
+    """
+
+    def __init__(self, data):
+        """
+        :param data: bytes of the sprite sheet, [HEADER][LENGTH of each atlas][each atlas]
+        """
+        magic, width, height, self.cols, self.rows, self.interval, self.count, n = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a sprite sheet')
+        self.size = (width, height)
+
+        # encoded atlases, decoded when used
+        self.atlases = []
+        offset = HEADER.size + n * LENGTH.size
+        for i in range(n):
+            length, = LENGTH.unpack_from(data, HEADER.size + i * LENGTH.size)
+            self.atlases.append(data[offset:offset + length])
+            offset += length
+        self.images = {}
+
+    def getThumbnail(self, seconds):
+        """
+        :param seconds: the position
+        :return: PIL.Image of the thumbnail nearby
+        """
+        index = min(max(int(seconds / self.interval), 0), self.count - 1)
+        atlas, i = divmod(index, self.cols * self.rows)
+        if atlas not in self.images.keys():
+            self.images[atlas] = Image.open(BytesIO(self.atlases[atlas]))
+        width, height = self.size
+        x, y = i % self.cols * width, i // self.cols * height
+        return self.images[atlas].crop((x, y, x + width, y + height))
@@ -0,0 +1,55 @@
+import struct
+from io import BytesIO
+from PIL import Image
+
+# RTP payload type of the tile frames
+TILE_PAYLOAD_TYPE = 96
+
+# kind, width, height, tile size, n tiles
+FRAME_HEADER = struct.Struct('!BHHHH')
+# column and row of each tile
+TILE_HEADER = struct.Struct('!HH')
+
+# kinds of the frame
+FULL = 0
+TILES = 1
+
+
+class TileDecoder:
+    """
+    Composite the changed tiles onto the last image
+    """
+
+    def __init__(self):
+        # the last image
+        self.canvas = None
+
+    def decode(self, data):
+        """
+        Decode the tile frame
+        :param data: bytes of the tile frame
+        :return: PIL.Image, None if it can't be decoded
+        """
+        kind, width, height, tileSize, n = FRAME_HEADER.unpack_from(data)
+        offset = FRAME_HEADER.size
+        if kind == FULL:
+            self.canvas = Image.open(BytesIO(data[offset:]))
+            self.canvas.load()
+            return self.canvas.copy()
+
+        if self.canvas is None or self.canvas.size != (width, height):
+            # wait for next full frame
+            return None
+        if n > 0:
+            positions = [TILE_HEADER.unpack_from(data, offset + i * TILE_HEADER.size) for i in range(n)]
+            offset += n * TILE_HEADER.size
+            mosaic = Image.open(BytesIO(data[offset:]))
+            cols = mosaic.size[0] // tileSize
+            for i, (col, row) in enumerate(positions):
+                x, y = i % cols * tileSize, i // cols * tileSize
+                tile = mosaic.crop((x, y, x + tileSize, y + tileSize))
+                self.canvas.paste(tile, (col * tileSize, row * tileSize))
+        return self.canvas.copy()
+
+    def reset(self):
+        self.canvas = None
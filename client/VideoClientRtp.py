@@ -5,6 +5,9 @@ from io import BytesIO
 from client.ClientRtp import ClientRtp
 from client.RtpPacket import RtpPacket
 from client.Buffer import BufferQueue
+from client.Reassembler import Reassembler
+from client.TileDecoder import TileDecoder, TILE_PAYLOAD_TYPE
+from client.PlayoutClock import PlayoutClock
 
 BUF_SIZE = 20480
 
@@ -22,6 +25,15 @@ class VideoClientRtp(ClientRtp):
 
         # buffer of the frames
         self.buffer = BufferQueue()
+        # combine the packets into frames
+        self.reassembler = Reassembler()
+        # composite the tiles if the server sends only the changed tiles
+        self.tileDecoder = TileDecoder()
+
+        # present each frame at its time, the frames sent ahead are buffered
+        self.playout = PlayoutClock()
+        # seconds each frame is presented at 1x
+        self.frameInterval = 0.04
 
         # callback function to update the label
         self.displayCallback = None
@@ -47,52 +59,42 @@ class VideoClientRtp(ClientRtp):
         """
         Receive RTP packet from server, combine into frames, and save them in the buffer
         """
+        rtpPacket = RtpPacket()
         while self._stopper.is_set():
-            rtpPacket = RtpPacket()
-            byteStream = BytesIO(b'')
-            lastFrameNbr = -1
-            packetBuffer = BufferQueue()
-            while True:
-                try:
-                    data = self.socket.recv(BUF_SIZE)
-                    if not data:
-                        break
-                    rtpPacket.decode(data)
-                    marker = rtpPacket.marker()
-                    currentSeqNbr = rtpPacket.seqNum()
-
-                    lastFrameNbr = rtpPacket.timestamp()
-                    byte = rtpPacket.getPayload()
-                    # put payloads in buffer, it's more robust when the packets are out of order
-                    packetBuffer.put(currentSeqNbr, byte)
-
-                    # marker == 1 means it's the last packet of the frame
-                    if marker == 1:
-                        while True:
-                            seq, byte = packetBuffer.get()
-                            if byte is None:
-                                break
-                            byteStream.write(byte)
-                        break
-                except IOError:
+            try:
+                data = self.socket.recv(BUF_SIZE)
+                if not data:
                     continue
-                except AttributeError:
-                    break
-            # get the frame from the bytes stream
-            frame = self.decode(byteStream)
-            byteStream.close()
-            if lastFrameNbr == -1:
+                rtpPacket.decode(data)
+            except IOError:
+                continue
+            except AttributeError:
+                break
+            if not self.acceptEpoch(Reassembler.getEpoch(rtpPacket.getPayload())):
+                # sent before repositioned
+                continue
+            frameNbr = rtpPacket.timestamp()
+            # place the fragment by its offset, it's robust when the packets are out of order
+            data = self.reassembler.put(frameNbr, rtpPacket.getPayload())
+            if data is None:
                 continue
-            self.buffer.put(lastFrameNbr, frame)
+            frame = self.decode(data, rtpPacket.payloadType())
+            self.buffer.put(self.getSeq(frameNbr), frame)
 
-    def decode(self, byteStream):
+    def decode(self, data, payloadType):
         """
-        Decode from the byte stream
-        :param byteStream: raw byte stream of the frame
+        Decode the frame
+        :param data: bytes of the frame
+        :param payloadType: RTP payload type, .jpg or tiles
         :return: ImageTk.PhotoImage
         """
         try:
-            frame = Image.open(byteStream)
+            if payloadType == TILE_PAYLOAD_TYPE:
+                frame = self.tileDecoder.decode(data)
+                if frame is None:
+                    return None
+            else:
+                frame = Image.open(BytesIO(data))
             # resize to the screen size
             if frame.size[1] != self.screenSize[1]:
                 frame = frame.resize(self.screenSize)
@@ -104,14 +106,24 @@ class VideoClientRtp(ClientRtp):
     def setDisplay(self, displayCallback):
         self.displayCallback = displayCallback
 
+    def setInterval(self, interval):
+        """
+        :param interval: seconds each frame is presented at 1x, the buffer is checked 4 times a frame
+        """
+        self.frameInterval = interval
+        super(VideoClientRtp, self).setInterval(interval / 4)
+
     def display(self):
         """
-        Get next frame in the buffer and display it
+        Display the frames due in the buffer
         """
-        seq, frame = self.buffer.get()
-        if frame is not None:
-            self.lastFrameNbr = seq
-            self.displayCallback(frame)
+        # seconds of each frame number at the speed
+        unit = self.frameInterval / abs(self.speedFactor)
+        while self._stopper.is_set() and self.playout.poll(self.buffer, unit) == 0:
+            seq, frame = self.buffer.get()
+            if frame is not None:
+                self.lastFrameNbr = abs(seq)
+                self.displayCallback(frame)
 
     def getPosition(self):
         """
@@ -130,6 +142,13 @@ class VideoClientRtp(ClientRtp):
 
     def clearBuffer(self):
         """
-        Clear the buffer
+        Clear the buffer, and buffer again before displaying
         """
         self.buffer.clear()
+        self.playout.reset()
+
+    def getStats(self):
+        """
+        Time to first frame and the stalls of the playout
+        """
+        return {'video.{}'.format(key): value for key, value in self.playout.getStats().items()}
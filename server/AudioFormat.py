@@ -0,0 +1,208 @@
+import struct
+import zlib
+import numpy as np
+
+# sample types can be sent, little endian
+SAMPLES = {
+    'f32': '<f4',
+    's16': '<i2'
+}
+# the rate can be divided by them
+DECIMATIONS = (1, 2, 4)
+# flags before each chunk
+FLAGS = struct.Struct('!B')
+# the chunk is compressed by zlib
+COMPRESSED = 0x01
+# the chunk is silent, only n samples are sent
+SILENT = 0x02
+# n samples of each channel of the silent chunk
+SILENCE = struct.Struct('!I')
+# chunks quieter than it are sent as silent, dBFS of the RMS, 0 to send all
+DEFAULT_SILENCE = -60
+# level of zlib, fast enough to compress each chunk
+ZLIB_LEVEL = 1
+
+
+class AudioFormat:
+    """
+    Payload format of the audio chunks, negotiated in SETUP: the sample type, n channels, the rate
+    and whether it's compressed, written as 'sample/channels/rate[/zlib]', e.g. 's16/1/22050/zlib'.
+
+    Each chunk is sent as [FLAGS][samples interleaved, compressed if flagged],
+    or [FLAGS][SILENCE] if it's silent, the client fills it with zeros
+    """
+
+    def __init__(self, fs, sample='f32', channels=2, decimation=1, compression=False):
+        """
+        :param fs: rate of the decoded audio
+        :param sample: 'f32' or 's16'
+        :param channels: 2, or 1 to downmix
+        :param decimation: the rate is fs / decimation
+        :param compression: whether to compress by zlib
+        """
+        self.fs = fs
+        self.sample = sample
+        self.channels = channels
+        self.decimation = decimation
+        self.compression = compression
+
+        # RMS of the silent chunks, 0 to send all
+        self.silence = 0
+        self.silentChunks = 0
+
+        # bytes before and after encoding, to know the ratio
+        self.rawBytes = 0
+        self.sentBytes = 0
+
+    def __str__(self):
+        text = '{}/{}/{}'.format(self.sample, self.channels, self.getRate())
+        if self.compression:
+            text = text + '/zlib'
+        return text
+
+    def getRate(self):
+        return self.fs // self.decimation
+
+    def setSilence(self, dbfs):
+        """
+        :param dbfs: chunks quieter than it are sent as silent, 0 to send all
+        """
+        self.silence = 10 ** (dbfs / 20) if dbfs < 0 else 0
+
+    @staticmethod
+    def describe(fs):
+        """
+        The formats can be chosen from
+        :param fs: rate of the decoded audio
+        :return: { key: 'value,...' } of the description of the audio
+        """
+        return {
+            'samples': ','.join(SAMPLES.keys()),
+            'channels': '2,1',
+            'rates': ','.join(str(fs // d) for d in DECIMATIONS if fs % d == 0),
+            'compression': 'zlib'
+        }
+
+    @staticmethod
+    def parse(text, fs):
+        """
+        :param text: 'sample/channels/rate[/zlib]', None for the raw float32 stereo
+        :param fs: rate of the decoded audio
+        :return: AudioFormat
+        """
+        if not text:
+            return AudioFormat(fs)
+        fields = text.strip().split('/')
+        if len(fields) not in (3, 4):
+            raise ValueError('Invalid audio format: {}'.format(text))
+        sample, channels, rate = fields[0], int(fields[1]), int(fields[2])
+        if sample not in SAMPLES.keys():
+            raise ValueError('Unsupported sample type: {}'.format(sample))
+        if channels not in (1, 2):
+            raise ValueError('Unsupported n channels: {}'.format(channels))
+        if rate <= 0 or fs % rate != 0 or fs // rate not in DECIMATIONS:
+            raise ValueError('Unsupported rate: {}'.format(rate))
+        compression = len(fields) == 4
+        if compression and fields[3] != 'zlib':
+            raise ValueError('Unsupported compression: {}'.format(fields[3]))
+        return AudioFormat(fs, sample, channels, fs // rate, compression)
+
+    def encode(self, chunk, start=0):
+        """
+        :param chunk: float32 array of (n, 2)
+        :param start: index of the first sample of the chunk in the audio
+        :return: bytes of the payload
+        """
+        self.rawBytes += chunk.nbytes
+        if self.decimation > 1:
+            chunk = self.decimate(chunk, start)
+        if self.channels == 1:
+            chunk = chunk.mean(axis=1)
+        if self.silence > 0 and np.sqrt(np.mean(np.square(chunk))) < self.silence:
+            self.silentChunks += 1
+            payload = FLAGS.pack(SILENT) + SILENCE.pack(len(chunk))
+            self.sentBytes += len(payload)
+            return payload
+        if self.sample == 's16':
+            chunk = (np.clip(chunk, -1, 1) * 32767).astype(SAMPLES['s16'])
+        else:
+            chunk = chunk.astype(SAMPLES['f32'], copy=False)
+        data = chunk.tobytes()
+
+        flags = 0
+        if self.compression:
+            compressed = zlib.compress(data, ZLIB_LEVEL)
+            # not for the noise, which can't be compressed
+            if len(compressed) < len(data):
+                data = compressed
+                flags |= COMPRESSED
+        payload = FLAGS.pack(flags) + data
+        self.sentBytes += len(payload)
+        return payload
+
+    def decimate(self, chunk, start):
+        """
+        Average each group of samples, a low-pass filter as well.
+        The groups are aligned to the start of the audio rather than of the chunk, so the chunks add up to
+        fs / decimation whatever their size: the samples before the first group of the chunk are in the last group
+        of the chunk before, which is averaged as far as that chunk goes
+        :param chunk: float32 array of (n, 2)
+        :param start: index of the first sample of the chunk in the audio
+        :return: float32 array of (n groups starting in the chunk, 2)
+        """
+        d = self.decimation
+        chunk = chunk[(-start) % d:]
+        n = len(chunk) // d * d
+        groups = chunk[:n].reshape(-1, d, chunk.shape[1]).mean(axis=1)
+        if n < len(chunk):
+            groups = np.concatenate([groups, chunk[n:].mean(axis=0, keepdims=True)])
+        return groups
+
+    def getStats(self):
+        """
+        The format, the ratio of the bytes sent to the raw float32 stereo, and n silent chunks
+        """
+        return {
+            'format': str(self),
+            'format.ratio': round(self.sentBytes / self.rawBytes, 3) if self.rawBytes else 0,
+            'format.silent': self.silentChunks
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    def benchmark(fs, seconds, fps, silence):
+        """
+        Bytes per second and the time to encode each chunk of each format, on a tone with noise and pauses
+        """
+        t = np.arange(int(fs * seconds)) / fs
+        tone = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * np.random.randn(len(t))
+        # silent for half of each second, like a talk
+        tone[t % 1 >= 0.5] = 0.0001 * np.random.randn(np.count_nonzero(t % 1 >= 0.5))
+        audio = np.stack([tone, np.roll(tone, 50)], axis=1).astype(np.float32)
+        chunkSize = int(fs / fps)
+        for text in ['f32/2/{}'.format(fs), 's16/2/{}'.format(fs), 's16/2/{}/zlib'.format(fs),
+                     's16/1/{}'.format(fs // 2), 's16/1/{}/zlib'.format(fs // 4)]:
+            audioFormat = AudioFormat.parse(text, fs)
+            audioFormat.setSilence(silence)
+            start = time.process_time()
+            sent = 0
+            for i in range(0, len(audio) - chunkSize + 1, chunkSize):
+                sent += len(audioFormat.encode(audio[i:i + chunkSize], i))
+            elapsed = time.process_time() - start
+            print('{:>18}: {:.0f} KB/s, {:.1f}x smaller, {:.3f} ms/chunk'.format(
+                text, sent / seconds / 1024, audio.nbytes / sent, elapsed / (len(audio) / chunkSize) * 1000))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fs', type=int, default=44100)
+    parser.add_argument('--seconds', type=float, default=10)
+    # chunks per second, the frame rate of the video
+    parser.add_argument('--fps', type=float, default=25)
+    # dBFS, 0 to send the silent chunks as well
+    parser.add_argument('--silence', type=float, default=DEFAULT_SILENCE)
+
+    args = vars(parser.parse_args())
+
+    benchmark(args['fs'], args['seconds'], args['fps'], args['silence'])
@@ -1,11 +1,17 @@
-from io import BytesIO
+import math
 import numpy as np
-import threading
 
 from server.ServerRtp import ServerRtp
-from server.RtpPacket import RtpPacket
+from server.Packetizer import Packetizer
+from server.AudioFormat import AudioFormat
+from server.EncodePipeline import EncodePipeline
 
-BUF_SIZE = 16386
+# RTP payload type of the raw audio
+PAYLOAD_TYPE = 35
+# ms of audio in each chunk, 0 for one frame of the video
+DEFAULT_PTIME = 0
+# n chunks can be prepared ahead, each is encoded in no time
+DEPTH = 2
 
 
 class AudioServerRtp(ServerRtp):
@@ -13,11 +19,13 @@ class AudioServerRtp(ServerRtp):
     RTP audio stream controller
     """
 
-    def __init__(self, addr, *args, **kwargs):
-        super(AudioServerRtp, self).__init__(addr, *args, **kwargs)
+    def __init__(self, addr, scheduler):
+        super(AudioServerRtp, self).__init__(addr, scheduler)
 
         # the audio itself
         self.audio = None
+        # the audio decoded into PCM, sliced rather than decoding each chunk, None if not built yet
+        self.pcm = None
 
         # size of each chunk
         self.chunkSize = 0  # n frames
@@ -26,107 +34,107 @@ class AudioServerRtp(ServerRtp):
         # length of each chunk
         self.chunkLength = 0  # Seconds
 
-        # index of current chunk to be sent
+        # position of current chunk to be sent, in chunks, fractional if not 1x
         self.currentChunk = 0
         # total number of chunks
         self.totalChunks = 0
+        # the chunk last sent
+        self.sentChunk = -1
 
-        # packet seq
-        self.currentSeq = 1
+        # payload format of the chunks
+        self.format = None
 
-        # used to control each threads
-        self.bufferSemaphore = None
-        self.sendSemaphore = None
+        # divide the chunks into packets
+        self.packetizer = Packetizer(PAYLOAD_TYPE)
+        # encoded chunks to send, not queued behind the frames
+        self.pipeline = EncodePipeline(scheduler.executor, DEPTH)
+        self.urgent = True
 
-        # encoded chunk
-        self.encodeChunk = None
-
-    def sendCondition(self):
-        """
-        Send until meet the end of the audio
-        :return:
-        """
-        return self.currentChunk < self.totalChunks
-
-    def beforeRun(self):
+    def fill(self):
         """
-        Init the semaphore, and start the encode thread
-        :return:
+        Encode next chunk
         """
-        self.bufferSemaphore = threading.Semaphore(value=1)
-        self.sendSemaphore = threading.Semaphore(value=0)
-        threading.Thread(target=self.encode).start()
+        with self.positionLock:
+            generation = self.pipeline.generation
+            position = self.currentChunk
+        if position < 0:
+            # meet the start in reverse, wait until repositioned or the speed is changed
+            self.exhausted = generation
+            return
+        if position >= self.totalChunks:
+            # meet the end, wait until repositioned
+            self.pipeline.put(generation, None, None)
+            self.exhausted = generation
+            return
+        index = math.floor(position)
+        chunk = self.getCurrentChunkContent(index)
+        if self.speedFactor < 0:
+            # play the samples backward
+            chunk = chunk[::-1]
+        # trans into the payload format, decimated by the samples from the start of the audio
+        chunk = self.format.encode(chunk, self.chunkSize * index)
+        # skip or repeat the chunks if not 1x, each chunk is still presented for its length
+        if not self.pipeline.put(generation, index, self.pipeline.done(chunk), self.chunkLength):
+            return
+        with self.positionLock:
+            if generation == self.pipeline.generation:
+                self.currentChunk = position + self.speedFactor
 
-    def running(self):
+    def isDroppable(self):
         """
-        Start to send data
+        Never drop the audio, catch up if late
         """
-        self.sendData()
+        return False
 
-    def encode(self):
-        """
-        Encode next chunk
-        """
-        while self.sendCondition() and self._stopper.is_set():
-            # get next chunk and trans into bytes
-            chunk = self.getCurrentChunkContent().tobytes()
-            # skip 1 chunk if double speed
-            self.currentChunk += 1 if not self.doubleSpeed else 2
-            self.bufferSemaphore.acquire()
-            self.encodeChunk = chunk
-            self.sendSemaphore.release()
+    def onSend(self, index):
+        self.sentChunk = index
 
-    def sendData(self):
-        """
-        Send the encoded chunk to the client
-        """
-        if self.socket is None:
-            return
-        self.sendSemaphore.acquire()
-        chunk = self.encodeChunk
-        self.bufferSemaphore.release()
-
-        byteStream = BytesIO(chunk)
-        totalBytes = len(chunk)
-        sendBytes = 0
-
-        # divide into packets
-        packet = RtpPacket()
-        while sendBytes < totalBytes:
-            sendBytes += BUF_SIZE
-            # whether it is the last packet
-            marker = 0 if sendBytes < totalBytes else 1
-            bytesToSend = byteStream.read(BUF_SIZE)
-            packet.encode(2, 0, 0, 0, self.currentSeq, marker, 35, self.ssrc, bytesToSend)
-            packet.setTimestamp(self.currentChunk)
-            self.currentSeq += 1
-            self.socket.sendto(packet.getPacket(), (self.clientAddr, self.clientPort))
-        byteStream.close()
-
-    def setAudio(self, audio, audioLength, fs):
+    def setAudio(self, audio, fs, audioLength, ptime):
         """
         Set the audio to be sent
-        :param audio: audio itself
+        :param audio: audio itself, None if read from the PCM
+        :param fs: framerate of the audio
         :param audioLength: seconds
-        :param fs: the framerate of the video
+        :param ptime: ms of audio in each chunk, short for low latency, long for less packets
         """
-        self.setInterval(1 / fs / 1.5)
         # seconds
-        self.chunkLength = 1 / fs
+        self.chunkLength = ptime / 1000
+        self.setInterval(self.chunkLength)
         self.audio = audio
-        self.fs = audio.fps
+        self.fs = fs
         # n frames
         self.chunkSize = int(self.fs * self.chunkLength)
         self.totalChunks = int(audioLength / self.chunkLength)
+        self.format = AudioFormat(self.fs)
+
+    def setFormat(self, audioFormat):
+        """
+        Set the payload format negotiated
+        :param audioFormat: AudioFormat
+        """
+        self.format = audioFormat
+
+    def setPcm(self, pcm):
+        """
+        Read the chunks from the decoded PCM, used since next chunk
+        :param pcm: PcmCache
+        """
+        if pcm.fs == self.fs:
+            self.pcm = pcm
 
-    def getCurrentChunkContent(self):
+    def getCurrentChunkContent(self, index):
         """
         Get the chunk content
+        :param index: n chunks from the start
         """
+        pcm = self.pcm
+        if pcm is not None:
+            return pcm.getChunk(self.chunkSize * index, self.chunkSize)
+        # decode it from the clip, until the PCM is built
         # allocate space
         chunk = np.zeros((self.chunkSize, 2), dtype=np.float32)
         # start position
-        start = self.chunkSize * self.currentChunk / self.fs  # Unit: seconds
+        start = self.chunkSize * index / self.fs  # Unit: seconds
         # get the sub clip
         subClip = self.audio.subclip(start, start + self.interval)
         # read each frames in the sub clip
@@ -136,12 +144,27 @@ class AudioServerRtp(ServerRtp):
             chunk[index] = c
         return chunk
 
+    def getStats(self):
+        """
+        Error of the pacing, and the payload format
+        """
+        stats = super(AudioServerRtp, self).getStats()
+        stats.update(self.format.getStats())
+        return {'audio.{}'.format(key): value for key, value in stats.items()}
+
     def setPosition(self, pos):
         """
         Set the position to get next chunk
         :param pos: .%
         """
-        self.currentChunk = int(self.totalChunks * pos / 1000)
+        self.moveTo(int(self.totalChunks * pos / 1000))
+
+    def setTime(self, seconds):
+        """
+        Set the position to get next chunk, used to follow the position the video is repositioned at
+        :param seconds: presentation time
+        """
+        self.moveTo(min(int(seconds / self.chunkLength), self.totalChunks))
 
     def align(self, align):
         """
@@ -149,4 +172,30 @@ class AudioServerRtp(ServerRtp):
         :param align: seconds
         """
         deltaChunk = int(align / self.chunkLength)
-        self.currentChunk += deltaChunk
+        # from the chunks not prepared yet
+        with self.positionLock:
+            self.currentChunk += deltaChunk
+
+    def speed(self, speed):
+        """
+        Change the speed from the chunk next to the one last sent, the chunks prepared at the old speed are discarded
+        :param speed: speed factor, negative for reverse
+        """
+        super(AudioServerRtp, self).speed(speed)
+        with self.positionLock:
+            if self.sentChunk >= 0:
+                self.currentChunk = self.sentChunk + math.copysign(1, self.speedFactor)
+            self.flush()
+        self.wakeUp()
+
+    def moveTo(self, chunk):
+        """
+        Get next chunk from there, the chunks prepared are discarded
+        :param chunk: n chunks from the start
+        """
+        with self.positionLock:
+            self.currentChunk = chunk
+            self.sentChunk = -1
+            self.flush()
+        self.clock.reset()
+        self.wakeUp()
@@ -0,0 +1,215 @@
+import os
+import time
+import sqlite3
+import cv2
+import sys; sys.path.append('..')
+
+from server.FrameStore import PACKAGE_DIR
+from server.SearchEngine import VALID_EXTENSION
+from server.SeekIndex import SeekIndex
+
+# seconds between the refreshes
+REFRESH_INTERVAL = 30
+
+# columns of the metadata, after the filename
+COLUMNS = ['size', 'mtime', 'framerate', 'frames', 'duration', 'width', 'height', 'audio_rate']
+
+
+class Catalog:
+    """
+    Metadata of the videos in the working dir, persisted in SQLite in PACKAGE_DIR and refreshed in the background,
+    so that DESCRIBE is a lookup rather than opening the video and the audio
+    """
+
+    def __init__(self, videoDir):
+        # where are the videos
+        self.videoDir = videoDir
+        self.path = os.path.join(videoDir, PACKAGE_DIR, 'catalog.db')
+
+    def connect(self):
+        """
+        Connect to the database, a connection per call, so that it can be used after fork
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        # readers are not blocked by the refresh
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS media (filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+            'framerate REAL, frames INTEGER, duration REAL, width INTEGER, height INTEGER, audio_rate INTEGER)'
+        )
+        return conn
+
+    def get(self, filename):
+        """
+        :return: { column: value } of the video, None if not in the catalog or changed since
+        """
+        try:
+            stat = os.stat(os.path.join(self.videoDir, filename))
+        except OSError:
+            return None
+        if not os.path.exists(self.path):
+            return None
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            row = conn.execute(
+                'SELECT {} FROM media WHERE filename = ?'.format(', '.join(COLUMNS)), (filename,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # no table yet
+            row = None
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        media = dict(zip(COLUMNS, row))
+        if media['size'] != stat.st_size or media['mtime'] != stat.st_mtime:
+            return None
+        return media
+
+    def put(self, filename, media):
+        """
+        :param media: { column: value } of the video
+        """
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO media (filename, {}) VALUES (?{})'.format(
+                        ', '.join(COLUMNS), ', ?' * len(COLUMNS)
+                    ),
+                    [filename] + [media[column] for column in COLUMNS]
+                )
+        finally:
+            conn.close()
+
+    def lookup(self, filename):
+        """
+        Get the metadata of the video, probe and add it if not in the catalog
+        :return: { column: value }
+        """
+        media = self.get(filename)
+        if media is None:
+            media = Catalog.probe(self.videoDir, filename)
+            self.put(filename, media)
+        return media
+
+    def refresh(self):
+        """
+        Probe the videos added or changed since last refresh, and remove the ones deleted
+        :return: n videos probed
+        """
+        files = {}
+        for filename in os.listdir(self.videoDir):
+            if filename.split('.')[-1] not in VALID_EXTENSION:
+                continue
+            stat = os.stat(os.path.join(self.videoDir, filename))
+            files[filename] = (stat.st_size, stat.st_mtime)
+
+        conn = self.connect()
+        try:
+            known = {row[0]: (row[1], row[2]) for row in conn.execute('SELECT filename, size, mtime FROM media')}
+            with conn:
+                conn.executemany(
+                    'DELETE FROM media WHERE filename = ?',
+                    [(filename,) for filename in known.keys() if filename not in files.keys()]
+                )
+        finally:
+            conn.close()
+
+        probed = 0
+        for filename, stat in sorted(files.items()):
+            try:
+                self.buildSeekIndex(filename)
+            except Exception as e:
+                print('Failed to index {}: {}'.format(filename, e))
+            if known.get(filename) == stat:
+                continue
+            try:
+                self.put(filename, Catalog.probe(self.videoDir, filename))
+                probed += 1
+            except Exception as e:
+                print('Failed to probe {}: {}'.format(filename, e))
+        return probed
+
+    def buildSeekIndex(self, filename):
+        """
+        Build the seek index of the video if it's not built or older than the video, by the packets without decoding,
+        so that fast forward sends only the keyframes, even if the video is not packaged
+        :return: whether built
+        """
+        path = SeekIndex.getPath(self.videoDir, filename)
+        videoPath = os.path.join(self.videoDir, filename)
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(videoPath):
+            return False
+        seekIndex = SeekIndex.buildByCapture(videoPath)
+        if seekIndex is None:
+            return False
+        seekIndex.save(path)
+        return True
+
+    def watch(self, interval=REFRESH_INTERVAL):
+        """
+        Refresh the catalog periodically, run in a process of its own
+        """
+        while True:
+            probed = self.refresh()
+            if probed > 0:
+                print('Catalog: {} videos probed'.format(probed))
+            time.sleep(interval)
+
+    @staticmethod
+    def probe(videoDir, filename):
+        """
+        Open the video and the audio to get the metadata
+        :return: { column: value }
+        """
+        path = os.path.join(videoDir, filename)
+        # raises OSError at once if the video is missing
+        stat = os.stat(path)
+        from moviepy.editor import AudioFileClip
+
+        cap = cv2.VideoCapture(path)
+        framerate = cap.get(cv2.CAP_PROP_FPS)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        try:
+            # the rate the audio is decoded at
+            audioClip = AudioFileClip(path)
+            audioRate = int(audioClip.fps)
+            audioClip.close()
+        except (OSError, KeyError, AttributeError):
+            # no audio track
+            audioRate = 0
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'framerate': framerate,
+            'frames': frames,
+            'duration': frames / framerate if framerate > 0 else 0,
+            'width': width,
+            'height': height,
+            'audio_rate': audioRate
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', type=str, default='../../movies/')
+    parser.add_argument('--n', type=int, default=1000)
+
+    args = vars(parser.parse_args())
+
+    catalog = Catalog(args['dir'])
+    start = time.perf_counter()
+    print('{} videos probed in {:.1f}s'.format(catalog.refresh(), time.perf_counter() - start))
+    filenames = sorted(filter(lambda x: x.split('.')[-1] in VALID_EXTENSION, os.listdir(args['dir'])))
+    if filenames:
+        start = time.perf_counter()
+        for i in range(args['n']):
+            catalog.get(filenames[i % len(filenames)])
+        print('lookup: {:.3f} ms'.format((time.perf_counter() - start) / args['n'] * 1000))
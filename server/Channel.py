@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import pickle
+import socket
+import threading
+import multiprocessing
+
+from server.ServerRtspController import ServerRtspController
+from server.RtpScheduler import RtpScheduler
+from server.Catalog import Catalog
+from server.PacingClock import DEFAULT_MAX_LATE
+
+# RTP port of the video of the first channel, the audio on it + 2, the next channel on it + 4
+DEFAULT_CHANNEL_PORT = 5004
+# n hops the packets sent to a multicast group can go
+MULTICAST_TTL = 16
+# payload format of the audio of the channels, the same for all the viewers
+CHANNEL_AUDIO_FORMAT = 's16/2/{}/zlib'
+# n threads of each channel to decode and encode
+CHANNEL_WORKERS = 2
+# seconds the viewers of a worker are kept without being renewed, e.g. after the worker died
+LEASE = 3.0
+# max bytes of a message of the viewers, e.g. the renewal of 2000 viewers of a worker
+MAX_MESSAGE = 64 * 1024
+
+
+class Channel:
+    """
+    A live channel of a video, read and encoded once and looped on a schedule by the wall clock, in a process of its own.
+    The packets are sent to a multicast group, or to each viewer from the same buffers,
+    so the server costs a stream per channel rather than per viewer.
+    Created by the supervisor before forking the workers, so that they can add and remove the viewers,
+    and the supervisor restarts it if died
+    """
+
+    def __init__(self, addr, videoDir, filename, port, group=None, options=None):
+        """
+        :param port: RTP port of the video, the audio on it + 2, of the group, or of the viewers
+        :param group: address of the multicast group, None to send to each viewer
+        :param options: options of the sessions, the command line arguments
+        """
+        self.addr = addr
+        self.videoDir = videoDir
+        self.filename = filename
+        self.port = port
+        self.group = group
+        self.options = options if options is not None else {}
+
+        media = Catalog(videoDir).lookup(filename)
+        # n frames and the frame rate of the video, and seconds of each loop
+        self.frames = media['frames']
+        self.framerate = media['framerate']
+        self.duration = self.frames / self.framerate
+        # payload format of the audio, None if the video has no audio
+        self.format = CHANNEL_AUDIO_FORMAT.format(media['audio_rate']) if media['audio_rate'] > 0 else None
+
+        # (kind, pid of the worker, [(addr, RTP port of the video)]) sent by the workers, read only by the channel,
+        # a datagram each, so the workers share it without a lock, and a worker died leaves no message half written,
+        # and the channel restarted reads on
+        self.reader, self.writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # sent from the event loops of the workers, never blocks them
+        self.writer.setblocking(False)
+        # n viewers of all the workers
+        self.viewers = multiprocessing.Value('i', 0)
+
+        self.process = None
+        # when the process is started
+        self.started = 0.0
+
+    def start(self):
+        """
+        Start to send the channel in its process
+        """
+        self.process = multiprocessing.Process(target=self.run, daemon=True)
+        self.process.start()
+        self.started = time.monotonic()
+
+    def send(self, kind, viewers):
+        """
+        Tell the channel the viewers of this worker, dropped if the channel is behind or restarting,
+        since the viewers are renewed in full soon after
+        :param kind: 'join', 'leave', or 'renew' for all of them
+        :param viewers: [(addr, RTP port of the video)], the audio on it + 2
+        """
+        try:
+            self.writer.send(pickle.dumps((kind, os.getpid(), viewers)))
+        except OSError:
+            # the buffer of the socket is full
+            pass
+
+    def join(self, addr, port):
+        """
+        Add a viewer, called by the workers
+        """
+        self.send('join', [(addr, port)])
+
+    def leave(self, addr, port):
+        self.send('leave', [(addr, port)])
+
+    def renew(self, viewers):
+        """
+        All the viewers of this worker, sent periodically, the ones of a worker not renewed for LEASE are dropped,
+        and the ones of the channel restarted are added again
+        """
+        self.send('renew', viewers)
+
+    def getTransport(self, port):
+        """
+        :param port: RTP port of the video of the viewer
+        :return: the Transport of SETUP, where the viewer receives the channel
+        """
+        if self.group is not None:
+            return 'RTP/UDP;multicast;destination={};port={}'.format(self.group, self.port)
+        return 'RTP/UDP;unicast;client_port={}'.format(port)
+
+    def getStats(self):
+        return {
+            'channel.viewers': self.viewers.value,
+            'channel.multicast': int(self.group is not None)
+        }
+
+    def run(self):
+        """
+        Send the channel, in its process, repositioned at the frame due by the schedule at the start of each loop
+        """
+        scheduler = RtpScheduler(CHANNEL_WORKERS)
+        # a session without a connection, sends the video and the audio to the destinations
+        session = ServerRtspController(None, None, self.addr, (self.addr, 0), self.videoDir, scheduler,
+                                       options=self.options)
+        session.getInfo(self.filename)
+        session.setup(self.format)
+        # the audio on the port + 2, if any
+        streams = [(rtp, offset) for rtp, offset in ((session.videoRtp, 0), (session.audioRtp, 2)) if rtp is not None]
+        # set if a stream fails, the process exits so that the supervisor restarts the channel
+        failed = threading.Event()
+
+        def onFailed(error):
+            print('Channel {} failed: {}'.format(self.filename, error))
+            failed.set()
+
+        for rtp, offset in streams:
+            rtp.setOnFailed(onFailed)
+            # sent in real time by the schedule, the lead sent ahead would be discarded by the viewers at each loop
+            rtp.setPacing(0, self.options.get('max_late', DEFAULT_MAX_LATE), 1.0)
+            if self.group is not None:
+                rtp.setClientInfo(self.group, self.port + offset)
+                rtp.setMulticast(MULTICAST_TTL)
+            else:
+                rtp.setDestinations([])
+        threading.Thread(target=self.serveMembers, args=(streams,), daemon=True).start()
+        print('Channel {} on {}'.format(self.filename, self.getTransport(self.port)))
+        while not failed.is_set():
+            # the frame due by the schedule of the wall clock, so it's the same after the channel is restarted,
+            # repositioned at exactly, rather than at the keyframe nearby
+            frame = min(int(time.time() % self.duration * self.framerate), self.frames - 1)
+            session.videoRtp.setFrame(frame)
+            reached = session.videoRtp.getTimestamp(frame)
+            if session.audioRtp is not None:
+                session.audioRtp.setTime(reached)
+            session.play(None)
+            # until the end of the loop from the frame reached
+            failed.wait(self.duration - reached)
+        sys.exit(1)
+
+    def serveMembers(self, streams):
+        """
+        Follow the viewers sent by the workers, and drop the ones of the workers not renewed for LEASE,
+        the destinations are only changed if not multicast
+        :param streams: [(ServerRtp, offset of its port)]
+        """
+        # { pid of the worker: (set of its viewers, when renewed) }
+        members = {}
+        current = set()
+        self.reader.settimeout(LEASE / 3)
+        while True:
+            try:
+                kind, worker, viewers = pickle.loads(self.reader.recv(MAX_MESSAGE))
+            except socket.timeout:
+                kind = None
+            except (pickle.UnpicklingError, EOFError):
+                # truncated, larger than MAX_MESSAGE
+                kind = None
+            if kind is not None:
+                joined, renewed = members.get(worker, (set(), time.monotonic()))
+                if kind == 'renew':
+                    joined, renewed = set(viewers), time.monotonic()
+                elif kind == 'join':
+                    joined = joined | set(viewers)
+                else:
+                    joined = joined - set(viewers)
+                members[worker] = (joined, renewed)
+            now = time.monotonic()
+            members = {worker: member for worker, member in members.items() if now - member[1] < LEASE}
+            viewers = set().union(*(joined for joined, _ in members.values()))
+            self.viewers.value = len(viewers)
+            if self.group is not None or viewers == current:
+                continue
+            current = viewers
+            for rtp, offset in streams:
+                rtp.setDestinations([(addr, port + offset) for addr, port in sorted(viewers)])
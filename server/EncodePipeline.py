@@ -0,0 +1,168 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+# n frames can be buffered
+DEFAULT_DEPTH = 8
+
+# stages to time
+DECODE = 'decode'
+ENCODE = 'encode'
+# time the sender waits for a frame
+STARVE = 'starve'
+
+
+class EncodePipeline:
+    """
+    A bounded queue of frames, the frames are decoded in order, encoded by the pool of threads shared by the sessions,
+    and got by the sender in the order of frame number, without blocking it.
+    The workers are threads, since OpenCV releases the GIL when resizing and encoding,
+    while passing the decoded frames to processes costs a copy of each raw frame
+    """
+
+    def __init__(self, executor, depth=DEFAULT_DEPTH):
+        """
+        :param executor: the pool to encode the frames, owned by the RtpScheduler
+        :param depth: n frames can be buffered
+        """
+        # (generation, frame number, Future of the encoded frame, presentation time), in the order of frame number
+        self.queue = collections.deque()
+        self.depth = depth
+        self.executor = executor
+
+        # increased when flushed, frames of the old generation are discarded
+        self.generation = 0
+        self.lock = threading.Lock()
+        # since when the sender waits for the frame at the head, None if not waiting
+        self.starving = None
+
+        # total seconds and count of each stage
+        self.time = {DECODE: 0.0, ENCODE: 0.0, STARVE: 0.0}
+        self.count = {DECODE: 0, ENCODE: 0, STARVE: 0}
+
+    def submit(self, encode, *args, executor=None):
+        """
+        Encode the frame by the workers
+        :param encode: function returns the encoded frame
+        :param executor: the pool to encode it, the one of the pipeline if None
+        :return: Future of the encoded frame
+        """
+        def timedEncode():
+            start = time.perf_counter()
+            data = encode(*args)
+            self.record(ENCODE, time.perf_counter() - start)
+            return data
+
+        return (executor if executor is not None else self.executor).submit(timedEncode)
+
+    @staticmethod
+    def done(data):
+        """
+        Wrap the frame that needs no encoding
+        :return: completed Future of the frame
+        """
+        future = Future()
+        future.set_result(data)
+        return future
+
+    @staticmethod
+    def then(future, fn):
+        """
+        Process the frame once it's encoded, without waiting for it
+        :param fn: function(encoded frame), returns the frame to send
+        :return: Future of the frame to send
+        """
+        chained = Future()
+
+        def apply(done):
+            try:
+                chained.set_result(fn(done.result()))
+            except Exception as e:
+                chained.set_exception(e)
+
+        future.add_done_callback(apply)
+        return chained
+
+    def isFull(self):
+        with self.lock:
+            return len(self.queue) >= self.depth
+
+    def put(self, generation, index, future, duration=0.0):
+        """
+        Put the frame into the queue, the caller checks isFull before reading it
+        :param generation: the generation when the frame is read
+        :param index: frame number, None for the end of the video
+        :param future: Future of the encoded frame
+        :param duration: seconds the frame is presented, until next frame
+        :return: whether the frame is put, False if flushed since it's read
+        """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            self.queue.append((generation, index, future, duration))
+            return True
+
+    def poll(self, callback=None):
+        """
+        Get next frame if it's encoded
+        :param callback: called when the frame at the head is encoded, if it's not yet
+        :return: (generation, frame number, encoded frame, presentation time),
+            (generation, None, None, 0.0) for the end of the video, None if not encoded yet
+        """
+        with self.lock:
+            if not self.queue:
+                if self.starving is None:
+                    self.starving = time.perf_counter()
+                return None
+            generation, index, future, duration = self.queue[0]
+            if future is not None and not future.done():
+                if self.starving is None:
+                    self.starving = time.perf_counter()
+                pending = future
+            else:
+                pending = None
+                self.queue.popleft()
+                if self.starving is not None:
+                    self.time[STARVE] += time.perf_counter() - self.starving
+                    self.starving = None
+                self.count[STARVE] += 1
+        if pending is not None:
+            if callback is not None:
+                pending.add_done_callback(lambda _: callback())
+            return None
+        data = future.result() if future is not None else None
+        return generation, index, data, duration
+
+    def flush(self):
+        """
+        Discard all the frames in the queue, used when reposition
+        :return: the new generation
+        """
+        with self.lock:
+            self.generation += 1
+            self.queue.clear()
+            self.starving = None
+            return self.generation
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.time[stage] += seconds
+            self.count[stage] += 1
+
+    def getStats(self):
+        """
+        Queue depth, and the average time of each stage
+        """
+        with self.lock:
+            stats = {'queue': len(self.queue)}
+            for stage in self.time.keys():
+                count = max(self.count[stage], 1)
+                stats['{}_ms'.format(stage)] = round(self.time[stage] / count * 1000, 3)
+            return stats
+
+    def close(self):
+        """
+        Discard the frames, the executor is shared and not shut down
+        """
+        self.flush()
@@ -0,0 +1,221 @@
+import os
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+# default size of each slot, frames larger than it are not cached
+SLOT_SIZE = 131072
+
+# slots of each set, a frame is looked up and evicted only in the set its key is hashed to
+WAYS = 8
+# n locks, each guards the sets hashed to it, so the workers rarely wait for each other
+LOCKS = 64
+# seconds to wait for the lock of a set, the cache is skipped if it takes longer
+LOCK_TIMEOUT = 0.05
+
+# counters of each lock saved after the slot table
+HITS = 0
+MISSES = 1
+EVICTIONS = 2
+CLOCK = 3
+N_COUNTERS = 4
+
+
+class FrameCache:
+    """
+    LRU cache of encoded frames in shared memory, keyed by (file, frame index, quality),
+    shared by the processes of all the sessions.
+    The slots are divided into sets of WAYS slots, each key is only in the set it's hashed to,
+    and the sets are guarded by LOCKS locks, so a lookup takes O(1) and locks only a part of the cache
+    """
+
+    def __init__(self, size, slotSize=SLOT_SIZE):
+        """
+        :param size: bytes of the frames in total
+        :param slotSize: max bytes of each frame
+        """
+        self.slotSize = slotSize
+        self.sets = max(size // slotSize // WAYS, 1)
+        self.slots = self.sets * WAYS
+
+        # encoded frames, one frame per slot
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slots * self.slotSize)
+        # key, length and last used time of each slot, the counters and the pid holding each lock
+        self.table = shared_memory.SharedMemory(
+            create=True, size=(self.slots * 3 + LOCKS * N_COUNTERS + LOCKS) * 8
+        )
+        self.locks = [multiprocessing.Lock() for _ in range(LOCKS)]
+
+        self.keys = None
+        self.lengths = None
+        self.lastUsed = None
+        self.counters = None
+        self.owners = None
+        self.attach()
+        self.keys[:] = 0
+        self.counters[:] = 0
+        self.owners[:] = 0
+
+    def attach(self):
+        """
+        View the slot table as arrays
+        """
+        table = np.ndarray((self.slots * 3 + LOCKS * N_COUNTERS + LOCKS,), dtype=np.int64, buffer=self.table.buf)
+        self.keys = table[:self.slots]
+        self.lengths = table[self.slots:self.slots * 2]
+        self.lastUsed = table[self.slots * 2:self.slots * 3]
+        end = self.slots * 3 + LOCKS * N_COUNTERS
+        self.counters = table[self.slots * 3:end].reshape(LOCKS, N_COUNTERS)
+        self.owners = table[end:]
+
+    def __getstate__(self):
+        return {
+            'slotSize': self.slotSize,
+            'sets': self.sets,
+            'memory': self.memory.name,
+            'table': self.table.name,
+            'locks': self.locks
+        }
+
+    def __setstate__(self, state):
+        """
+        Attach to the shared memory in another process
+        """
+        self.slotSize = state['slotSize']
+        self.sets = state['sets']
+        self.slots = self.sets * WAYS
+        self.memory = shared_memory.SharedMemory(name=state['memory'])
+        self.table = shared_memory.SharedMemory(name=state['table'])
+        self.locks = state['locks']
+        self.attach()
+
+    @staticmethod
+    def getKey(name, index, level):
+        """
+        Hash (file, frame index, quality) into a non-zero int64, 0 is for empty slot
+        """
+        digest = hashlib.blake2b('{}\0{}\0{}'.format(name, index, level).encode(), digest_size=8).digest()
+        key = int.from_bytes(digest, 'little', signed=True)
+        return key if key != 0 else 1
+
+    def locate(self, key):
+        """
+        :return: (first slot of the set of the key, index of the lock guarding the set)
+        """
+        index = key % self.sets
+        return index * WAYS, index % LOCKS
+
+    def acquire(self, lock):
+        """
+        Lock a part of the cache, the lock held by a process died is released on behalf of it
+        :param lock: index of the lock
+        :return: False if it's still held after LOCK_TIMEOUT, the cache is skipped
+        """
+        if not self.locks[lock].acquire(timeout=LOCK_TIMEOUT):
+            owner = int(self.owners[lock])
+            if owner == 0 or owner == os.getpid():
+                return False
+            try:
+                os.kill(owner, 0)
+                # held by a process alive
+                return False
+            except ProcessLookupError:
+                pass
+            try:
+                self.locks[lock].release()
+            except ValueError:
+                # released by another process already
+                pass
+            if not self.locks[lock].acquire(timeout=LOCK_TIMEOUT):
+                return False
+        self.owners[lock] = os.getpid()
+        return True
+
+    def release(self, lock):
+        self.owners[lock] = 0
+        self.locks[lock].release()
+
+    def get(self, name, index, level):
+        """
+        Get the encoded frame
+        :return: bytes, None if not cached
+        """
+        key = self.getKey(name, index, level)
+        first, lock = self.locate(key)
+        if not self.acquire(lock):
+            return None
+        try:
+            counters = self.counters[lock]
+            slot = np.flatnonzero(self.keys[first:first + WAYS] == key)
+            if len(slot) == 0:
+                counters[MISSES] += 1
+                return None
+            slot = first + slot[0]
+            counters[HITS] += 1
+            counters[CLOCK] += 1
+            self.lastUsed[slot] = counters[CLOCK]
+            start = slot * self.slotSize
+            # copy out, since the slot may be evicted later
+            return bytes(self.memory.buf[start:start + self.lengths[slot]])
+        finally:
+            self.release(lock)
+
+    def put(self, name, index, level, data):
+        """
+        Put the encoded frame into the cache, evict the least recently used one of its set if full
+        """
+        if len(data) > self.slotSize:
+            return
+        key = self.getKey(name, index, level)
+        first, lock = self.locate(key)
+        if not self.acquire(lock):
+            return
+        try:
+            keys = self.keys[first:first + WAYS]
+            if np.any(keys == key):
+                return
+            counters = self.counters[lock]
+            empty = np.flatnonzero(keys == 0)
+            if len(empty) > 0:
+                slot = first + empty[0]
+            else:
+                slot = first + np.argmin(self.lastUsed[first:first + WAYS])
+                counters[EVICTIONS] += 1
+            counters[CLOCK] += 1
+            # the key is set last, so a process died while writing leaves the slot empty
+            self.keys[slot] = 0
+            start = slot * self.slotSize
+            self.memory.buf[start:start + len(data)] = data
+            self.lengths[slot] = len(data)
+            self.lastUsed[slot] = counters[CLOCK]
+            self.keys[slot] = key
+        finally:
+            self.release(lock)
+
+    def getStats(self):
+        """
+        Hit / miss counters of the cache, read without the locks
+        """
+        counters = self.counters.sum(axis=0)
+        return {
+            'cache.hits': int(counters[HITS]),
+            'cache.misses': int(counters[MISSES]),
+            'cache.evictions': int(counters[EVICTIONS]),
+            'cache.entries': int(np.count_nonzero(self.keys)),
+            'cache.slots': self.slots
+        }
+
+    def close(self):
+        """
+        Release the shared memory, should be called by the creator only
+        """
+        self.keys = None
+        self.lengths = None
+        self.lastUsed = None
+        self.counters = None
+        self.owners = None
+        self.memory.close()
+        self.memory.unlink()
+        self.table.close()
+        self.table.unlink()
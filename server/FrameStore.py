@@ -0,0 +1,72 @@
+import os
+import mmap
+import numpy as np
+
+# where the packaged files are saved, relative to the video dir
+PACKAGE_DIR = '.package'
+
+
+class FrameStore:
+    """
+    Pre-encoded frames of a video at one rung of the quality ladder,
+    an append-only blob of .jpg frames plus an offset index, both memory-mapped
+    """
+
+    def __init__(self, blobPath, indexPath):
+        # offset of each frame in the blob, n frames + 1 entries
+        self.index = np.memmap(indexPath, dtype='<u8', mode='r')
+
+        self.file = open(blobPath, 'rb')
+        self.blob = None
+        if os.path.getsize(blobPath) > 0:
+            self.blob = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return max(len(self.index) - 1, 0)
+
+    def getFrame(self, index):
+        """
+        Get the encoded frame, without copy
+        :param index: frame number
+        :return: memoryview of the .jpg frame
+        """
+        start = int(self.index[index])
+        end = int(self.index[index + 1])
+        return memoryview(self.blob)[start:end]
+
+    def close(self):
+        if self.blob is not None:
+            self.blob.close()
+            self.blob = None
+        self.file.close()
+
+    @staticmethod
+    def getPath(videoDir, filename, rung):
+        """
+        Path of the blob and the index
+        :param rung: name of the rung of the quality ladder
+        :return: (blob path, index path)
+        """
+        prefix = os.path.join(videoDir, PACKAGE_DIR, '{}.{}'.format(filename, rung))
+        return prefix + '.jpg', prefix + '.idx'
+
+    @staticmethod
+    def isPackaged(videoDir, filename, rung):
+        """
+        Whether the package exists, and is newer than the video
+        """
+        blobPath, indexPath = FrameStore.getPath(videoDir, filename, rung)
+        if not os.path.exists(blobPath) or not os.path.exists(indexPath):
+            return False
+        videoTime = os.path.getmtime(os.path.join(videoDir, filename))
+        return os.path.getmtime(indexPath) >= videoTime
+
+    @staticmethod
+    def open(videoDir, filename, rung):
+        """
+        Open the package of the video
+        :return: FrameStore, None if not packaged
+        """
+        if not FrameStore.isPackaged(videoDir, filename, rung):
+            return None
+        return FrameStore(*FrameStore.getPath(videoDir, filename, rung))
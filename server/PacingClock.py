@@ -0,0 +1,115 @@
+import threading
+import time
+
+# seconds of media can be sent ahead of the presentation clock, the window filled at the start
+DEFAULT_LEAD = 2.0
+# the window is filled at up to n times real time, 0 for as fast as the shaper allows
+DEFAULT_BURST_SPEED = 4.0
+# a unit later than it (seconds) is dropped, if it can be dropped
+DEFAULT_MAX_LATE = 0.2
+# a unit later than it (seconds) is counted as late, rather than the error of waking up
+LATE_TOLERANCE = 0.005
+
+
+class PacingClock:
+    """
+    Presentation clock of a stream, based on the monotonic clock,
+    gives the deadline to send each unit (frame or chunk) of the stream.
+    After each start (play, reposition, speed change), the units are sent faster than real time
+    to fill the buffer of the client with the lead window, then at real time keeping that lead
+    """
+
+    def __init__(self, lead=DEFAULT_LEAD, maxLate=DEFAULT_MAX_LATE, burstSpeed=DEFAULT_BURST_SPEED,
+                 clock=time.monotonic):
+        """
+        :param lead: seconds of media can be sent ahead of the presentation clock
+        :param maxLate: a unit later than it (seconds) is dropped, if it can be dropped
+        :param burstSpeed: the lead is filled at up to n times real time, 0 for at once
+        :param clock: seconds, monotonic, replaced to simulate
+        """
+        self.lead = lead
+        self.maxLate = maxLate
+        self.burstSpeed = burstSpeed
+        self.clock = clock
+
+        # monotonic time the presentation starts, None if not started
+        self.start = None
+        # presentation time of next unit since start, seconds
+        self.position = 0.0
+
+        # n units checked, sent late, and dropped
+        self.sent = 0
+        self.late = 0
+        self.dropped = 0
+        # sum of |error| and the max late, seconds
+        self.totalError = 0.0
+        self.maxError = 0.0
+
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        Restart the presentation from next unit, used when resume, reposition or change speed
+        """
+        with self.lock:
+            self.start = None
+            self.position = 0.0
+
+    def getDelay(self):
+        """
+        :return: seconds to wait until the deadline of next unit, negative if late
+        """
+        with self.lock:
+            now = self.clock()
+            if self.start is None:
+                self.start = now
+            return self.start + self.getDeadline(self.position) - now
+
+    def getDeadline(self, position):
+        """
+        :param position: presentation time of the unit since start, seconds
+        :return: seconds since start the unit is due,
+            at burst speed until the lead is filled, then the lead ahead of real time
+        """
+        burst = position / self.burstSpeed if self.burstSpeed > 0 else 0.0
+        return max(burst, position - self.lead)
+
+    def check(self, droppable):
+        """
+        Record the error of next unit, and decide whether to send it
+        :param droppable: whether the unit can be dropped if it's too late
+        :return: False if it should be dropped
+        """
+        late = -self.getDelay()
+        with self.lock:
+            self.sent += 1
+            self.totalError += abs(late)
+            self.maxError = max(self.maxError, late)
+            if late <= LATE_TOLERANCE:
+                return True
+            self.late += 1
+            if droppable and late > self.maxLate:
+                self.dropped += 1
+                return False
+            # catch up by sending at once
+            return True
+
+    def advance(self, duration):
+        """
+        Move to next unit
+        :param duration: presentation time of the unit sent, seconds
+        """
+        with self.lock:
+            self.position += duration
+
+    def getStats(self):
+        """
+        Error of the deadlines
+        """
+        with self.lock:
+            return {
+                'error_ms': round(self.totalError / max(self.sent, 1) * 1000, 3),
+                'max_late_ms': round(self.maxError * 1000, 3),
+                'late': self.late,
+                'dropped': self.dropped
+            }
@@ -0,0 +1,126 @@
+import os
+import multiprocessing
+import cv2
+import numpy as np
+import sys; sys.path.append('..')
+
+from server.SearchEngine import VALID_EXTENSION
+from server.QualityLadder import QualityLadder, DEFAULT_LADDER
+from server.FrameStore import FrameStore, PACKAGE_DIR
+from server.SeekIndex import SeekIndex
+from server.SpriteSheet import SpriteSheet
+from server.PcmCache import PcmCache
+
+
+class Packager:
+    """
+    Pre-encode every video in the working dir into a frame-indexed .jpg store per rung of the quality ladder,
+    so that the server only needs a slice lookup for each frame, and build the seek index, the sprite sheet
+    and the decoded audio of it
+    """
+
+    def __init__(self, workingDir, workers, ladder):
+        # where are the videos
+        self.workingDir = workingDir
+        # the qualities to encode into
+        self.ladder = ladder
+        # n processes
+        self.workers = workers
+
+    def listFiles(self):
+        """
+        Find the videos which are not packaged yet
+        """
+        files = os.listdir(self.workingDir)
+        files = filter(lambda x: x.split('.')[-1] in VALID_EXTENSION, files)
+        return sorted(filter(lambda x: not self.isPackaged(x), files))
+
+    def isPackaged(self, filename):
+        for level in range(len(self.ladder)):
+            if not FrameStore.isPackaged(self.workingDir, filename, self.ladder.getName(level)):
+                return False
+        return os.path.exists(SeekIndex.getPath(self.workingDir, filename)) \
+            and os.path.exists(SpriteSheet.getPath(self.workingDir, filename))
+
+    def start(self):
+        """
+        Package the videos in a process pool
+        """
+        os.makedirs(os.path.join(self.workingDir, PACKAGE_DIR), exist_ok=True)
+        files = self.listFiles()
+        print('{} videos to package ...'.format(len(files)))
+
+        with multiprocessing.Pool(self.workers) as pool:
+            jobs = [(self.workingDir, filename, self.ladder) for filename in files]
+            for filename, length in pool.imap_unordered(Packager.packageFile, jobs):
+                print('{}: {} frames'.format(filename, length))
+
+    @staticmethod
+    def packageFile(job):
+        """
+        Decode the video once, and encode each frame into every rung of the ladder, and the thumbnails of it
+        :param job: (workingDir, filename, ladder)
+        :return: (filename, n frames)
+        """
+        workingDir, filename, ladder = job
+        seekIndex = SeekIndex.build(os.path.join(workingDir, filename))
+        if seekIndex is not None:
+            seekIndex.save(SeekIndex.getPath(workingDir, filename))
+
+        cap = cv2.VideoCapture(os.path.join(workingDir, filename))
+        fs = cap.get(cv2.CAP_PROP_FPS)
+        spriteSheet = SpriteSheet.create(fs, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        thumbnails = set(spriteSheet.getFrames(fs))
+
+        levels = range(len(ladder))
+        blobs = {}
+        offsets = {}
+        for level in levels:
+            blobPath, _ = FrameStore.getPath(workingDir, filename, ladder.getName(level))
+            blobs[level] = open(blobPath + '.tmp', 'wb')
+            offsets[level] = [0]
+
+        while True:
+            res, frame = cap.read()
+            if not res:
+                break
+            if len(offsets[0]) - 1 in thumbnails:
+                spriteSheet.add(frame)
+            for level in levels:
+                encode = cv2.imencode(
+                    '.jpg', cv2.resize(frame, ladder.getSize(level)),
+                    [cv2.IMWRITE_JPEG_QUALITY, ladder.getJpegQuality(level)]
+                )
+                data = encode[1].tobytes() if encode[0] else b''
+                blobs[level].write(data)
+                offsets[level].append(offsets[level][-1] + len(data))
+        cap.release()
+
+        for level in levels:
+            blobs[level].close()
+            blobPath, indexPath = FrameStore.getPath(workingDir, filename, ladder.getName(level))
+            np.array(offsets[level], dtype='<u8').tofile(indexPath + '.tmp')
+            # the index is written at last, it marks the package as completed
+            os.replace(blobPath + '.tmp', blobPath)
+            os.replace(indexPath + '.tmp', indexPath)
+        spriteSheet.save(SpriteSheet.getPath(workingDir, filename))
+        if not PcmCache.isBuilt(workingDir, filename):
+            try:
+                PcmCache.build(workingDir, filename)
+            except Exception:
+                # no audio track, decoded when played otherwise
+                pass
+        return filename, len(offsets[0]) - 1
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', type=str, default='../../movies/')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--ladder', type=str, default=DEFAULT_LADDER)
+
+    args = vars(parser.parse_args())
+
+    Packager(args['dir'], args['workers'], QualityLadder.parse(args['ladder'])).start()
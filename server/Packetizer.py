@@ -0,0 +1,148 @@
+import struct
+
+# version, marker and payload type, seq, timestamp, ssrc
+HEADER = struct.Struct('!BBHII')
+HEADER_SIZE = HEADER.size
+# in the spirit of RFC 2435, type specific (8 bits) and fragment offset (24 bits), total length of the unit,
+# the type specific bits are the epoch of the unit, increased when repositioned
+PAYLOAD_HEADER = struct.Struct('!II')
+PAYLOAD_HEADER_SIZE = PAYLOAD_HEADER.size
+
+RTP_VERSION = 2
+# max bytes of the RTP payload, so that each packet fits in an IPv4 / UDP datagram on a 1500 MTU
+DEFAULT_MAX_PAYLOAD = 1500 - 20 - 8 - HEADER_SIZE
+
+
+class Packetizer:
+    """
+    Divide the encoded frame into RTP packets without copying it,
+    the header and the payload of each packet are separate buffers, to be sent by sendmsg.
+    Each payload starts with the offset of the fragment in the frame and the length of the frame,
+    so that the client can place the fragments regardless of the order they arrive in
+    """
+
+    def __init__(self, payloadType, maxPayload=DEFAULT_MAX_PAYLOAD):
+        """
+        :param payloadType: RTP payload type
+        :param maxPayload: max bytes of the RTP payload of each packet, including the payload header
+        """
+        self.payloadType = payloadType
+        self.fragmentSize = 0
+        self.setMaxPayload(maxPayload)
+        self.ssrc = 0
+        # seq of next packet
+        self.seq = 1
+
+        # the RTP header and the payload header are filled in place for each packet
+        self.header = bytearray(HEADER_SIZE + PAYLOAD_HEADER_SIZE)
+        # [header, fragment] of current packet
+        self.buffers = [memoryview(self.header), None]
+
+    def setSsrc(self, ssrc):
+        self.ssrc = ssrc
+
+    def setMaxPayload(self, maxPayload):
+        """
+        :param maxPayload: max bytes of the RTP payload of each packet, including the payload header
+        """
+        if maxPayload <= PAYLOAD_HEADER_SIZE:
+            raise ValueError('Max payload should be larger than {} bytes'.format(PAYLOAD_HEADER_SIZE))
+        self.fragmentSize = maxPayload - PAYLOAD_HEADER_SIZE
+
+    def packets(self, data, timestamp, epoch=0):
+        """
+        Packets of the frame, the buffers are reused, valid until next packet
+        :param data: the encoded frame, less than 16 MB
+        :param timestamp: RTP timestamp of the frame
+        :param epoch: the client discards the packets of an older epoch, in flight when repositioned, mod 256
+        :return: generator of [header, fragment], both are memoryview
+        """
+        view = memoryview(data)
+        totalBytes = len(view)
+        for start in range(0, totalBytes, self.fragmentSize):
+            end = min(start + self.fragmentSize, totalBytes)
+            # whether it is the last packet
+            marker = 1 if end == totalBytes else 0
+            HEADER.pack_into(
+                self.header, 0,
+                RTP_VERSION << 6, (marker << 7) | self.payloadType,
+                self.seq & 0xFFFF, timestamp & 0xFFFFFFFF, self.ssrc & 0xFFFFFFFF
+            )
+            PAYLOAD_HEADER.pack_into(self.header, HEADER_SIZE, (epoch & 0xFF) << 24 | start & 0xFFFFFF, totalBytes)
+            self.seq += 1
+            self.buffers[1] = view[start:end]
+            yield self.buffers
+
+
+if __name__ == '__main__':
+    import argparse
+    import socket
+    import time
+    import tracemalloc
+    from io import BytesIO
+    import sys; sys.path.append('..')
+
+    from server.RtpPacket import RtpPacket
+
+    def sendByCopy(sock, addr, data, payloadSize, seq):
+        """
+        The way the frame was sent, copied by BytesIO, slices and header + payload
+        """
+        byteStream = BytesIO(data)
+        totalBytes = len(data)
+        sentBytes = 0
+        packet = RtpPacket()
+        while sentBytes < totalBytes:
+            sentBytes += payloadSize
+            marker = 0 if sentBytes < totalBytes else 1
+            packet.encode(2, 0, 0, 0, seq & 0xFFFF, marker, 26, 1, byteStream.read(payloadSize))
+            seq += 1
+            sock.sendto(packet.getPacket(), addr)
+        byteStream.close()
+        return seq
+
+    def sendByPacketizer(sock, addr, data, packetizer):
+        for packet in packetizer.packets(data, 0):
+            sock.sendmsg(packet, (), 0, addr)
+
+    def benchmark(frameSize, payloadSize, frames):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        addr = receiver.getsockname()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        data = bytes(frameSize)
+        packetizer = Packetizer(26, payloadSize)
+
+        # the payload of the packetizer also carries the payload header
+        methods = [
+            ('copy', -(-frameSize // payloadSize), lambda: sendByCopy(sock, addr, data, payloadSize, 1)),
+            ('packetizer', -(-frameSize // packetizer.fragmentSize),
+             lambda: sendByPacketizer(sock, addr, data, packetizer))
+        ]
+        for name, packetsPerFrame, send in methods:
+            start = time.perf_counter()
+            for _ in range(frames):
+                send()
+            seconds = time.perf_counter() - start
+
+            # peak bytes allocated when sending a frame
+            tracemalloc.start()
+            send()
+            tracemalloc.reset_peak()
+            send()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print('{}: {:.0f} packets/s, peak {} bytes allocated per frame'.format(
+                name, frames * packetsPerFrame / seconds, peak))
+        sock.close()
+        receiver.close()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frame', type=int, default=40000)
+    parser.add_argument('--payload', type=int, default=DEFAULT_MAX_PAYLOAD)
+    parser.add_argument('--frames', type=int, default=2000)
+
+    args = vars(parser.parse_args())
+
+    benchmark(args['frame'], args['payload'], args['frames'])
@@ -0,0 +1,174 @@
+import os
+import struct
+import time
+import numpy as np
+import sys; sys.path.append('..')
+
+from server.FrameStore import PACKAGE_DIR
+
+# magic, sample rate, n channels, followed by the interleaved float32 samples
+HEADER = struct.Struct('<4sII')
+MAGIC = b'PCM0'
+# the audio is always decoded into stereo
+CHANNELS = 2
+# seconds of audio decoded at once
+BUILD_CHUNK = 10
+# a temporary file older than it (seconds) is left by a failed build
+STALE = 600
+
+
+class PcmCache:
+    """
+    The audio track of a video decoded once into a float32 PCM file, read by memory map,
+    so that each chunk is a slice of it rather than decoded again
+    """
+
+    def __init__(self, path):
+        """
+        :param path: path of the PCM file
+        """
+        with open(path, 'rb') as f:
+            magic, self.fs, self.channels = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('Not a PCM file')
+        frames = (os.path.getsize(path) - HEADER.size) // (4 * self.channels)
+        self.samples = np.memmap(path, dtype='<f4', mode='r', offset=HEADER.size, shape=(frames, self.channels))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def getChunk(self, start, size):
+        """
+        :param start: first sample
+        :param size: n samples
+        :return: float32 array of (size, channels), padded with zeros after the end
+        """
+        chunk = self.samples[max(start, 0):max(start + size, 0)]
+        if len(chunk) == size:
+            return chunk
+        padded = np.zeros((size, self.channels), dtype=np.float32)
+        padded[:len(chunk)] = chunk
+        return padded
+
+    def close(self):
+        self.samples = None
+
+    @staticmethod
+    def getPath(videoDir, filename):
+        return os.path.join(videoDir, PACKAGE_DIR, '{}.pcm'.format(filename))
+
+    @staticmethod
+    def isBuilt(videoDir, filename):
+        """
+        Whether the PCM file is built and newer than the video
+        """
+        path = PcmCache.getPath(videoDir, filename)
+        if not os.path.exists(path):
+            return False
+        return os.path.getmtime(path) >= os.path.getmtime(os.path.join(videoDir, filename))
+
+    @staticmethod
+    def open(videoDir, filename):
+        """
+        :return: PcmCache, None if not built
+        """
+        if not PcmCache.isBuilt(videoDir, filename):
+            return None
+        return PcmCache(PcmCache.getPath(videoDir, filename))
+
+    @staticmethod
+    def build(videoDir, filename):
+        """
+        Decode the audio track of the video, skipped if another process is building it
+        :return: whether it's built
+        """
+        from moviepy.editor import AudioFileClip
+
+        os.makedirs(os.path.join(videoDir, PACKAGE_DIR), exist_ok=True)
+        path = PcmCache.getPath(videoDir, filename)
+        tmp = path + '.tmp'
+        if os.path.exists(tmp) and time.time() - os.path.getmtime(tmp) > STALE:
+            os.remove(tmp)
+        try:
+            # the temporary file marks that it's being built
+            fd = os.open(tmp, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        clip = None
+        try:
+            clip = AudioFileClip(os.path.join(videoDir, filename))
+            fs = int(clip.fps)
+            chunks = clip.iter_chunks(chunksize=fs * BUILD_CHUNK, fps=fs, quantize=False)
+            with os.fdopen(fd, 'wb') as f:
+                PcmCache.write(f, fs, chunks)
+            os.replace(tmp, path)
+            return True
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            if clip is not None:
+                clip.close()
+
+    @staticmethod
+    def write(f, fs, chunks):
+        """
+        Write the PCM file
+        :param f: file opened for writing
+        :param fs: sample rate
+        :param chunks: iterable of float arrays of (n, CHANNELS)
+        """
+        f.write(HEADER.pack(MAGIC, fs, CHANNELS))
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk, dtype='<f4').tobytes())
+
+
+if __name__ == '__main__':
+    import argparse
+    from moviepy.editor import AudioFileClip
+
+    def readBySubclip(clip, chunkSize, index):
+        """
+        The way the chunks were read, a subclip of each chunk, copied sample by sample
+        """
+        chunk = np.zeros((chunkSize, 2), dtype=np.float32)
+        start = chunkSize * index / clip.fps
+        subClip = clip.subclip(start, start + chunkSize / clip.fps)
+        for i, c in enumerate(subClip.iter_frames()):
+            if i >= chunkSize:
+                break
+            chunk[i] = c
+        return chunk
+
+    def benchmark(videoDir, filename, n, fps):
+        if not PcmCache.isBuilt(videoDir, filename):
+            start = time.perf_counter()
+            PcmCache.build(videoDir, filename)
+            print('built in {:.1f}s'.format(time.perf_counter() - start))
+        pcm = PcmCache.open(videoDir, filename)
+        clip = AudioFileClip(os.path.join(videoDir, filename))
+        chunkSize = int(clip.fps / fps)
+
+        start = time.process_time()
+        for index in range(n):
+            readBySubclip(clip, chunkSize, index).tobytes()
+        subclipTime = (time.process_time() - start) / n
+        start = time.process_time()
+        for index in range(n):
+            pcm.getChunk(index * chunkSize, chunkSize).tobytes()
+        pcmTime = (time.process_time() - start) / n
+        print('subclip: {:.3f} ms/chunk, memory map: {:.4f} ms/chunk, {:.0f}x'.format(
+            subclipTime * 1000, pcmTime * 1000, subclipTime / max(pcmTime, 1e-9)))
+        clip.close()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', type=str, default='../../movies/')
+    parser.add_argument('--file', type=str, required=True)
+    parser.add_argument('--n', type=int, default=200)
+    # chunks per second, the frame rate of the video
+    parser.add_argument('--fps', type=float, default=25)
+
+    args = vars(parser.parse_args())
+
+    benchmark(args['dir'], args['file'], args['n'], args['fps'])
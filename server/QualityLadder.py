@@ -0,0 +1,54 @@
+# rungs of the ladder from low to high, 'widthxheight@jpeg quality'
+DEFAULT_LADDER = '320x180@75,480x270@95,640x360@90,960x540@90,1280x720@90'
+
+
+class QualityLadder:
+    """
+    The resolutions and the .jpg qualities the video can be sent in
+    """
+
+    def __init__(self, rungs):
+        """
+        :param rungs: [(width, height, jpeg quality), ...], from low to high
+        """
+        self.rungs = list(rungs)
+
+    def __len__(self):
+        return len(self.rungs)
+
+    def getSize(self, level):
+        """
+        Size of each frame
+        :return: (width, height)
+        """
+        return self.rungs[level][:2]
+
+    def getJpegQuality(self, level):
+        return self.rungs[level][2]
+
+    def getName(self, level):
+        """
+        Name of the rung, used to identify the encoded frames
+        :return: 'widthxheight@jpeg quality'
+        """
+        return '{}x{}@{}'.format(*self.rungs[level])
+
+    def describe(self):
+        """
+        Describe all the rungs, in the same format as parsed
+        """
+        return ','.join(self.getName(level) for level in range(len(self.rungs)))
+
+    @staticmethod
+    def parse(text):
+        """
+        Parse the ladder
+        :param text: 'widthxheight@jpeg quality,...'
+        :return: QualityLadder
+        """
+        rungs = []
+        for rung in text.split(','):
+            size, quality = rung.strip().split('@')
+            width, height = size.split('x')
+            rungs.append((int(width), int(height), int(quality)))
+        return QualityLadder(rungs)
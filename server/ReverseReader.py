@@ -0,0 +1,198 @@
+import threading
+from collections import deque
+
+# bytes of the encoded frames kept for each session
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# n frames decoded back from the frame to play, if no seek index
+DEFAULT_GOP = 25
+# n frames being encoded at once
+MAX_PENDING = 8
+
+
+class ReverseReader:
+    """
+    Frames to play in reverse, the GOP of the frame is decoded forward from its keyframe at once,
+    and the encoded frames are kept until they are sent in reverse,
+    so that each frame is not decoded from the keyframe again.
+    The frames kept are bounded in bytes, the earliest ones are evicted, which are sent last
+    """
+
+    def __init__(self, maxBytes=DEFAULT_MAX_BYTES):
+        """
+        :param maxBytes: bytes of the encoded frames can be kept
+        """
+        self.maxBytes = maxBytes
+        # frame number -> encoded frame
+        self.frames = {}
+        self.bytes = 0
+        # level of the ladder the frames are encoded in
+        self.level = None
+
+        # n frames got from the kept ones, n GOPs decoded, n frames decoded, n frames evicted
+        self.hits = 0
+        self.gops = 0
+        self.decoded = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    def read(self, index, level, start, decode, encode):
+        """
+        Get the encoded frame
+        :param index: frame number
+        :param level: level of the ladder
+        :param start: frame number of the keyframe at or before the frame
+        :param decode: function(frame number), returns the decoded frame, None if failed
+        :param encode: function(frame, frame number), returns Future of the encoded frame
+        :return: encoded frame, None if failed
+        """
+        if level != self.level:
+            self.clear()
+            self.level = level
+        data = self.pop(index)
+        if data is not None:
+            with self.lock:
+                self.hits += 1
+            return data
+
+        # the frames kept are after the frame, they won't be sent
+        self.clear()
+        # decode the GOP forward until the frame, while the frames before are being encoded
+        pending = deque()
+        for i in range(start, index + 1):
+            frame = decode(i)
+            if frame is None:
+                break
+            pending.append((i, encode(frame, i)))
+            while len(pending) > MAX_PENDING:
+                self.keep(*pending.popleft())
+        while len(pending) > 0:
+            self.keep(*pending.popleft())
+        with self.lock:
+            self.gops += 1
+            self.decoded += index + 1 - start
+        return self.pop(index)
+
+    def keep(self, index, future):
+        """
+        Keep the encoded frame, evict the earliest ones if out of memory
+        """
+        data = future.result()
+        if data is None:
+            return
+        with self.lock:
+            self.frames[index] = data
+            self.bytes += len(data)
+            while self.bytes > self.maxBytes and len(self.frames) > 1:
+                earliest = min(self.frames.keys())
+                self.bytes -= len(self.frames.pop(earliest))
+                self.evicted += 1
+
+    def pop(self, index):
+        """
+        Get the frame kept and release it, each frame is sent once
+        """
+        with self.lock:
+            data = self.frames.pop(index, None)
+            if data is not None:
+                self.bytes -= len(data)
+            return data
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+    def getStats(self):
+        """
+        Hit rate of the frames kept, and the memory used
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'gops': self.gops,
+                'decoded': self.decoded,
+                'evicted': self.evicted,
+                'bytes': self.bytes
+            }
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import time
+    import cv2
+    from concurrent.futures import ThreadPoolExecutor
+    import sys; sys.path.append('..')
+
+    from server.SeekIndex import SeekIndex, BACKWARD
+
+    class Capture:
+        """
+        Decode the frames in order if possible, seek otherwise
+        """
+
+        def __init__(self, path):
+            self.cap = cv2.VideoCapture(path)
+            self.position = 0
+
+        def decode(self, index):
+            if index != self.position:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            res, frame = self.cap.read()
+            self.position = index + 1
+            return frame if res else None
+
+    def benchmark(path, seekIndex, n, size, maxBytes):
+        executor = ThreadPoolExecutor(max_workers=2)
+
+        def encodeFrame(frame, index):
+            return cv2.imencode('.jpg', cv2.resize(frame, size))[1].tobytes()
+
+        def encode(frame, index):
+            return executor.submit(encodeFrame, frame, index)
+
+        total = int(cv2.VideoCapture(path).get(cv2.CAP_PROP_FRAME_COUNT))
+        last = total - 1
+        frames = range(last, max(last - n, -1), -1)
+
+        # seek to each frame
+        capture = Capture(path)
+        start = time.perf_counter()
+        for index in frames:
+            encodeFrame(capture.decode(index), index)
+        seconds = time.perf_counter() - start
+        print('seek each frame: {:.1f} frames/s'.format(len(frames) / seconds))
+
+        # decode each GOP forward once
+        capture = Capture(path)
+        reader = ReverseReader(maxBytes)
+        peak = 0
+        start = time.perf_counter()
+        for index in frames:
+            if seekIndex is not None:
+                keyframe = seekIndex.getKeyframe(index, BACKWARD)
+            else:
+                keyframe = max(index - DEFAULT_GOP, 0)
+            reader.read(index, 0, keyframe, capture.decode, encode)
+            peak = max(peak, reader.bytes)
+        seconds = time.perf_counter() - start
+        print('reverse reader: {:.1f} frames/s, peak {} bytes kept, {}'.format(
+            len(frames) / seconds, peak, reader.getStats()))
+        executor.shutdown()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', type=str, default='../../movies/')
+    parser.add_argument('--file', type=str, required=True)
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--size', type=str, default='480x270')
+    # MB
+    parser.add_argument('--cache', type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024)
+
+    args = vars(parser.parse_args())
+
+    path = os.path.join(args['dir'], args['file'])
+    seekIndex = SeekIndex.open(args['dir'], args['file'])
+    if seekIndex is None:
+        seekIndex = SeekIndex.build(path)
+    width, height = args['size'].split('x')
+    benchmark(path, seekIndex, args['n'], (int(width), int(height)), args['cache'] * 1024 * 1024)
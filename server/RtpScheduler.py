@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# n threads of each worker process to decode and encode the frames and the chunks, shared by its sessions
+DEFAULT_WORKERS = 4
+
+
+class RtpScheduler:
+    """
+    Sends all the RTP streams of a worker process from one thread, each stream is stepped at its deadline,
+    by a heap ordered by the deadlines, and the frames and the chunks are prepared by a bounded pool of threads,
+    so that a session costs no thread of its own
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        """
+        :param workers: n threads to decode and encode, shared by the sessions
+        """
+        # (deadline, order, stream), the earliest first
+        self.heap = []
+        # the entry in the heap in effect of each stream, the others are stale
+        self.entries = {}
+        # breaks the ties of the deadlines, so the streams are never compared
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+
+        # decode and encode
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # the light work due soon, e.g. the audio chunks, not queued behind the frames
+        self.urgentExecutor = ThreadPoolExecutor(max_workers=1)
+        # encode the GOPs decoded to play in reverse, waited for by the threads of the pool, which would deadlock
+        # if they waited for the pool they run in
+        self.reverseExecutor = ThreadPoolExecutor(max_workers=workers)
+
+        # n streams stepped, and the total seconds they are stepped later than the deadline
+        self.steps = 0
+        self.lag = 0.0
+        self.maxLag = 0.0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, urgent=False):
+        """
+        Run it in the pool
+        :param urgent: whether it's light and due soon, run apart from the frames
+        :return: Future of the result
+        """
+        if urgent:
+            return self.urgentExecutor.submit(fn, *args)
+        return self.executor.submit(fn, *args)
+
+    def wake(self, stream, delay=0.0):
+        """
+        Step the stream after the delay, or earlier if it's due earlier already
+        :param stream: has step(), which returns seconds until next step, or None to wait until woken up again,
+            and fail(error), called instead if step raises
+        :param delay: seconds
+        """
+        deadline = time.monotonic() + delay
+        with self.condition:
+            current = self.entries.get(stream)
+            if current is not None and current[0] <= deadline:
+                return
+            entry = (deadline, next(self.order), stream)
+            self.entries[stream] = entry
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                # earlier than the one waited for
+                self.condition.notify()
+
+    def next(self):
+        """
+        Wait until the earliest stream is due
+        :return: the stream
+        """
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                deadline, _, stream = entry = self.heap[0]
+                if self.entries.get(stream) is not entry:
+                    # woken up earlier since
+                    heapq.heappop(self.heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                del self.entries[stream]
+                self.steps += 1
+                self.lag -= delay
+                self.maxLag = max(self.maxLag, -delay)
+                return stream
+
+    def run(self):
+        """
+        Step the streams in the order of the deadlines
+        """
+        while True:
+            stream = self.next()
+            try:
+                delay = stream.step()
+            except Exception as e:
+                # the other streams are not affected, the stream is closed and never stepped again
+                stream.fail(e)
+                continue
+            if delay is not None:
+                self.wake(stream, delay)
+
+    def getStats(self):
+        """
+        n streams waiting in the heap, and how late they are stepped
+        """
+        with self.condition:
+            return {
+                'scheduler.streams': len(self.entries),
+                'scheduler.lag_ms': round(self.lag / max(self.steps, 1) * 1000, 3),
+                'scheduler.max_lag_ms': round(self.maxLag * 1000, 3)
+            }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    class Stream:
+        """
+        Stepped every interval, like a stream of that frame rate
+        """
+
+        def __init__(self, interval, steps):
+            self.interval = interval
+            self.steps = steps
+            self.done = threading.Event()
+
+        def step(self):
+            self.steps -= 1
+            if self.steps <= 0:
+                self.done.set()
+                return None
+            return self.interval
+
+        def fail(self, error):
+            print('Failed to step: {}'.format(error))
+            self.done.set()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streams', type=int, default=1000)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--seconds', type=float, default=5)
+
+    args = vars(parser.parse_args())
+
+    scheduler = RtpScheduler()
+    streams = [
+        Stream(1 / args['fps'], int(args['fps'] * args['seconds'])) for _ in range(args['streams'])
+    ]
+    start = time.process_time()
+    for s in streams:
+        scheduler.wake(s)
+    for s in streams:
+        s.done.wait()
+    print('{} streams at {} fps, {} threads'.format(args['streams'], args['fps'], threading.active_count()))
+    print('cpu: {:.1f}%'.format((time.process_time() - start) / args['seconds'] * 100))
+    print(scheduler.getStats())
@@ -0,0 +1,96 @@
+# max bytes of the start line and the headers of a message
+MAX_HEADER = 16384
+# max bytes of the body of a message
+MAX_BODY = 65536
+
+
+class RtspParser:
+    """
+    Incremental parser of the RTSP messages on a TCP stream. Each message ends at the empty line after the headers,
+    followed by Content-Length bytes of body if any, so that the messages split or coalesced by TCP,
+    and the pipelined ones, are parsed the same
+    """
+
+    def __init__(self):
+        # bytes received but not parsed yet
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        :param data: bytes received
+        :return: [(start line, { header in lower case: value }, body)] of the messages completed
+        """
+        self.buffer += data
+        messages = []
+        while True:
+            message = self.next()
+            if message is None:
+                return messages
+            messages.append(message)
+
+    def next(self):
+        """
+        Parse the first message in the buffer
+        :return: (start line, headers, body), None if it's not complete yet
+        """
+        # the empty lines between the messages
+        while self.buffer[:2] == b'\r\n' or self.buffer[:1] == b'\n':
+            del self.buffer[:2 if self.buffer[:1] == b'\r' else 1]
+        end, separator = self.findHeaderEnd()
+        if end < 0:
+            if len(self.buffer) > MAX_HEADER:
+                raise ValueError('Header too long')
+            return None
+
+        lines = bytes(self.buffer[:end]).decode('utf-8').replace('\r\n', '\n').split('\n')
+        headers = {}
+        for line in lines[1:]:
+            key, colon, value = line.partition(':')
+            if not colon:
+                raise ValueError('Invalid header: {}'.format(line))
+            headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if not 0 <= length <= MAX_BODY:
+            raise ValueError('Invalid Content-Length: {}'.format(length))
+        start = end + separator
+        if len(self.buffer) < start + length:
+            return None
+        body = bytes(self.buffer[start:start + length]).decode('utf-8')
+        del self.buffer[:start + length]
+        return lines[0].strip(), headers, body
+
+    def findHeaderEnd(self):
+        """
+        :return: (where the headers end, length of the empty line), -1 if not received yet
+        """
+        ends = [(self.buffer.find(separator), len(separator)) for separator in (b'\r\n\r\n', b'\n\n')]
+        ends = [end for end in ends if end[0] >= 0]
+        return min(ends) if ends else (-1, 0)
+
+
+if __name__ == '__main__':
+    def test():
+        import random
+
+        messages = [
+            'DESCRIBE a.mp4 RTSP/1.0\r\nCSeq: 1\r\n\r\n',
+            'SETUP a.mp4 RTSP/1.0\r\nCSeq: 2\r\nTransport: RTP/UDP; client_port= 44444\r\n\r\n',
+            'SET_PARAMETER a.mp4 RTSP/1.0\r\nCSeq: 3\r\nContent-Length: 10\r\n\r\nspeed: 2\r\n',
+            '\r\nPLAY a.mp4 RTSP/1.0\nCSeq: 4\nRange: npt=10\n\n'
+        ]
+        stream = ''.join(messages).encode()
+        for _ in range(1000):
+            parser = RtspParser()
+            parsed = []
+            i = 0
+            # split at random, and coalesce
+            while i < len(stream):
+                n = random.randint(1, 40)
+                parsed += parser.feed(stream[i:i + n])
+                i += n
+            assert [line.split(' ')[0] for line, _, _ in parsed] == ['DESCRIBE', 'SETUP', 'SET_PARAMETER', 'PLAY']
+            assert parsed[2][2] == 'speed: 2\r\n' and parsed[3][1]['range'] == 'npt=10'
+        print('ok')
+
+    test()
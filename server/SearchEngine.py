@@ -3,6 +3,10 @@ import multiprocessing
 import os
 import json
 
+from server.SeekIndex import SeekIndex
+from server.SpriteSheet import SpriteSheet
+from server.FrameStore import PACKAGE_DIR
+
 BUF_SIZE = 2048
 # the file format supported
 VALID_EXTENSION = ['mp4', 'avi', 'mkv', 'mov', 'mpg', 'Ogg', 'wmv', '3gp', 'flv', 'vob', 'webm']
@@ -10,7 +14,7 @@ VALID_EXTENSION = ['mp4', 'avi', 'mkv', 'mov', 'mpg', 'Ogg', 'wmv', '3gp', 'flv'
 
 class SearchEngine:
     """
-    Search the videos on the server
+    Search the videos on the server, and send the sprite sheets of them
     """
 
     def __init__(self, host, port, workingDir):
@@ -60,7 +64,7 @@ class SearchEngine:
 
     def handleNewConnection(self, conn):
         """
-        Handle the new connection, receive search requests and send the results
+        Handle the new connection, receive search or sprites requests and send the results
         """
         self.listenSocket.close()
         while True:
@@ -70,11 +74,35 @@ class SearchEngine:
                 request = ''
             if not request:
                 break
+            if request[:7] == 'SPRITES':
+                data = self.getSprites(request[8:].strip())
+                conn.sendall('SPRITES {}\n'.format(len(data)).encode() + data)
+                continue
             if not request[:6] == 'SEARCH':
                 continue
             res = self.generateResponse(request[7:]).encode()
             conn.send(res)
 
+    def getSprites(self, filename):
+        """
+        Get the sprite sheet of the video, build and save it if not packaged
+        :return: bytes of the sprite sheet, empty if no such video
+        """
+        if os.path.basename(filename) != filename or filename.split('.')[-1] not in VALID_EXTENSION:
+            return b''
+        if not os.path.exists(os.path.join(self.workingDir, filename)):
+            return b''
+        data = SpriteSheet.open(self.workingDir, filename)
+        if data is not None:
+            return data
+        seekIndex = SeekIndex.open(self.workingDir, filename)
+        spriteSheet = SpriteSheet.build(os.path.join(self.workingDir, filename), seekIndex)
+        if spriteSheet is None:
+            return b''
+        os.makedirs(os.path.join(self.workingDir, PACKAGE_DIR), exist_ok=True)
+        spriteSheet.save(SpriteSheet.getPath(self.workingDir, filename))
+        return spriteSheet.pack()
+
     def generateResponse(self, parse):
         """
         Search on the workingDir, and parse the results
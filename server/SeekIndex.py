@@ -0,0 +1,200 @@
+import os
+import shutil
+import subprocess
+import cv2
+import numpy as np
+import sys; sys.path.append('..')
+
+from server.FrameStore import PACKAGE_DIR
+
+# direction to find the keyframe
+BACKWARD = -1
+NEAREST = 0
+FORWARD = 1
+
+
+class SeekIndex:
+    """
+    Keyframe positions and the timestamp of each frame of a video,
+    so that the video can be repositioned at a keyframe, where it can be decoded at once
+    """
+
+    def __init__(self, keyframes, timestamps):
+        """
+        :param keyframes: frame number of each keyframe, ascending
+        :param timestamps: presentation time of each frame, seconds
+        """
+        self.keyframes = np.asarray(keyframes, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def getKeyframe(self, frame, direction=NEAREST):
+        """
+        Find the keyframe near the frame
+        :param frame: frame number
+        :param direction: BACKWARD for at or before, FORWARD for at or after, NEAREST for the nearest one
+        :return: frame number of the keyframe
+        """
+        if len(self.keyframes) == 0:
+            return frame
+        # first keyframe after the frame
+        after = int(np.searchsorted(self.keyframes, frame, side='right'))
+        before = self.keyframes[max(after - 1, 0)]
+        if before == frame:
+            return frame
+        if after == len(self.keyframes):
+            return int(before)
+        after = self.keyframes[after]
+        if direction == BACKWARD:
+            return int(before)
+        if direction == FORWARD:
+            return int(after)
+        return int(before) if frame - before <= after - frame else int(after)
+
+    def getTimestamp(self, frame):
+        """
+        :return: presentation time of the frame, seconds
+        """
+        frame = min(max(frame, 0), len(self.timestamps) - 1)
+        return float(self.timestamps[frame])
+
+    def getFrame(self, seconds):
+        """
+        :return: the frame presented at the time
+        """
+        frame = int(np.searchsorted(self.timestamps, seconds, side='right')) - 1
+        return min(max(frame, 0), len(self.timestamps) - 1)
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, keyframes=self.keyframes, timestamps=self.timestamps)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def getPath(videoDir, filename):
+        return os.path.join(videoDir, PACKAGE_DIR, '{}.seek.npz'.format(filename))
+
+    @staticmethod
+    def open(videoDir, filename):
+        """
+        Load the index saved, if it's newer than the video
+        :return: SeekIndex, None if not built
+        """
+        path = SeekIndex.getPath(videoDir, filename)
+        if not os.path.exists(path):
+            return None
+        if os.path.getmtime(path) < os.path.getmtime(os.path.join(videoDir, filename)):
+            return None
+        with np.load(path) as data:
+            return SeekIndex(data['keyframes'], data['timestamps'])
+
+    @staticmethod
+    def build(path):
+        """
+        Build the index of the video, by ffprobe if available, otherwise by the packets read by OpenCV
+        :return: SeekIndex, None if failed
+        """
+        if shutil.which('ffprobe') is not None:
+            index = SeekIndex.buildByProbe(path)
+            if index is not None:
+                return index
+        return SeekIndex.buildByCapture(path)
+
+    @staticmethod
+    def buildByProbe(path):
+        """
+        Get the key_frame flag and the timestamp of each frame by ffprobe
+        """
+        command = [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'frame=key_frame,best_effort_timestamp_time',
+            '-of', 'compact=p=0', path
+        ]
+        try:
+            output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout.decode()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        keyframes = []
+        timestamps = []
+        for line in output.splitlines():
+            fields = dict(field.split('=', 1) for field in line.split('|') if '=' in field)
+            if 'key_frame' not in fields:
+                continue
+            if fields['key_frame'] == '1':
+                keyframes.append(len(timestamps))
+            try:
+                timestamps.append(float(fields.get('best_effort_timestamp_time')))
+            except (TypeError, ValueError):
+                # no timestamp, follow the last frame
+                timestamps.append(timestamps[-1] if timestamps else 0.0)
+        if not timestamps:
+            return None
+        # first frame at 0
+        timestamps = np.array(timestamps) - timestamps[0]
+        return SeekIndex(keyframes, timestamps)
+
+    @staticmethod
+    def buildByCapture(path):
+        """
+        Read the packets without decoding, get the keyframe flags of them
+        """
+        cap = cv2.VideoCapture(path)
+        fs = cap.get(cv2.CAP_PROP_FPS)
+        if not fs or not hasattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME') or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            cap.release()
+            return None
+        keyframes = []
+        n = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(n)
+            n += 1
+        cap.release()
+        if n == 0:
+            return None
+        return SeekIndex(keyframes, np.arange(n) / fs)
+
+
+if __name__ == '__main__':
+    import argparse
+    import random
+    import time
+
+    def benchmark(path, index, n):
+        """
+        Latency of repositioning at random frames, with and without the index
+        """
+        cap = cv2.VideoCapture(path)
+        length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        targets = [random.randrange(length) for _ in range(n)]
+        for name, useIndex in [('without index', False), ('with index', True)]:
+            latency = []
+            for frame in targets:
+                if useIndex:
+                    frame = index.getKeyframe(frame)
+                start = time.perf_counter()
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+                cap.read()
+                latency.append((time.perf_counter() - start) * 1000)
+            p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+            print('{}: p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+                name, p50, p90, p99, max(latency)))
+        cap.release()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dir', type=str, default='../../movies/')
+    parser.add_argument('--file', type=str, required=True)
+    # n random seeks
+    parser.add_argument('--n', type=int, default=100)
+
+    args = vars(parser.parse_args())
+
+    seekIndex = SeekIndex.open(args['dir'], args['file'])
+    if seekIndex is None:
+        os.makedirs(os.path.join(args['dir'], PACKAGE_DIR), exist_ok=True)
+        seekIndex = SeekIndex.build(os.path.join(args['dir'], args['file']))
+        seekIndex.save(SeekIndex.getPath(args['dir'], args['file']))
+    print('{} frames, {} keyframes'.format(len(seekIndex), len(seekIndex.keyframes)))
+    benchmark(os.path.join(args['dir'], args['file']), seekIndex, args['n'])
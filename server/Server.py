@@ -1,48 +1,288 @@
+import time
 import socket
+import ipaddress
+import asyncio
+import threading
 import multiprocessing
+import multiprocessing.connection
 import sys; sys.path.append('..')
 
 from server.ServerRtspController import ServerRtspController
+from server.RtspParser import RtspParser
+from server.WorkerStats import WorkerStats
+from server.Channel import Channel, DEFAULT_CHANNEL_PORT
 from server.SearchEngine import SearchEngine
+from server.Catalog import Catalog
+from server.FrameCache import FrameCache
+from server.QualityLadder import DEFAULT_LADDER
+from server.EncodePipeline import DEFAULT_DEPTH
+from server.RtpScheduler import RtpScheduler, DEFAULT_WORKERS
+from server.PacingClock import DEFAULT_LEAD, DEFAULT_MAX_LATE, DEFAULT_BURST_SPEED
+from server.TokenBucket import DEFAULT_RATE, DEFAULT_BURST
+from server.Packetizer import DEFAULT_MAX_PAYLOAD
+from server.TileCodec import DEFAULT_TILE_SIZE, DEFAULT_REFRESH
+from server.ReverseReader import DEFAULT_MAX_BYTES
+from server.AudioServerRtp import DEFAULT_PTIME
+from server.AudioFormat import DEFAULT_SILENCE
+
+# n worker processes accepting the sessions
+DEFAULT_PROCESSES = multiprocessing.cpu_count()
+# n sessions each worker streams at once, the idle connections are not counted
+DEFAULT_MAX_SESSIONS = 8
+# bytes read from a connection at once
+BUF_SIZE = 4096
+# each worker binds the port itself, and the kernel balances the connections between them,
+# otherwise the workers accept from the socket bound by the supervisor
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+# a worker died sooner than it (seconds) after started is restarted after it, rather than at once
+RESTART_DELAY = 1.0
+# seconds between the counters of each worker are published, and its viewers of the channels are renewed
+STATS_INTERVAL = 1.0
 
 
 class Server:
     """
-    The RTSP server, listening for connection
+    The RTSP server, the sessions are served end to end by a pool of pre-forked workers, each listening on the port,
+    and the supervisor restarts the workers died
     """
 
-    def __init__(self, addr, rtspPort, videoDir):
+    def __init__(self, addr, rtspPort, videoDir, options=None):
         # host, RTSP port and the RTP port
         self.addr = addr
         self.rtspPort = rtspPort
 
         # where are the videos
         self.videoDir = videoDir
+        # options of the sessions, the command line arguments
+        self.options = options if options is not None else {}
 
-        # the socket used to listen
+        # the socket of the supervisor the workers listen on, None if REUSE_PORT, each worker binds its own
         self.listenRtspSocket = None
 
+        # encoded frames shared by all the sessions
+        self.frameCache = None
+        if self.options.get('cache', 0) > 0:
+            self.frameCache = FrameCache(self.options['cache'] * 1024 * 1024)
+        # counters of the workers, summed up by GET_PARAMETER
+        self.stats = WorkerStats(self.options.get('processes', DEFAULT_PROCESSES))
+        # the live channels, { filename: Channel }, shared by all the workers
+        self.channels = {}
+
+        # set in each worker, index of it, the scheduler of its streams, its sessions and the connections
+        self.slot = 0
+        self.scheduler = None
+        self.sessions = None
+        self.controllers = set()
+        # the server accepting the connections of the worker, and whether it's accepting, not while the worker is full
+        self.server = None
+        self.listening = False
+
         self.initConnection()
-        self.startServer()
+        self.initChannels()
+        try:
+            self.startServer()
+        finally:
+            if self.frameCache is not None:
+                self.frameCache.close()
 
     def initConnection(self):
-        self.listenRtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listenRtspSocket.bind((self.addr, self.rtspPort))
+        """
+        Bind the port in the supervisor, so that it fails at once if in use,
+        kept to be shared by the workers only if the port can't be reused
+        """
+        sock = self.bind()
+        if REUSE_PORT:
+            sock.close()
+        else:
+            sock.listen(socket.SOMAXCONN)
+            self.listenRtspSocket = sock
+
+    def initChannels(self):
+        """
+        Start the live channels before forking the workers, so that the workers can add the viewers to them,
+        each on the next multicast group and ports of the one before
+        """
+        filenames = [filename.strip() for filename in self.options.get('channels', '').split(',') if filename.strip()]
+        group = self.options.get('multicast', '')
+        port = self.options.get('channel_port', DEFAULT_CHANNEL_PORT)
+        for i, filename in enumerate(filenames):
+            channel = Channel(
+                self.addr, self.videoDir, filename, port + i * 4,
+                str(ipaddress.ip_address(group) + i) if group else None, self.options
+            )
+            channel.start()
+            self.channels[filename] = channel
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if REUSE_PORT:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.addr, self.rtspPort))
+        return sock
 
     def startServer(self):
-        self.listenRtspSocket.listen(10)
+        """
+        Fork the workers, and restart the ones died, and the channels died
+        """
+        workers = [self.fork(slot) for slot in range(self.stats.workers)]
+        started = [time.monotonic()] * len(workers)
         print('listening ...')
+        while True:
+            sentinels = {worker.sentinel: slot for slot, worker in enumerate(workers)}
+            channels = {channel.process.sentinel: channel for channel in self.channels.values()}
+            for sentinel in multiprocessing.connection.wait(list(sentinels.keys()) + list(channels.keys())):
+                if sentinel in channels.keys():
+                    self.restartChannel(channels[sentinel])
+                    continue
+                slot = sentinels[sentinel]
+                workers[slot].join()
+                print('Worker {} exited with {}, restarting'.format(slot, workers[slot].exitcode))
+                # the connections and the sessions died with it
+                self.stats.set(slot, 'connections', 0)
+                self.stats.set(slot, 'sessions', 0)
+                self.stats.add(slot, 'restarts')
+                if time.monotonic() - started[slot] < RESTART_DELAY:
+                    # don't spin if it dies at once
+                    time.sleep(RESTART_DELAY)
+                workers[slot] = self.fork(slot)
+                started[slot] = time.monotonic()
+
+    @staticmethod
+    def restartChannel(channel):
+        """
+        Restart the channel died, it goes on by the schedule, and its viewers are added again as the workers renew them
+        """
+        channel.process.join()
+        print('Channel {} exited with {}, restarting'.format(channel.filename, channel.process.exitcode))
+        if time.monotonic() - channel.started < RESTART_DELAY:
+            # don't spin if it dies at once
+            time.sleep(RESTART_DELAY)
+        channel.start()
 
+    def fork(self, slot):
+        """
+        :param slot: index of the worker
+        :return: the worker started
+        """
+        worker = multiprocessing.Process(target=self.work, args=(slot,))
+        worker.start()
+        return worker
+
+    def work(self, slot):
+        """
+        Serve the RTSP connections in an event loop, in a worker process
+        :param slot: index of the worker
+        """
+        self.slot = slot
+        self.warmUp()
+        # the sessions set up in the worker
+        self.sessions = threading.BoundedSemaphore(self.options.get('max_sessions', DEFAULT_MAX_SESSIONS))
+        # sends the RTP of all the sessions of the worker
+        self.scheduler = RtpScheduler(self.options.get('workers', DEFAULT_WORKERS))
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        await self.listen()
         while True:
-            rtspSocket, clientAddr = self.listenRtspSocket.accept()
-            print('{} connected'.format(clientAddr))
-            # create new process for new connection
-            multiprocessing.Process(target=self.handleNewConnection, args=(rtspSocket, clientAddr)).start()
+            await asyncio.sleep(STATS_INTERVAL)
+            self.renewChannels()
+            # the sessions of the other workers may have ended meanwhile
+            await self.balance()
+
+    async def listen(self):
+        """
+        Accept the connections on a socket of the worker, so that it can be closed while the worker is full
+        """
+        self.listening = True
+        if REUSE_PORT:
+            sock = self.bind()
+            sock.listen(socket.SOMAXCONN)
+        else:
+            # the socket of the supervisor is kept listening by the other workers
+            sock = self.listenRtspSocket.dup()
+        self.server = await asyncio.start_server(self.handleNewConnection, sock=sock)
+
+    async def balance(self):
+        """
+        Stop accepting while the worker serves as many sessions as it can and another worker can serve more,
+        so that the new connections go to the others, rather than being refused at SETUP,
+        and accept again once a session ends, or all the others are full as well
+        """
+        self.publishStats()
+        maxSessions = self.options.get('max_sessions', DEFAULT_MAX_SESSIONS)
+        full = self.stats.get(self.slot)['sessions'] >= maxSessions
+        roomElsewhere = any(
+            self.stats.get(slot)['sessions'] < maxSessions for slot in range(self.stats.workers) if slot != self.slot
+        )
+        accept = not full or not roomElsewhere
+        if accept and not self.listening:
+            await self.listen()
+        elif not accept and self.listening:
+            self.listening = False
+            self.server.close()
+
+    def publishStats(self):
+        """
+        Publish the connections and the sessions of the worker
+        """
+        self.stats.set(self.slot, 'connections', len(self.controllers))
+        self.stats.set(self.slot, 'sessions', sum(1 for session in self.controllers if session.acquired))
+
+    def renewChannels(self):
+        """
+        Renew the viewers of the worker of each channel, so that the channel drops them if the worker dies
+        """
+        for channel in self.channels.values():
+            channel.renew([
+                (session.clientAddr, session.clientVideoRtpPort)
+                for session in self.controllers if session.channel is channel and session.joined
+            ])
+
+    @staticmethod
+    def warmUp():
+        """
+        Import what the sessions need before the first connection
+        """
+        try:
+            # only needed to decode the audio not in PCM yet
+            import moviepy.editor
+        except ImportError:
+            pass
 
-    def handleNewConnection(self, rtspSocket, clientAddr):
-        # release the source
-        self.listenRtspSocket.close()
-        ServerRtspController(rtspSocket, self.addr, clientAddr, self.videoDir).start()
+    async def handleNewConnection(self, reader, writer):
+        """
+        Parse the requests of the connection, and handle them in order in the threads of the executor,
+        as they block, e.g. to open the video
+        """
+        loop = asyncio.get_running_loop()
+        clientAddr = writer.get_extra_info('peername')
+        print('{} connected'.format(clientAddr))
+        session = ServerRtspController(
+            writer, loop, self.addr, clientAddr, self.videoDir, self.scheduler,
+            self.frameCache, self.options, self.sessions, self.stats, self.channels, self.slot
+        )
+        self.controllers.add(session)
+        self.stats.add(self.slot, 'accepted')
+        parser = RtspParser()
+        try:
+            while True:
+                data = await reader.read(BUF_SIZE)
+                if not data:
+                    break
+                for request in parser.feed(data):
+                    await loop.run_in_executor(None, session.handleRequest, request)
+                    # the session may be set up
+                    await self.balance()
+        except ValueError as e:
+            print('{}: bad request, {}'.format(clientAddr, e))
+            self.stats.add(self.slot, 'bad_requests')
+            session.sendResponse(0, status='400 Bad Request')
+        except ConnectionError:
+            pass
+        finally:
+            await loop.run_in_executor(None, session.teardown)
+            self.controllers.discard(session)
+            await self.balance()
 
 
 if __name__ == '__main__':
@@ -52,10 +292,55 @@ if __name__ == '__main__':
     parser.add_argument('--host', type=str, default='0.0.0.0')
     parser.add_argument('--port', type=int, default=554)
     parser.add_argument('--dir', type=str, default='../../movies/')
+    # size of the cache of encoded frames shared by all the sessions, MB, 0 to disable
+    parser.add_argument('--cache', type=int, default=256)
+    # qualities the videos can be sent in, 'widthxheight@jpeg quality,...' from low to high
+    parser.add_argument('--ladder', type=str, default=DEFAULT_LADDER)
+    # n frames can be buffered in the encode pipeline of each session
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH)
+    # n threads of each worker process to decode and encode, shared by its sessions
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    # size of the frames kept to play in reverse of each session, MB
+    parser.add_argument('--reverse-cache', type=int, default=DEFAULT_MAX_BYTES // 1024 // 1024)
+    # seconds of media can be sent ahead of real time, the buffer of the client
+    parser.add_argument('--lead', type=float, default=DEFAULT_LEAD)
+    # the lead is filled at up to n times real time after PLAY, repositioning or changing the speed, 0 for at once
+    parser.add_argument('--burst-speed', type=float, default=DEFAULT_BURST_SPEED)
+    # a video frame later than it (seconds) is dropped
+    parser.add_argument('--max-late', type=float, default=DEFAULT_MAX_LATE)
+    # rate of each stream, kbit/s, 0 to spread the packets of each frame over the frame interval
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE)
+    # bytes of each stream can be sent at once
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST)
+    # max bytes of the RTP payload of each packet, fits in a 1500 MTU by default
+    parser.add_argument('--max-payload', type=int, default=DEFAULT_MAX_PAYLOAD)
+    # 'jpeg' to send each frame in full, 'tiles' to send only the changed tiles, for screen capture or lectures
+    parser.add_argument('--codec', type=str, default='jpeg', choices=['jpeg', 'tiles'])
+    # pixels of each side of the tiles, multiple of 16
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    # n frames between the full frames of the tiles codec
+    parser.add_argument('--refresh', type=int, default=DEFAULT_REFRESH)
+    # ms of audio in each packet, e.g. 10 or 20 for low latency, 100 for less packets, 0 for one frame of the video
+    parser.add_argument('--ptime', type=float, default=DEFAULT_PTIME)
+    # n worker processes serving the sessions, each listening on the port, restarted if died
+    parser.add_argument('--processes', type=int, default=DEFAULT_PROCESSES)
+    # n sessions each worker streams at once, SETUP is refused beyond it
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS)
+    # audio chunks quieter than it (dBFS) are sent as a silence marker, 0 to send all
+    parser.add_argument('--silence', type=float, default=DEFAULT_SILENCE)
+    # videos served as live channels, 'a.mp4,b.mp4', each encoded once and looped, SETUP of them joins the channel
+    parser.add_argument('--channels', type=str, default='')
+    # address of the multicast group of the first channel, the next ones on the next addresses,
+    # empty to send the packets to each viewer
+    parser.add_argument('--multicast', type=str, default='')
+    # RTP port of the video of the first channel, the audio on it + 2, the next channel on it + 4
+    parser.add_argument('--channel-port', type=int, default=DEFAULT_CHANNEL_PORT)
 
     args = vars(parser.parse_args())
 
     # the search engine
     multiprocessing.Process(target=SearchEngine, args=(args['host'], 20000, args['dir'])).start()
+    # the catalog of the videos, refreshed in the background
+    multiprocessing.Process(target=Catalog(args['dir']).watch).start()
     # the server
-    Server(args['host'], args['port'], args['dir'])
+    Server(args['host'], args['port'], args['dir'], args)
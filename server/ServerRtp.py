@@ -1,17 +1,29 @@
+import math
 import socket
 import threading
 
+from server.PacingClock import PacingClock
+from server.TokenBucket import TokenBucket
+from server.EncodePipeline import EncodePipeline
 
-class ServerRtp(threading.Thread):
+# range of the speed factor, negative for reverse
+MIN_SPEED = 0.25
+MAX_SPEED = 16
+
+
+class ServerRtp:
     """
-    Base class of the RTP stream controller
+    Base class of the RTP stream controller, stepped by the RtpScheduler of the worker,
+    the units are prepared in its pool, and buffered in the pipeline until due
     """
 
-    def __init__(self, addr, *args, **kwargs):
-        super(ServerRtp, self).__init__(*args, **kwargs)
-
+    def __init__(self, addr, scheduler):
+        """
+        :param scheduler: RtpScheduler sending all the streams of the worker
+        """
         # addr of the server
         self.addr = addr
+        self.scheduler = scheduler
 
         self.socket = None
         self.initSocket()
@@ -21,26 +33,59 @@ class ServerRtp(threading.Thread):
         self._pause.set()
         self._stopper = threading.Event()
         self._stopper.set()
-        self._send_interval = threading.Event()
+        # set when the scheduler is done with it after stopped
+        self._closed = threading.Event()
+        # function(exception), called if the stream fails to be sent, e.g. to close its session
+        self.onFailed = None
 
-        # default interval to send
+        # default presentation time of each unit
         self.interval = 0.04
+        # deadlines to send each unit
+        self.clock = PacingClock()
+        # spread the packets of each unit
+        self.shaper = TokenBucket()
         self.ssrc = 0
 
-        self.clientAddr = None
-        self.clientPort = None
+        # (addr, port) each packet is sent to, a client, the viewers of a channel, or a multicast group,
+        # replaced rather than changed, so the list being sent to is never changed meanwhile
+        self.destinations = []
+
+        # divide each unit into packets, set by the subclass
+        self.packetizer = None
+
+        # units prepared to send
+        self.pipeline = EncodePipeline(scheduler.executor)
+        # protects the position read by fill
+        self.positionLock = threading.Lock()
+        # Future of fill in the pool, None if never
+        self.filling = None
+        # generation of the pipeline nothing more can be filled in, until repositioned
+        self.exhausted = -1
+        # (generation, index, data, duration) of the unit waiting for its deadline
+        self.unit = None
+        # packets of the unit being sent, and the one waiting for the shaper
+        self.packets = None
+        self.packet = None
+        # generation of the unit being sent
+        self.sending = 0
+        # whether the end is sent
+        self.ended = False
+        # whether the units are light and due soon, prepared apart from the frames
+        self.urgent = False
 
         # whether has started
         self.is_start = False
 
-        # 2x speed or not
-        self.doubleSpeed = False
+        # speed factor of the playback
+        self.speedFactor = 1.0
 
     def initSocket(self):
         """
         Init the RTP socket on UDP
         """
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # the scheduler never blocks on a stream
+        self.socket.setblocking(False)
 
     def closeSocket(self):
         self.socket.close()
@@ -50,60 +95,258 @@ class ServerRtp(threading.Thread):
         self.interval = interval
 
     def setClientInfo(self, addr, port):
-        self.clientAddr = addr
-        self.clientPort = port
+        self.destinations = [(addr, port)]
+
+    def setDestinations(self, destinations):
+        """
+        :param destinations: [(addr, port)], each packet is sent to all of them from the same buffers
+        """
+        self.destinations = list(destinations)
+
+    def setOnFailed(self, onFailed):
+        """
+        :param onFailed: function(exception), called by the scheduler if the stream fails to be sent
+        """
+        self.onFailed = onFailed
+
+    def setMulticast(self, ttl):
+        """
+        :param ttl: n hops the packets sent to a multicast group can go
+        """
+        self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
 
     def setSsrc(self, ssrc):
         self.ssrc = ssrc
+        self.packetizer.setSsrc(ssrc)
 
-    def run(self):
+    def setMaxPayload(self, maxPayload):
         """
-        Start
+        :param maxPayload: max bytes of the RTP payload of each packet, to avoid IP fragmentation
+        """
+        self.packetizer.setMaxPayload(maxPayload)
+
+    def setPacing(self, lead, maxLate, burstSpeed):
+        """
+        :param lead: seconds of media can be sent ahead of the presentation clock, filled at the start
+        :param maxLate: a unit later than it (seconds) is dropped, if it can be dropped
+        :param burstSpeed: the lead is filled at up to n times real time, 0 for as fast as the shaper allows
+        """
+        self.clock = PacingClock(lead, maxLate, burstSpeed)
+
+    def setShaping(self, rate, burst):
+        """
+        :param rate: bytes per second, 0 to spread the packets of each unit over the interval
+        :param burst: bytes can be sent at once
+        """
+        self.shaper = TokenBucket(rate, burst)
+
+    def step(self):
+        """
+        Send what is due, called by the scheduler
+        :return: seconds until it's due to step again, None to wait until woken up
+        """
+        if not self._stopper.is_set():
+            if not self._closed.is_set():
+                self.closeSocket()
+                self._closed.set()
+            return None
+        self.refill()
+        if not self._pause.is_set():
+            return None
+        while True:
+            if self.packets is not None and self.sending != self.pipeline.generation:
+                # repositioned, the rest of the unit is out of date
+                self.packets = None
+                self.packet = None
+            if self.packets is not None:
+                delay = self.sendPackets()
+                if delay > 0:
+                    return delay
+            if self.unit is None:
+                if self.ended:
+                    return None
+                self.unit = self.pipeline.poll(self.wakeUp)
+                if self.unit is None:
+                    # woken up when prepared
+                    return None
+                # room for the next one
+                self.refill()
+            generation, index, data, duration = self.unit
+            if generation != self.pipeline.generation:
+                # repositioned since
+                self.unit = None
+                continue
+            if index is None:
+                with self.positionLock:
+                    # unless repositioned meanwhile
+                    self.ended = generation == self.pipeline.generation
+                self.unit = None
+                continue
+            delay = self.clock.getDelay()
+            if delay > 0:
+                return delay
+            self.unit = None
+            send = self.clock.check(self.isDroppable())
+            self.clock.advance(self.interval if duration is None else duration)
+            if not send or data is None:
+                continue
+            self.onSend(index)
+            # spread the packets until next unit is due
+            self.shaper.setFrame(len(data), self.clock.getDelay())
+            # divide into packets, without copying the unit, tagged with the epoch of the position
+            self.sending = generation
+            self.packets = self.packetizer.packets(data, index, generation)
+
+    def fail(self, error):
+        """
+        Stop and close the stream failed to step, called by the scheduler, which steps it no more
+        :param error: the exception raised by step
+        """
+        self._pause.set()
+        self._stopper.clear()
+        if not self._closed.is_set():
+            self.closeSocket()
+            self._closed.set()
+        if self.onFailed is not None:
+            self.onFailed(error)
+
+    def sendPackets(self):
+        """
+        Send the packets of the unit when the shaper allows
+        :return: seconds to wait before sending next packet, 0 if all sent
+        """
+        while True:
+            if self.packet is None:
+                self.packet = next(self.packets, None)
+                if self.packet is None:
+                    self.packets = None
+                    return 0
+                delay = self.shaper.reserve(len(self.packet[0]) + len(self.packet[1]))
+                if delay > 0:
+                    return delay
+            dropped = False
+            for destination in self.destinations:
+                try:
+                    # [header, payload], sent by sendmsg without joining them
+                    self.socket.sendmsg(self.packet, (), 0, destination)
+                except OSError:
+                    # the buffer of the socket is full
+                    dropped = True
+            if dropped:
+                self.shaper.drop()
+            self.packet = None
+
+    def refill(self):
+        """
+        Prepare next unit in the pool, one at a time, if there is room in the pipeline
+        """
+        if self.filling is not None and not self.filling.done():
+            return
+        if not self._stopper.is_set() or self.exhausted == self.pipeline.generation or self.pipeline.isFull():
+            return
+        self.filling = self.scheduler.submit(self.fill, urgent=self.urgent)
+        # step again when it's prepared
+        self.filling.add_done_callback(lambda _: self.wakeUp())
+
+    def wakeUp(self):
+        """
+        Step as soon as possible, e.g. a unit is prepared
+        """
+        if self.is_start:
+            self.scheduler.wake(self)
+
+    def flush(self):
+        """
+        Discard the units prepared at the old position or speed, called with the position lock held
+        """
+        self.pipeline.flush()
+        self.ended = False
+
+    def getEpoch(self):
+        """
+        :return: epoch of the units sent from now on, the generation of the pipeline mod 256
+        """
+        return self.pipeline.generation & 0xFF
+
+    def start(self):
+        """
+        Start to send
         """
         self.is_start = True
-        self.beforeRun()
-        while self.sendCondition() and self._stopper.is_set():
-            self._pause.wait()
-            self.running()
-            self._send_interval.wait(self.interval)
-        self.closeSocket()
+        self.scheduler.wake(self)
 
     def pause(self):
         """
-        Pause the thread
+        Pause the stream
         """
         self._pause.clear()
 
     def resume(self):
         """
-        Resume the thread
+        Resume the stream
         """
+        self.clock.reset()
         self._pause.set()
+        self.wakeUp()
 
     def stop(self):
         """
-        Stop the thread
+        Stop the stream, the socket is closed by the scheduler
         """
         self._pause.set()
         self._stopper.clear()
+        self.wakeUp()
+
+    def wait(self, timeout=1.0):
+        """
+        Wait for the scheduler and the unit being prepared to be done with it after stopped,
+        before the resource they read is released
+        :param timeout: seconds to wait for each
+        """
+        if self.is_start:
+            self._closed.wait(timeout)
+        elif self.socket is not None:
+            self.closeSocket()
+        filling = self.filling
+        if filling is not None:
+            try:
+                filling.result(timeout)
+            except Exception:
+                pass
 
     def speed(self, speed):
         """
         Change the speed
-        :param speed: 1 or 2
+        :param speed: speed factor, from MIN_SPEED to MAX_SPEED, negative for reverse
+        """
+        self.speedFactor = math.copysign(min(max(abs(speed), MIN_SPEED), MAX_SPEED), speed)
+        self.clock.reset()
+        self.wakeUp()
+
+    def getStats(self):
+        """
+        Error of the pacing, and the counters of the shaper
         """
-        if speed == 1:
-            self.doubleSpeed = False
-        elif speed == 2:
-            self.doubleSpeed = True
+        stats = {'pacing.{}'.format(key): value for key, value in self.clock.getStats().items()}
+        stats.update({'shaper.{}'.format(key): value for key, value in self.shaper.getStats().items()})
+        return stats
 
     """ Hook functions """
 
-    def sendCondition(self):
+    def fill(self):
+        """
+        Prepare next unit and put it into the pipeline, run in the pool, set exhausted if nothing more to prepare
+        """
         raise NotImplementedError
 
-    def running(self):
+    def isDroppable(self):
+        """
+        Whether a unit can be dropped if it's too late
+        """
         raise NotImplementedError
 
-    def beforeRun(self):
-        raise NotImplementedError
+    def onSend(self, index):
+        """
+        Called before sending the unit
+        """
+        pass
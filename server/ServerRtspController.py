@@ -2,11 +2,22 @@ import math
 import random
 import os
 import cv2
-import socket
-from moviepy.editor import AudioFileClip
+import threading
 
-from server.VideoServerRtp import VideoServerRtp
-from server.AudioServerRtp import AudioServerRtp
+from server.VideoServerRtp import VideoServerRtp, HD
+from server.AudioServerRtp import AudioServerRtp, DEFAULT_PTIME
+from server.FrameStore import FrameStore
+from server.QualityLadder import QualityLadder, DEFAULT_LADDER
+from server.SeekIndex import SeekIndex, BACKWARD, NEAREST, FORWARD
+from server.EncodePipeline import DEFAULT_DEPTH
+from server.PacingClock import DEFAULT_LEAD, DEFAULT_MAX_LATE, DEFAULT_BURST_SPEED
+from server.TokenBucket import DEFAULT_RATE, DEFAULT_BURST
+from server.Packetizer import DEFAULT_MAX_PAYLOAD
+from server.TileCodec import TileCodec, DEFAULT_TILE_SIZE, DEFAULT_REFRESH
+from server.ReverseReader import DEFAULT_MAX_BYTES
+from server.PcmCache import PcmCache
+from server.AudioFormat import AudioFormat, DEFAULT_SILENCE
+from server.Catalog import Catalog
 
 
 class ServerRtspController:
@@ -14,8 +25,19 @@ class ServerRtspController:
     RTSP controller, and controls RTP stream
     """
 
-    def __init__(self, rtspSocket, addr, clientAddr, videoDir):
-        self.rtspSocket = rtspSocket
+    def __init__(self, writer, loop, addr, clientAddr, videoDir, scheduler,
+                 frameCache=None, options=None, sessions=None, serverStats=None, channels=None, slot=0):
+        """
+        :param writer: asyncio.StreamWriter of the RTSP connection
+        :param loop: the event loop the connection belongs to, the requests are handled in other threads
+        :param scheduler: RtpScheduler sending the streams of the worker
+        :param sessions: semaphore of the sessions can be set up in the worker, None for no limit
+        :param serverStats: WorkerStats, counters of all the workers
+        :param channels: { filename: Channel }, the live channels, SETUP of them joins the channel
+        :param slot: index of the worker, whose counters in serverStats are added to
+        """
+        self.writer = writer
+        self.loop = loop
         self.addr = addr
 
         self.clientAddr = clientAddr[0]
@@ -37,11 +59,32 @@ class ServerRtspController:
 
         # where are the videos
         self.videoDir = videoDir
+        # metadata of the videos
+        self.catalog = Catalog(videoDir)
+        # encoded frames shared by all the sessions
+        self.frameCache = frameCache
+        # options of the session
+        self.options = options if options is not None else {}
+        # the qualities the video can be sent in
+        self.ladder = QualityLadder.parse(self.options.get('ladder', DEFAULT_LADDER))
+        # sessions can be set up in the worker, and whether this one is counted
+        self.sessions = sessions
+        self.acquired = False
+        # counters of all the workers, and the index of this one
+        self.serverStats = serverStats
+        self.slot = slot
 
+        # sends the RTP of all the sessions of the worker
+        self.scheduler = scheduler
         # RTP for the video and audio
         self.videoRtp = None
         self.audioRtp = None
 
+        # the live channels, the one set up instead of the streams, and whether receiving it
+        self.channels = channels if channels is not None else {}
+        self.channel = None
+        self.joined = False
+
         self.init()
 
     def init(self):
@@ -51,240 +94,444 @@ class ServerRtspController:
         self.ssrc = random.randint(1, 99999)
         self.sessionid = random.randint(1, 99999)
 
-    def start(self):
-        """
-        Receive and handle request
-        """
-        while self.rtspSocket is not None:
-            request = self.recvRtspRequest()
-            print('\nRequest:')
-            print(request)
-            if not request:
-                break
-            self.handleRequest(request)
-        self.teardown()
-
-    def recvRtspRequest(self):
-        """
-        Try to receive request
-        """
-        try:
-            request = self.rtspSocket.recv(2048).decode('utf-8')
-        except ConnectionResetError:
-            request = ''
-        return request
-
     def handleRequest(self, request):
         """
         Handle different request
+        :param request: (request line, { header in lower case: value }, body), parsed by RtspParser
         """
-        if not request:
-            return
-        lines = str(request).split('\n')
-        seq = int(lines[1].split(' ')[1])
-        command, filename = lines[0].split(' ')[:2]
-        if command == 'DESCRIBE':
+        requestLine, headers, body = request
+        command, filename = requestLine.split(' ')[:2]
+        try:
+            seq = int(headers.get('cseq', 0))
+        except ValueError:
+            seq = 0
+        try:
+            self.dispatch(command, filename, seq, headers, body)
+        except (KeyError, IndexError, ValueError) as e:
+            # a header missing or malformed, the connection is kept for the next request
+            print('{}: bad request, {} {!r}'.format(self.clientAddr, command, e))
+            if self.serverStats is not None:
+                self.serverStats.add(self.slot, 'bad_requests')
+            self.sendResponse(seq, status='400 Bad Request')
+        except OSError as e:
+            # the video is missing or can't be read
+            print('{}: {} not found, {}'.format(self.clientAddr, filename, e))
+            self.sendResponse(seq, status='404 Not Found')
+
+    def dispatch(self, command, filename, seq, headers, body):
+        """
+        Handle the request by its command
+        :param seq: CSeq of the request
+        :param headers: { header in lower case: value }
+        """
+        if command in ('PLAY', 'PAUSE', 'SET_PARAMETER') and self.channel is not None:
+            # live, only whether the client receives it can be controlled
+            if command == 'SET_PARAMETER':
+                self.sendResponse(seq, status='455 Method Not Valid in This State')
+                return
+            if command == 'PLAY':
+                self.joinChannel()
+            else:
+                self.leaveChannel()
+            self.sendResponse(seq)
+        elif command in ('PLAY', 'PAUSE', 'SET_PARAMETER') and self.videoRtp is None:
+            self.sendResponse(seq, status='455 Method Not Valid in This State')
+        elif command == 'DESCRIBE':
             # get info of the video and audio
             info = self.getInfo(filename)
             self.sendDescribeResponse(seq, info)
+        elif command == 'SETUP' and self.info is None:
+            # the video to set up is chosen by DESCRIBE
+            self.sendResponse(seq, status='455 Method Not Valid in This State')
         elif command == 'SETUP':
-            self.clientVideoRtpPort = int(lines[2].split('=')[-1])
+            self.clientVideoRtpPort = int(headers['transport'].split('=')[-1])
+            if self.filename in self.channels.keys():
+                # sent by the channel, the session costs no stream of the worker
+                self.channel = self.channels[self.filename]
+                self.sendSetupResponse(seq)
+                return
+            if not self.acquireSession():
+                self.sendResponse(seq, status='453 Not Enough Bandwidth')
+                return
             # setup the RTP server
-            self.setup()
+            self.setup(headers.get('audio-format'))
             self.sendSetupResponse(seq)
         elif command == 'PLAY':
-            self.sendPlayResponse(seq)
             pos = None
-            if len(lines) > 3:
-                pos = int(lines[3].split(' ')[-1][4:])
-            # play the video
-            self.play(pos)
+            if 'range' in headers.keys():
+                pos = int(headers['range'][4:])
+            # where to find the keyframe when reposition
+            direction = {
+                'backward': BACKWARD,
+                'forward': FORWARD
+            }.get(headers.get('seek'), NEAREST)
+            # play the video, repositioned in place if playing
+            self.play(pos, direction)
+            # the client discards the packets of the epochs before
+            epochs = ['video={}'.format(self.videoRtp.getEpoch())]
+            if self.audioRtp is not None:
+                epochs.append('audio={}'.format(self.audioRtp.getEpoch()))
+            self.sendResponse(seq, {'Epoch': ';'.join(epochs)})
         elif command == 'PAUSE':
             self.pause()
-            self.sendPauseResponse(seq)
+            self.sendResponse(seq)
         elif command == 'TEARDOWN':
             # pause and teardown
-            self.pause()
-            self.sendTearDownResponse(seq)
+            if self.videoRtp is not None:
+                self.pause()
+            self.sendResponse(seq)
             self.teardown()
         elif command == 'SET_PARAMETER':
-            # get the parameter set
-            key, value = lines[3].split(':')
-            if key == 'align':
-                align = float(value)
-                self.audioRtp.align(align)
-                self.sendSetParameterResponse(seq)
-            elif key == 'level':
-                level = int(value)
-                self.videoRtp.setQuality(level)
-                self.sendSetParameterResponse(seq)
-            elif key == 'speed':
-                speed = int(value)
-                self.videoRtp.speed(speed)
-                self.audioRtp.speed(speed)
+            # get the parameters set, a 'key: value' per line of the body
+            for line in body.splitlines():
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'align' and self.audioRtp is not None:
+                    align = float(value)
+                    self.audioRtp.align(align)
+                elif key == 'level':
+                    level = int(value)
+                    self.videoRtp.setQuality(level)
+                elif key == 'speed':
+                    speed = float(value)
+                    for rtp in self.getStreams():
+                        rtp.speed(speed)
+            self.sendResponse(seq)
+        elif command == 'GET_PARAMETER':
+            self.sendGetParameterResponse(seq, self.getStats())
         else:
-            return
+            self.sendResponse(seq, status='501 Not Implemented')
 
-    def sendDescribeResponse(self, seq, info):
+    def acquireSession(self):
         """
-        Generate response for DESCRIBE request
+        Count the session in the worker when it's set up
+        :return: False if the worker serves as many sessions as it can
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seq}\nSession: {session}'.format(**{
-            'seq': seq,
-            'session': self.sessionid
-        })
-        if 'video' in info.keys():
-            videoInfo = '\nm=video 0\na=control:streamid=0\na=length:{length}\na=framerate:{fs}'.format(**{
-                'length': info['video']['length'],
-                'fs': info['video']['framerate']
-            })
-            response = response + videoInfo
-        if 'audio' in info.keys():
-            audioInfo = '\nm=audio 0\na=control:streamid=1\na=framerate:{fs}'.format(**{
-                'fs': info['audio']['framerate']
-            })
-            response = response + audioInfo
-        self.rtspSocket.send(response.encode())
+        if self.sessions is None or self.acquired:
+            return True
+        self.acquired = self.sessions.acquire(blocking=False)
+        return self.acquired
 
-    def sendSetupResponse(self, seq):
+    def sendResponse(self, seq, headers=None, body='', status='200 OK'):
+        """
+        Send a response, [status line][headers][empty line][body]
+        :param headers: { key: value } after CSeq and Session
+        :param body: Content-Length is added if any
+        """
+        lines = ['RTSP/1.0 {}'.format(status), 'CSeq: {}'.format(seq), 'Session: {}'.format(self.sessionid)]
+        for key, value in (headers if headers is not None else {}).items():
+            lines.append('{}: {}'.format(key, value))
+        body = body.encode()
+        if body:
+            lines.append('Content-Length: {}'.format(len(body)))
+        self.write('\r\n'.join(lines).encode() + b'\r\n\r\n' + body)
+
+    def write(self, data):
         """
-        Generate response for SETUP request
+        The writer belongs to the event loop, and the requests are handled in the threads of the executor
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seqNum}\nSession: {session}'.format(
-            **{
-                'seqNum': seq,
-                'session': self.sessionid
-            })
-        self.rtspSocket.send(response.encode())
+        if self.writer is not None:
+            self.loop.call_soon_threadsafe(self.writer.write, data)
 
-    def sendPlayResponse(self, seq):
+    def sendDescribeResponse(self, seq, info):
         """
-        Generate response for PLAY request
+        Generate response for DESCRIBE request, the description is the body
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seqNum}\nSession: {session}'.format(**{
-            'seqNum': seq,
-            'session': self.sessionid
-        })
-        self.rtspSocket.send(response.encode())
+        lines = []
+        if 'video' in info.keys():
+            lines += [
+                'm=video 0',
+                'a=control:streamid=0',
+                'a=length:{}'.format(info['video']['length']),
+                'a=framerate:{}'.format(info['video']['framerate']),
+                # the qualities can be chosen, and the default one
+                'a=ladder:{}'.format(self.ladder.describe()),
+                'a=level:{}'.format(min(HD, len(self.ladder) - 1))
+            ]
+            if self.filename in self.channels.keys():
+                # live, can't be repositioned, nor changed the speed or the quality
+                lines.append('a=type:broadcast')
+        if 'audio' in info.keys():
+            lines += [
+                'm=audio 0',
+                'a=control:streamid=1',
+                'a=framerate:{}'.format(info['audio']['framerate']),
+                'a=ptime:{:g}'.format(info['audio']['ptime'])
+            ]
+            # the payload formats can be chosen in SETUP
+            for key, value in AudioFormat.describe(info['audio']['framerate']).items():
+                lines.append('a={}:{}'.format(key, value))
+        self.sendResponse(seq, {'Content-Type': 'application/sdp'}, '\r\n'.join(lines) + '\r\n')
 
-    def sendPauseResponse(self, seq):
+    def sendSetupResponse(self, seq):
         """
-        Generate response for PAUSE request
+        Generate response for SETUP request
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seqNum}\nSession: {session}'.format(**{
-            'seqNum': seq,
-            'session': self.sessionid
-        })
-        self.rtspSocket.send(response.encode())
+        if self.channel is not None:
+            # where the channel is received, and the payload format of its audio
+            headers = {'Transport': self.channel.getTransport(self.clientVideoRtpPort)}
+            if self.channel.format is not None:
+                headers['Audio-Format'] = self.channel.format
+            self.sendResponse(seq, headers)
+            return
+        headers = {'Transport': 'RTP/UDP;unicast;client_port={}'.format(self.clientVideoRtpPort)}
+        if self.audioRtp is not None:
+            # the payload format of the audio is used
+            headers['Audio-Format'] = self.audioRtp.format
+        self.sendResponse(seq, headers)
 
-    def sendTearDownResponse(self, seq):
+    def sendGetParameterResponse(self, seq, stats):
         """
-        Generate response for TEARDOWN request
+        Generate response for GET_PARAMETER request, a 'key: value' per line of the body
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seqNum}\nSession: {session}'.format(**{
-            'seqNum': seq,
-            'session': self.sessionid
-        })
-        self.rtspSocket.send(response.encode())
+        body = ''.join('{}: {}\r\n'.format(key, value) for key, value in stats.items())
+        self.sendResponse(seq, {'Content-Type': 'text/parameters'}, body)
 
-    def sendSetParameterResponse(self, seq):
+    def getStats(self):
         """
-        Generate response for SET_PARAMETER request
+        Collect the counters of the session
         """
-        response = 'RTSP/1.0 200 OK\nCSeq: {seqNum}\nSession: {session}'.format(**{
-            'seqNum': seq,
-            'session': self.sessionid
-        })
-        self.rtspSocket.send(response.encode())
+        stats = {}
+        if self.frameCache is not None:
+            stats.update(self.frameCache.getStats())
+        if self.videoRtp is not None:
+            stats.update(self.videoRtp.getStats())
+        if self.audioRtp is not None:
+            stats.update(self.audioRtp.getStats())
+        if self.channel is not None:
+            stats.update(self.channel.getStats())
+        stats.update(self.scheduler.getStats())
+        if self.serverStats is not None:
+            stats.update(self.serverStats.getTotal())
+        return stats
 
     def getInfo(self, filename):
         """
-        Get info of the video and audio corresponding to the filename
+        Get info of the video and audio corresponding to the filename, from the catalog
         """
+        media = self.catalog.lookup(filename)
+        # set once found, so a video not found leaves the one described before
+        self.filename = filename
         self.info = {
-            'video': self.getVideoInfo(filename),
-            'audio': self.getAudioInfo(filename)
+            'video': {
+                'length': media['frames'],  # n frames
+                'framerate': math.floor(media['framerate'])
+            }
+        }
+        if media['audio_rate'] == 0:
+            # no audio track, only the video is described and sent
+            return self.info
+        self.info['audio'] = {
+            'framerate': media['audio_rate']
         }
+        # ms of audio in each chunk, one frame of the video by default
+        ptime = self.options.get('ptime', DEFAULT_PTIME)
+        self.info['audio']['ptime'] = ptime if ptime > 0 else 1000 / self.info['video']['framerate']
         return self.info
 
-    def getVideoInfo(self, filename):
+    def openVideo(self):
         """
-        Open the video, get the framerate and the length of the video
+        Open the video to send, at SETUP
         """
         if self.cap is not None:
             self.cap.release()
-            self.cap = None
-        self.cap = cv2.VideoCapture(os.path.join(self.videoDir, filename))
-        framerate = math.floor(self.cap.get(cv2.CAP_PROP_FPS))
-        length = math.floor(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        return {
-            'length': length,  # n frames
-            'framerate': framerate
-        }
+        self.cap = cv2.VideoCapture(os.path.join(self.videoDir, self.filename))
 
-    def getAudioInfo(self, filename):
+    def openAudio(self):
         """
-        Extract the audio from the video, get the framerate of the audio
+        Extract the audio from the video to send, only if it's not decoded into PCM yet
         """
-        self.audioClip = AudioFileClip(os.path.join(self.videoDir, filename))
-        framerate = math.floor(self.audioClip.fps)
-        return {
-            'framerate': framerate
-        }
+        from moviepy.editor import AudioFileClip
 
-    def setup(self):
+        if self.audioClip is None:
+            self.audioClip = AudioFileClip(os.path.join(self.videoDir, self.filename))
+        return self.audioClip
+
+    def setup(self, audioFormat=None):
         """
         Setup RTP of video and audio respectively, and set some parameters
+        :param audioFormat: payload format of the audio chosen by the client, 'sample/channels/rate[/zlib]'
         """
-        self.videoRtp = VideoServerRtp(self.addr)
+        self.openVideo()
+        self.videoRtp = VideoServerRtp(self.addr, self.scheduler)
         self.videoRtp.setClientInfo(self.clientAddr, self.clientVideoRtpPort)
         self.videoRtp.setSsrc(self.ssrc)
+        self.videoRtp.setOnFailed(self.onStreamFailed)
         self.videoRtp.setCapture(self.cap)
+        self.videoRtp.setLadder(self.ladder)
+        self.videoRtp.setPipeline(self.options.get('depth', DEFAULT_DEPTH))
+        # MB to bytes
+        reverseCache = self.options.get('reverse_cache', DEFAULT_MAX_BYTES // 1024 // 1024) * 1024 * 1024
+        self.videoRtp.setReverseCache(reverseCache)
+        seekIndex = SeekIndex.open(self.videoDir, self.filename)
+        if seekIndex is None:
+            # not built by the catalog yet, read from the packets in the background
+            threading.Thread(target=self.buildSeekIndex, args=(self.videoRtp,), daemon=True).start()
+        self.videoRtp.setSeekIndex(seekIndex)
+        if self.options.get('codec') == 'tiles':
+            self.videoRtp.setTileCodec(TileCodec(
+                self.options.get('tile_size', DEFAULT_TILE_SIZE),
+                self.options.get('refresh', DEFAULT_REFRESH)
+            ))
+        self.videoRtp.setFrameStores(self.openFrameStores())
+        if self.frameCache is not None:
+            mtime = os.path.getmtime(os.path.join(self.videoDir, self.filename))
+            self.videoRtp.setFrameCache(self.frameCache, '{}:{}'.format(self.filename, mtime))
+
+        lead = self.options.get('lead', DEFAULT_LEAD)
+        maxLate = self.options.get('max_late', DEFAULT_MAX_LATE)
+        burstSpeed = self.options.get('burst_speed', DEFAULT_BURST_SPEED)
+        self.videoRtp.setPacing(lead, maxLate, burstSpeed)
+        # kbit/s to bytes/s
+        rate = self.options.get('rate', DEFAULT_RATE) * 1000 // 8
+        burst = self.options.get('burst', DEFAULT_BURST)
+        self.videoRtp.setShaping(rate, burst)
+        maxPayload = self.options.get('max_payload', DEFAULT_MAX_PAYLOAD)
+        self.videoRtp.setMaxPayload(maxPayload)
 
+        if 'audio' not in self.info.keys():
+            return
         fs = self.info['video']['framerate']
-        self.audioRtp = AudioServerRtp(self.addr)
+        self.audioRtp = AudioServerRtp(self.addr, self.scheduler)
+        self.audioRtp.setPacing(lead, maxLate, burstSpeed)
+        self.audioRtp.setShaping(rate, burst)
+        self.audioRtp.setMaxPayload(maxPayload)
         self.audioRtp.setClientInfo(self.clientAddr, self.clientVideoRtpPort + 2)
         self.audioRtp.setSsrc(self.ssrc)
-        self.audioRtp.setAudio(self.audioClip, self.info['video']['length'] / fs, fs)
+        self.audioRtp.setOnFailed(self.onStreamFailed)
+        audioRate = self.info['audio']['framerate']
+        pcm = PcmCache.open(self.videoDir, self.filename)
+        # the clip is opened only to decode the audio until the PCM is built
+        audio = self.openAudio() if pcm is None else None
+        self.audioRtp.setAudio(audio, audioRate, self.info['video']['length'] / fs, self.info['audio']['ptime'])
+        try:
+            audioFormat = AudioFormat.parse(audioFormat, audioRate)
+        except ValueError:
+            # keep the raw float32 stereo, the client follows the format in the response
+            audioFormat = AudioFormat(audioRate)
+        audioFormat.setSilence(self.options.get('silence', DEFAULT_SILENCE))
+        self.audioRtp.setFormat(audioFormat)
+        if pcm is not None:
+            self.audioRtp.setPcm(pcm)
+        else:
+            # decoded by the clip until it's built
+            threading.Thread(target=self.buildPcm, args=(self.audioRtp,), daemon=True).start()
+
+    def onStreamFailed(self, error):
+        """
+        Called by the scheduler if a stream of the session fails, the connection is closed,
+        so the session is torn down as if the client left, rather than kept without being sent
+        """
+        print('Failed to send {} to {}: {}'.format(self.filename, self.clientAddr, error))
+        writer = self.writer
+        if writer is not None:
+            self.loop.call_soon_threadsafe(writer.close)
+
+    def buildPcm(self, audioRtp):
+        """
+        Decode the audio into PCM once, shared by the later sessions
+        :param audioRtp: to read from it when built
+        """
+        try:
+            if not PcmCache.build(self.videoDir, self.filename):
+                # being built by another session
+                return
+        except Exception as e:
+            print('Failed to decode the audio of {}: {}'.format(self.filename, e))
+            return
+        audioRtp.setPcm(PcmCache.open(self.videoDir, self.filename))
 
-    def play(self, pos):
+    def buildSeekIndex(self, videoRtp):
+        """
+        Find the keyframes by the packets without decoding, for this session only, saved by the catalog
+        :param videoRtp: sends only the keyframes when fast forward once it's built
+        """
+        seekIndex = SeekIndex.buildByCapture(os.path.join(self.videoDir, self.filename))
+        if seekIndex is not None:
+            videoRtp.setSeekIndex(seekIndex)
+
+    def openFrameStores(self):
+        """
+        Open the pre-encoded frames of each rung of the ladder, if packaged
+        :return: { name of the rung: FrameStore }
+        """
+        frameStores = {}
+        for level in range(len(self.ladder)):
+            name = self.ladder.getName(level)
+            store = FrameStore.open(self.videoDir, self.filename, name)
+            if store is not None:
+                frameStores[name] = store
+        return frameStores
+
+    def play(self, pos, direction=NEAREST):
         """
         Start to send data via RTP connection
         :param pos: .%
+        :param direction: where to find the keyframe when reposition, BACKWARD, FORWARD or NEAREST
         """
-        # reposition
+        # reposition without pausing, the units prepared are discarded, and the new ones are due at once
         if pos is not None:
-            self.videoRtp.pause()
-            self.videoRtp.setPosition(pos)
-            self.audioRtp.pause()
-            self.audioRtp.setPosition(pos)
-        self.videoRtp.resume()
-        self.audioRtp.resume()
-        if not self.videoRtp.is_start:
-            self.videoRtp.start()
-            self.audioRtp.start()
+            frame = self.videoRtp.setPosition(pos, direction)
+            if self.audioRtp is not None:
+                # follow the frame the video is repositioned at
+                self.audioRtp.setTime(self.videoRtp.getTimestamp(frame))
+        started = self.videoRtp.is_start
+        for rtp in self.getStreams():
+            rtp.resume()
+            if not started:
+                rtp.start()
+
+    def joinChannel(self):
+        """
+        Receive the live channel set up, from where it is by its schedule
+        """
+        if not self.joined:
+            # set first, so that the viewers renewed meanwhile are not without it after it joins
+            self.joined = True
+            self.channel.join(self.clientAddr, self.clientVideoRtpPort)
+
+    def leaveChannel(self):
+        if self.joined:
+            self.joined = False
+            self.channel.leave(self.clientAddr, self.clientVideoRtpPort)
 
     def pause(self):
         """
         Pause the transport
         """
-        self.videoRtp.pause()
-        self.audioRtp.pause()
+        for rtp in self.getStreams():
+            rtp.pause()
+
+    def getStreams(self):
+        """
+        :return: the RTP streams set up, the video, and the audio if the video has any
+        """
+        return [rtp for rtp in (self.videoRtp, self.audioRtp) if rtp is not None]
 
     def teardown(self):
         """
         Teardown the connection, and release the resource
         """
-        if self.videoRtp is not None:
-            self.videoRtp.stop()
-            self.videoRtp = None
-        if self.audioRtp is not None:
-            self.audioRtp.stop()
-            self.audioRtp = None
-        if self.rtspSocket is not None:
-            self.rtspSocket.shutdown(socket.SHUT_RDWR)
-            self.rtspSocket.close()
-            self.rtspSocket = None
+        streams = self.getStreams()
+        for rtp in streams:
+            rtp.stop()
+        # the capture is not released while being decoded in the pool
+        for rtp in streams:
+            rtp.wait()
+        self.videoRtp = None
+        self.audioRtp = None
+        self.leaveChannel()
+        self.channel = None
+        if self.writer is not None:
+            self.loop.call_soon_threadsafe(self.writer.close)
+            self.writer = None
+        if self.acquired:
+            self.sessions.release()
+            self.acquired = False
         if self.cap is not None:
             self.cap.release()
             self.cap = None
+        # the worker serves other sessions after it
+        if self.audioClip is not None:
+            self.audioClip.close()
+            self.audioClip = None
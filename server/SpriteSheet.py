@@ -0,0 +1,163 @@
+import math
+import os
+import struct
+import cv2
+import numpy as np
+import sys; sys.path.append('..')
+
+from server.FrameStore import PACKAGE_DIR
+from server.SeekIndex import BACKWARD
+
+# magic, thumbnail width, height, columns, rows of each atlas, seconds between the thumbnails, n thumbnails, n atlases
+HEADER = struct.Struct('!4sHHHHfII')
+MAGIC = b'SPRT'
+# bytes of each atlas
+LENGTH = struct.Struct('!I')
+
+# seconds between the thumbnails, longer for long videos so that there are no more than MAX_THUMBNAILS
+DEFAULT_INTERVAL = 5
+MAX_THUMBNAILS = 400
+THUMBNAIL_SIZE = (160, 90)
+# thumbnails in each atlas
+COLS = 10
+ROWS = 10
+JPEG_QUALITY = 70
+# grab the frames in between rather than seek, if the next thumbnail is no more than it frames later
+MAX_GRAB = 25
+
+
+class SpriteSheet:
+    """
+    Low-resolution thumbnails of a video, one every some seconds, packed into a few .jpg atlases,
+    so that the client can preview any position when scrubbing, after a single request.
+
+    It's saved and sent as [HEADER][LENGTH of each atlas][each atlas]
+    """
+
+    def __init__(self, interval, count, size=THUMBNAIL_SIZE):
+        """
+        :param interval: seconds between the thumbnails
+        :param count: n thumbnails
+        :param size: (width, height) of each thumbnail
+        """
+        self.interval = interval
+        self.count = count
+        self.size = size
+
+        # encoded atlases
+        self.atlases = []
+        # the atlas being filled, and n thumbnails added
+        self.current = None
+        self.added = 0
+
+    @staticmethod
+    def create(fs, totalFrames):
+        """
+        :param fs: frame rate of the video
+        :param totalFrames: n frames of the video
+        :return: an empty SpriteSheet of the video
+        """
+        length = totalFrames / fs if fs > 0 else 0
+        interval = max(DEFAULT_INTERVAL, length / MAX_THUMBNAILS)
+        return SpriteSheet(interval, max(math.ceil(length / interval), 1))
+
+    def getFrames(self, fs):
+        """
+        :return: frame number of each thumbnail
+        """
+        return [int(round(i * self.interval * fs)) for i in range(self.count)]
+
+    def add(self, frame):
+        """
+        Add next thumbnail
+        :param frame: BGR frame
+        """
+        width, height = self.size
+        if self.current is None:
+            self.current = np.zeros((ROWS * height, COLS * width, 3), dtype=np.uint8)
+        i = self.added % (COLS * ROWS)
+        x, y = i % COLS * width, i // COLS * height
+        self.current[y:y + height, x:x + width] = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self.added += 1
+        if self.added % (COLS * ROWS) == 0:
+            self.encodeAtlas()
+
+    def encodeAtlas(self):
+        """
+        Encode the atlas being filled, only the rows used
+        """
+        if self.current is None:
+            return
+        used = self.added - len(self.atlases) * COLS * ROWS
+        rows = math.ceil(used / COLS)
+        encode = cv2.imencode('.jpg', self.current[:rows * self.size[1]], [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        self.atlases.append(encode[1].tobytes())
+        self.current = None
+
+    def pack(self):
+        """
+        :return: bytes to save and send
+        """
+        self.encodeAtlas()
+        header = HEADER.pack(MAGIC, self.size[0], self.size[1], COLS, ROWS, self.interval, self.added, len(self.atlases))
+        lengths = b''.join(LENGTH.pack(len(atlas)) for atlas in self.atlases)
+        return header + lengths + b''.join(self.atlases)
+
+    def save(self, path):
+        # written by other processes as well
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(self.pack())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def getPath(videoDir, filename):
+        return os.path.join(videoDir, PACKAGE_DIR, '{}.sprites'.format(filename))
+
+    @staticmethod
+    def open(videoDir, filename):
+        """
+        Load the sprite sheet saved, if it's newer than the video
+        :return: bytes of it, None if not built
+        """
+        path = SpriteSheet.getPath(videoDir, filename)
+        if not os.path.exists(path):
+            return None
+        if os.path.getmtime(path) < os.path.getmtime(os.path.join(videoDir, filename)):
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def build(path, seekIndex=None):
+        """
+        Decode the thumbnails of the video at their exact times, each decoded forward from the keyframe before it
+        if the seek index is given, so that the seek costs no more than the GOP
+        :return: SpriteSheet, None if failed
+        """
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            return None
+        fs = cap.get(cv2.CAP_PROP_FPS)
+        sheet = SpriteSheet.create(fs, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        position = 0
+        for index in sheet.getFrames(fs):
+            if not 0 <= index - position <= MAX_GRAB:
+                start = seekIndex.getKeyframe(index, BACKWARD) if seekIndex is not None else index
+                # unless the keyframe is behind the frame decoded last, in the same GOP
+                if not start <= position <= index:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                    position = start
+            # the frames in between are grabbed without retrieving
+            while position < index:
+                cap.grab()
+                position += 1
+            res, frame = cap.read()
+            position = index + 1
+            if not res:
+                break
+            sheet.add(frame)
+        cap.release()
+        if sheet.added == 0:
+            return None
+        return sheet
@@ -0,0 +1,235 @@
+import struct
+import threading
+import cv2
+import numpy as np
+
+# RTP payload type of the tile frames, dynamic
+TILE_PAYLOAD_TYPE = 96
+
+# kind, width, height, tile size, n tiles
+FRAME_HEADER = struct.Struct('!BHHHH')
+# column and row of each tile
+TILE_HEADER = struct.Struct('!HH')
+
+# kinds of the frame
+FULL = 0
+TILES = 1
+
+# pixels of each side of the tiles, multiple of 16 so that the tiles don't share the blocks of the .jpg
+DEFAULT_TILE_SIZE = 32
+# n frames between the full refresh
+DEFAULT_REFRESH = 50
+# a tile is changed if any channel of any pixel differs more than it
+THRESHOLD = 16
+# send the full frame instead if more tiles are changed
+MAX_CHANGED = 0.6
+
+
+class TileCodec:
+    """
+    Conditional replenishment, the frame is divided into tiles, and only the tiles changed since they were sent
+    are encoded, packed side by side into a single .jpg. A full frame is sent periodically, and whenever
+    the client may not have the previous frames, so that the errors don't last.
+
+    A frame is [FRAME_HEADER][TILE_HEADER of each tile][.jpg], the .jpg is the full frame if FULL,
+    otherwise the changed tiles from left to right, top to bottom, in rows of as many tiles as the frame.
+    Frames are encoded in order, since each one depends on the previous ones
+    """
+
+    def __init__(self, tileSize=DEFAULT_TILE_SIZE, refresh=DEFAULT_REFRESH):
+        """
+        :param tileSize: pixels of each side of the tiles
+        :param refresh: n frames between the full refresh
+        """
+        if tileSize <= 0 or tileSize % 16 != 0:
+            raise ValueError('Tile size should be a positive multiple of 16')
+        self.tileSize = tileSize
+        self.refresh = refresh
+
+        # what the client has, padded to whole tiles
+        self.reference = None
+        # the reference is valid while the key is unchanged
+        self.key = None
+        # n frames since last full refresh
+        self.sinceRefresh = 0
+
+        # n frames, n full frames, total tiles, and changed tiles
+        self.frames = 0
+        self.refreshes = 0
+        self.tiles = 0
+        self.changed = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        """
+        Send a full frame next, used when the client may miss some frames
+        """
+        self.reference = None
+
+    def encode(self, frame, quality, key=None):
+        """
+        Encode the frame against the frames sent
+        :param frame: BGR frame
+        :param quality: quality of the .jpg
+        :param key: identifies the sequence of frames, e.g. the generation of the pipeline,
+            the full frame is sent when it's changed
+        :return: encoded tile frame, None if failed
+        """
+        height, width = frame.shape[:2]
+        padded = self.pad(frame)
+        rows, cols = padded.shape[0] // self.tileSize, padded.shape[1] // self.tileSize
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        full = self.reference is None or key != self.key \
+            or self.reference.shape != padded.shape or self.sinceRefresh >= self.refresh
+        if not full:
+            # max difference of each tile
+            diff = cv2.absdiff(padded, self.reference)
+            diff = diff.reshape(rows, self.tileSize, cols, self.tileSize, -1).max(axis=(1, 3, 4))
+            changed = np.argwhere(diff > THRESHOLD)
+            full = len(changed) > MAX_CHANGED * rows * cols
+
+        self.key = key
+        if full:
+            res, data = cv2.imencode('.jpg', frame, params)
+            if not res:
+                self.reference = None
+                return None
+            self.reference = padded
+            self.sinceRefresh = 1
+            self.record(rows * cols, rows * cols, True)
+            return FRAME_HEADER.pack(FULL, width, height, self.tileSize, 0) + data.tobytes()
+
+        self.sinceRefresh += 1
+        self.record(rows * cols, len(changed), False)
+        header = FRAME_HEADER.pack(TILES, width, height, self.tileSize, len(changed))
+        if len(changed) == 0:
+            return header
+
+        # pack the changed tiles in rows of cols tiles
+        size = self.tileSize
+        mosaic = np.zeros((-(-len(changed) // cols) * size, min(len(changed), cols) * size, padded.shape[2]),
+                          dtype=padded.dtype)
+        positions = []
+        for i, (row, col) in enumerate(changed):
+            y, x = row * size, col * size
+            tile = padded[y:y + size, x:x + size]
+            mosaic[i // cols * size:(i // cols + 1) * size, i % cols * size:(i % cols + 1) * size] = tile
+            # what the client will have
+            self.reference[y:y + size, x:x + size] = tile
+            positions.append(TILE_HEADER.pack(col, row))
+        res, data = cv2.imencode('.jpg', mosaic, params)
+        if not res:
+            self.reference = None
+            return None
+        return header + b''.join(positions) + data.tobytes()
+
+    def wrap(self, data, size):
+        """
+        Send a .jpg frame encoded apart as a full frame, e.g. the frames played in reverse, which can't be encoded
+        against the frames sent, the reference is left as it is, and replaced once the key is changed
+        :param data: encoded .jpg frame, None if failed
+        :param size: (width, height) of the frame
+        :return: encoded tile frame, None if failed
+        """
+        if data is None:
+            return None
+        width, height = size
+        tiles = -(-width // self.tileSize) * -(-height // self.tileSize)
+        self.record(tiles, tiles, True)
+        return FRAME_HEADER.pack(FULL, width, height, self.tileSize, 0) + data
+
+    def pad(self, frame):
+        """
+        Pad the frame to whole tiles
+        """
+        height, width = frame.shape[:2]
+        bottom, right = -height % self.tileSize, -width % self.tileSize
+        if bottom == 0 and right == 0:
+            return frame.copy()
+        return cv2.copyMakeBorder(frame, 0, bottom, 0, right, cv2.BORDER_REPLICATE)
+
+    def record(self, tiles, changed, full):
+        with self.lock:
+            self.frames += 1
+            self.tiles += tiles
+            self.changed += changed
+            if full:
+                self.refreshes += 1
+
+    def getStats(self):
+        """
+        Ratio of the tiles sent, and n full frames
+        """
+        with self.lock:
+            return {
+                'changed_ratio': round(self.changed / max(self.tiles, 1), 3),
+                'refreshes': self.refreshes
+            }
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    def slides(n, size):
+        """
+        Synthetic screen capture, static slides with some text, a moving cursor, a new slide every 100 frames
+        """
+        width, height = size
+        rng = np.random.default_rng(0)
+        slide = None
+        for i in range(n):
+            if i % 100 == 0:
+                slide = np.full((height, width, 3), 245, dtype=np.uint8)
+                for line in range(8):
+                    text = ''.join(chr(c) for c in rng.integers(97, 123, 24))
+                    cv2.putText(slide, text, (40, 60 + line * height // 10), cv2.FONT_HERSHEY_SIMPLEX,
+                                height / 900, (30, 30, 30), 2)
+            frame = slide.copy()
+            x, y = int(width / 2 + width / 3 * np.cos(i / 20)), int(height / 2 + height / 3 * np.sin(i / 20))
+            cv2.circle(frame, (x, y), 8, (0, 0, 255), -1)
+            yield frame
+
+    def motion(n, size):
+        """
+        Synthetic natural content, a moving gradient with noise, every tile changes
+        """
+        width, height = size
+        rng = np.random.default_rng(0)
+        xs = np.arange(width, dtype=np.float32)[None, :]
+        ys = np.arange(height, dtype=np.float32)[:, None]
+        for i in range(n):
+            base = 127 + 100 * np.sin((xs + ys + i * 8) / 40)
+            frame = np.repeat(base[:, :, None], 3, axis=2) + rng.normal(0, 8, (height, width, 3))
+            yield np.clip(frame, 0, 255).astype(np.uint8)
+
+    def benchmark(name, frames, quality, tileSize, refresh):
+        frames = list(frames)
+        codec = TileCodec(tileSize, refresh)
+        jpegBytes = tileBytes = 0
+        jpegTime = tileTime = 0.0
+        for frame in frames:
+            start = time.perf_counter()
+            jpegBytes += len(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1])
+            jpegTime += time.perf_counter() - start
+            start = time.perf_counter()
+            tileBytes += len(codec.encode(frame, quality))
+            tileTime += time.perf_counter() - start
+        print('{}: jpeg {:.0f} B/frame {:.2f} ms, tiles {:.0f} B/frame {:.2f} ms, {:.1%} of the bytes, {}'.format(
+            name, jpegBytes / len(frames), jpegTime / len(frames) * 1000,
+            tileBytes / len(frames), tileTime / len(frames) * 1000, tileBytes / jpegBytes, codec.getStats()))
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--refresh', type=int, default=DEFAULT_REFRESH)
+
+    args = vars(parser.parse_args())
+
+    size = (args['width'], args['height'])
+    for name, frames in (('slides', slides(args['frames'], size)), ('motion', motion(args['frames'], size))):
+        benchmark(name, frames, args['quality'], args['tile_size'], args['refresh'])
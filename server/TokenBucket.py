@@ -0,0 +1,84 @@
+import threading
+import time
+
+# bytes per second, 0 to spread the packets of each frame over the frame interval
+DEFAULT_RATE = 0
+# bytes can be sent at once, about 4 packets on a 1500 MTU
+DEFAULT_BURST = 6000
+# part of the frame interval to spread the packets over, leaves some time for next frame
+SPREAD = 0.8
+
+
+class TokenBucket:
+    """
+    Token bucket to shape the packets of a stream, so that the packets of a frame are not sent in a burst
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """
+        :param rate: bytes per second, 0 to spread the packets of each frame over the frame interval
+        :param burst: bytes can be sent at once
+        """
+        self.rate = rate
+        self.burst = burst
+
+        # rate of current frame
+        self.currentRate = rate
+        # tokens in bytes, negative for the bytes taken in advance
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+        # n packets delayed, the total delay in seconds, and n packets failed to send
+        self.shaped = 0
+        self.delay = 0.0
+        self.dropped = 0
+
+    def setFrame(self, size, interval):
+        """
+        Set the rate for next frame, at least the frame can be sent in the interval
+        :param size: bytes of the frame
+        :param interval: seconds until next frame is due, 0 to send it at the rate set
+        """
+        with self.lock:
+            if interval <= 0:
+                self.currentRate = self.rate
+            else:
+                self.currentRate = max(self.rate, size / (interval * SPREAD))
+
+    def reserve(self, size):
+        """
+        Take the tokens of the packet
+        :param size: bytes of the packet
+        :return: seconds to wait before sending it
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.last, last = now, self.last
+            if self.currentRate <= 0:
+                # unlimited
+                self.tokens = self.burst
+                return 0.0
+            self.tokens = min(self.burst, self.tokens + (now - last) * self.currentRate)
+            self.tokens -= size
+            if self.tokens >= 0:
+                return 0.0
+            delay = -self.tokens / self.currentRate
+            self.shaped += 1
+            self.delay += delay
+            return delay
+
+    def drop(self):
+        """
+        Count a packet failed to send
+        """
+        with self.lock:
+            self.dropped += 1
+
+    def getStats(self):
+        with self.lock:
+            return {
+                'shaped': self.shaped,
+                'shaped_delay_ms': round(self.delay * 1000, 3),
+                'dropped': self.dropped
+            }
@@ -1,12 +1,28 @@
-import threading
+import math
+import time
 import cv2
-from io import BytesIO
 
 from server.ServerRtp import ServerRtp
-from server.RtpPacket import RtpPacket
+from server.Packetizer import Packetizer
+from server.QualityLadder import QualityLadder, DEFAULT_LADDER
+from server.SeekIndex import NEAREST, FORWARD, BACKWARD
+from server.EncodePipeline import EncodePipeline, DECODE
+from server.TileCodec import TILE_PAYLOAD_TYPE
+from server.ReverseReader import ReverseReader, DEFAULT_GOP
 
-BUF_SIZE = 16384
+# RTP payload type of JPEG
+PAYLOAD_TYPE = 26
 
+# grab the frames in between rather than seek, if the capture is behind by no more than it
+MAX_GRAB = 25
+# send only the frames reached by seeking at this speed or faster, the keyframes if the seek index is built,
+# if the frames have to be decoded, since grabbing the frames in between decodes them as well
+KEYFRAME_SPEED = 2
+# about n frames OpenCV decodes to seek, it seeks to a keyframe some frames before and decodes forward,
+# the frames sent are this times the speed apart, so that fast forward decodes no more than 1x
+SEEK_COST = 16
+
+# default levels of the ladder
 BLUR = 0
 HD = 1
 
@@ -16,101 +32,230 @@ class VideoServerRtp(ServerRtp):
     Video RTP stream controller
     """
 
-    def __init__(self, addr, *args, **kwargs):
-        super(VideoServerRtp, self).__init__(addr, *args, **kwargs)
+    def __init__(self, addr, scheduler):
+        super(VideoServerRtp, self).__init__(addr, scheduler)
 
-        # current frame to send
+        # position of current frame to read, fractional if not 1x
         self.currentFrame = 0
+        # frame number of the frame last sent
+        self.sentFrame = -1
         # n frames of the video
         self.totalLength = 0
+        # frame rate
+        self.fs = 0
         # the video itself
         self.cap = None
 
-        # current seq number of the packet
-        self.currentSeq = 1
+        # divide the frames into packets
+        self.packetizer = Packetizer(PAYLOAD_TYPE)
 
-        # the video quality, represented by the size of each frame
-        self.quality = (480, 270)
+        # the video quality, represented by the level of the ladder
+        self.ladder = QualityLadder.parse(DEFAULT_LADDER)
+        self.level = HD
 
-        # Semaphore to control each thread
-        self.bufferSemaphore = None
-        self.sendSemaphore = None
-        # the encoded frame
-        self.encodeFrame = None
+        # pre-encoded frames of each rung of the ladder, if packaged
+        self.frameStores = {}
+        # index of next frame to read from the capture
+        self.capPosition = 0
+        # keyframes and timestamps of the video, if built
+        self.seekIndex = None
+        # encoded frames shared by all the sessions, and the name of the video in it
+        self.frameCache = None
+        self.cacheName = ''
+        # send only the changed tiles if set, the frames depend on the ones sent before
+        self.tileCodec = None
+        # GOPs decoded forward to be sent in reverse
+        self.reverseReader = ReverseReader()
 
-    def sendCondition(self):
+    def fill(self):
         """
-        Send until meet the end of the video
+        Decode next frame, and put it into the pipeline to encode
         """
-        return self.currentFrame < self.totalLength
+        with self.positionLock:
+            generation = self.pipeline.generation
+            position = self.currentFrame
+            index = math.floor(position)
+            # skip the frames in between if faster than 1x
+            nextPosition = self.getNextPosition(position)
+            # present the frame until next one is due
+            duration = abs(math.floor(nextPosition) - index) / (self.fs * abs(self.speedFactor))
+        if index < 0:
+            # meet the start in reverse, wait until repositioned or the speed is changed
+            self.exhausted = generation
+            return
+        # the quality may be changed at any time, it takes effect from next frame
+        future = self.readFrame(index, self.level, generation)
+        if future is None:
+            # meet the end, wait until repositioned
+            self.pipeline.put(generation, None, None)
+            self.exhausted = generation
+            return
+        if not self.pipeline.put(generation, index, future, duration):
+            return
+        with self.positionLock:
+            if generation == self.pipeline.generation:
+                self.currentFrame = nextPosition
 
-    def beforeRun(self):
+    def isDroppable(self):
         """
-        Init the semaphore, and start the encode thread
+        The tile frames can't be dropped, they depend on the ones sent before, unless sent in full in reverse
         """
-        self.bufferSemaphore = threading.Semaphore(value=1)
-        self.sendSemaphore = threading.Semaphore(value=0)
-        threading.Thread(target=self.encode).start()
+        return self.tileCodec is None or self.speedFactor < 0
+
+    def onSend(self, index):
+        self.sentFrame = index
 
-    def running(self):
+    def getNextPosition(self, position):
         """
-        Start to send data
+        Position of the frame to read after the one at the position, at current speed
+        :param position: position of the frame, in frames
+        :return: position of next frame, before it if in reverse
         """
-        self.sendData()
+        if self.isSparse():
+            frame = math.floor(position)
+            step = math.ceil(abs(self.speedFactor) * SEEK_COST)
+            if self.seekIndex is None:
+                # reached by seeking all the same, decoded from the keyframe before
+                return frame - step if self.speedFactor < 0 else frame + step
+            if self.speedFactor < 0:
+                nextFrame = self.seekIndex.getKeyframe(frame - step, BACKWARD)
+                # no keyframe before it
+                return nextFrame if nextFrame < frame else frame - step
+            nextFrame = self.seekIndex.getKeyframe(frame + step, FORWARD)
+            # no keyframe after it
+            return nextFrame if nextFrame > frame else frame + step
+        # slower than 1x by presenting each frame longer
+        return position + math.copysign(max(abs(self.speedFactor), 1), self.speedFactor)
 
-    def encode(self):
+    def isSparse(self):
         """
-        Encode next frame
+        Whether to send only the frames far apart reached by seeking, the keyframes if the seek index is built,
+        at high speed, if the frames have to be decoded
         """
-        while self._stopper.is_set():
-            if self.cap is None:
-                return
-            res, frame = self.cap.read()
-            if self.doubleSpeed:
-                # discard a frame each time if double speed
-                res, frame = self.cap.read()
-            if not res:
-                # fail to get next frame
-                return
-            # resize the frame
-            frame = cv2.resize(frame, self.quality)
-            # encode into .jpg format
-            encode = cv2.imencode('.jpg', frame)
-            if not encode[0]:
-                # fail to encode
-                return
-            data = encode[1].tobytes()
-            self.bufferSemaphore.acquire()
-            self.encodeFrame = data
-            self.sendSemaphore.release()
-            self.currentFrame += 1
+        return abs(self.speedFactor) >= KEYFRAME_SPEED \
+            and self.ladder.getName(self.level) not in self.frameStores.keys()
 
-    def sendData(self):
+    def readFrame(self, index, level, generation=0):
         """
-        Send the encoded frame to the client
+        Get the encoded frame from the package or the cache if exists, otherwise decode it and encode it by the workers
+        :param index: frame number
+        :param level: level of the ladder
+        :param generation: the generation of the pipeline when the frame is read
+        :return: Future of the encoded .jpg frame, or the tile frame if tiles, None if failed
         """
-        if self.socket is None:
-            return
-        self.sendSemaphore.acquire()
-        data = self.encodeFrame
-        self.bufferSemaphore.release()
-
-        byteStream = BytesIO(data)
-        totalBytes = len(data)
-        sentBytes = 0
-
-        # divide into packets
-        packet = RtpPacket()
-        while sentBytes < totalBytes:
-            sentBytes += BUF_SIZE
-            # if it is the last packet
-            marker = 0 if sentBytes < totalBytes else 1
-            bytesToSend = byteStream.read(BUF_SIZE)
-            packet.encode(2, 0, 0, 0, self.currentSeq, marker, 26, self.ssrc, bytesToSend)
-            packet.setTimestamp(self.currentFrame)
-            self.currentSeq += 1
-            self.socket.sendto(packet.getPacket(), (self.clientAddr, self.clientPort))
-        byteStream.close()
+        if self.tileCodec is None:
+            return self.readJpeg(index, level)
+        if self.speedFactor >= 0:
+            return self.readTiles(index, level, generation)
+        # the frames in reverse can't be encoded against the ones sent in order, read as .jpg,
+        # e.g. from the GOP decoded forward at once rather than seeking each frame, and sent in full
+        future = self.readJpeg(index, level)
+        if future is None:
+            return None
+        size = self.ladder.getSize(level)
+        return self.pipeline.then(future, lambda data: self.tileCodec.wrap(data, size))
+
+    def readJpeg(self, index, level):
+        """
+        Get the encoded .jpg frame from the package or the cache if exists, otherwise decode it and encode it
+        :return: Future of the encoded .jpg frame, None if failed
+        """
+        name = self.ladder.getName(level)
+        store = self.frameStores.get(name)
+        if store is not None:
+            if index >= len(store):
+                return None
+            return self.pipeline.done(store.getFrame(index))
+
+        if self.frameCache is not None:
+            data = self.frameCache.get(self.cacheName, index, name)
+            if data is not None:
+                return self.pipeline.done(data)
+
+        if self.speedFactor < 0 and not self.isSparse():
+            return self.readReverse(index, level)
+
+        start = time.perf_counter()
+        frame = self.decodeFromCapture(index)
+        self.pipeline.record(DECODE, time.perf_counter() - start)
+        if frame is None:
+            return None
+        return self.pipeline.submit(self.encodeFrame, frame, index, level)
+
+    def readReverse(self, index, level):
+        """
+        Get the frame to play in reverse, the GOP of it is decoded forward at once,
+        and encoded by the pool for reverse, since it's waited for in the pool, the frames before it are kept to be sent next
+        :return: Future of the encoded .jpg frame, None if failed
+        """
+        if self.seekIndex is not None:
+            keyframe = self.seekIndex.getKeyframe(index, BACKWARD)
+        else:
+            keyframe = max(index - DEFAULT_GOP, 0)
+        start = time.perf_counter()
+        data = self.reverseReader.read(
+            index, level, keyframe, self.decodeFromCapture,
+            lambda frame, i: self.pipeline.submit(self.encodeFrame, frame, i, level,
+                                                  executor=self.scheduler.reverseExecutor)
+        )
+        self.pipeline.record(DECODE, time.perf_counter() - start)
+        if data is None:
+            return None
+        return self.pipeline.done(data)
+
+    def readTiles(self, index, level, generation):
+        """
+        Decode the frame and encode the changed tiles in order, in the decode thread,
+        the tile frames are neither pre-encoded nor cached, since they depend on the frames sent before
+        :return: Future of the encoded tile frame, None if failed
+        """
+        start = time.perf_counter()
+        frame = self.decodeFromCapture(index)
+        self.pipeline.record(DECODE, time.perf_counter() - start)
+        if frame is None:
+            return None
+        frame = cv2.resize(frame, self.ladder.getSize(level))
+        # the frames of the old generation are discarded, so a full frame is sent after repositioning
+        data = self.tileCodec.encode(frame, self.ladder.getJpegQuality(level), generation)
+        return self.pipeline.done(data)
+
+    def decodeFromCapture(self, index):
+        """
+        Decode the frame from the capture
+        :param index: frame number
+        :return: the frame, None if failed
+        """
+        if self.cap is None:
+            return None
+        if 0 < index - self.capPosition <= MAX_GRAB and not self.isSparse():
+            # the frames in between may be got from the cache or skipped, grab them without retrieving
+            while self.capPosition < index:
+                self.cap.grab()
+                self.capPosition += 1
+        elif index != self.capPosition:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        res, frame = self.cap.read()
+        self.capPosition = index + 1
+        if not res:
+            return None
+        return frame
+
+    def encodeFrame(self, frame, index, level):
+        """
+        Resize and encode the frame, called by the workers
+        :return: encoded .jpg frame, None if failed
+        """
+        # resize the frame
+        frame = cv2.resize(frame, self.ladder.getSize(level))
+        # encode into .jpg format
+        encode = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.ladder.getJpegQuality(level)])
+        if not encode[0]:
+            # fail to encode
+            return None
+        data = encode[1].tobytes()
+        if self.frameCache is not None:
+            self.frameCache.put(self.cacheName, index, self.ladder.getName(level), data)
+        return data
 
     def setCapture(self, cap):
         """
@@ -120,23 +265,138 @@ class VideoServerRtp(ServerRtp):
         # n frames
         self.totalLength = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         # frame rate
-        fs = cap.get(cv2.CAP_PROP_FPS)
-        self.setInterval(1 / fs / 1.5)
+        self.fs = cap.get(cv2.CAP_PROP_FPS)
+        self.setInterval(1 / self.fs)
 
-    def setPosition(self, pos):
+    def setFrameStores(self, frameStores):
         """
-        Set the position to read next frame
+        Set the pre-encoded frames
+        :param frameStores: { name of the rung: FrameStore }
+        """
+        self.frameStores = frameStores
+
+    def setFrameCache(self, frameCache, name):
+        """
+        Set the cache shared by all the sessions
+        :param frameCache: FrameCache
+        :param name: identifies the video in the cache
+        """
+        self.frameCache = frameCache
+        self.cacheName = name
+
+    def setTileCodec(self, tileCodec):
+        """
+        Send only the changed tiles of each frame
+        :param tileCodec: TileCodec
+        """
+        self.tileCodec = tileCodec
+        self.packetizer.payloadType = TILE_PAYLOAD_TYPE
+
+    def setReverseCache(self, maxBytes):
+        """
+        :param maxBytes: bytes of the encoded frames can be kept to be sent in reverse
+        """
+        self.reverseReader = ReverseReader(maxBytes)
+
+    def setPipeline(self, depth):
+        """
+        Set the size of the pipeline, the frames are encoded by the pool of the scheduler
+        :param depth: n frames can be buffered
+        """
+        self.pipeline.close()
+        self.pipeline = EncodePipeline(self.scheduler.executor, depth)
+
+    def getStats(self):
+        """
+        Queue depth and the time of each stage of the pipeline, the tiles sent, the frames kept to play in reverse,
+        and the error of the pacing
+        """
+        stats = self.pipeline.getStats()
+        if self.tileCodec is not None:
+            stats.update({'tiles.{}'.format(key): value for key, value in self.tileCodec.getStats().items()})
+        stats.update({'reverse.{}'.format(key): value for key, value in self.reverseReader.getStats().items()})
+        stats.update(super(VideoServerRtp, self).getStats())
+        return {'video.{}'.format(key): value for key, value in stats.items()}
+
+    def setSeekIndex(self, seekIndex):
+        self.seekIndex = seekIndex
+
+    def setPosition(self, pos, direction=NEAREST):
+        """
+        Set the position to read next frame,
+        move it to the keyframe nearby if the frame has to be decoded, so that it can be decoded at once
         :param pos: .%
+        :param direction: where to find the keyframe, BACKWARD, FORWARD or NEAREST
+        :return: frame number of the position
         """
-        self.currentFrame = int(self.totalLength * pos / 1000)
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.currentFrame)
+        frame = int(self.totalLength * pos / 1000)
+        if self.seekIndex is not None and self.ladder.getName(self.level) not in self.frameStores.keys():
+            frame = self.seekIndex.getKeyframe(frame, direction)
+        self.setFrame(frame)
+        return frame
+
+    def setFrame(self, frame):
+        """
+        Set the frame to read next as it is, e.g. the one due by a schedule, decoded from the keyframe before if needed
+        :param frame: frame number
+        """
+        with self.positionLock:
+            self.currentFrame = frame
+            self.sentFrame = -1
+            # the frames in the pipeline are out of date
+            self.flush()
+        self.clock.reset()
+        self.wakeUp()
+
+    def speed(self, speed):
+        """
+        Change the speed from the frame next to the one last sent, the frames in the pipeline are discarded,
+        since they are read at the old speed
+        :param speed: speed factor, negative for reverse
+        """
+        super(VideoServerRtp, self).speed(speed)
+        reverse = self.speedFactor < 0
+        with self.positionLock:
+            if self.sentFrame >= 0:
+                frame = self.sentFrame - 1 if reverse else self.sentFrame + 1
+            else:
+                frame = math.floor(self.currentFrame)
+            if self.isSparse() and self.seekIndex is not None:
+                frame = self.seekIndex.getKeyframe(frame, BACKWARD if reverse else FORWARD)
+            self.currentFrame = frame
+            self.flush()
+        self.clock.reset()
+        self.wakeUp()
+
+    def getTimestamp(self, frame):
+        """
+        :return: presentation time of the frame, seconds
+        """
+        if self.seekIndex is not None:
+            return self.seekIndex.getTimestamp(frame)
+        return frame / self.fs
+
+    def setLadder(self, ladder):
+        """
+        Set the qualities the video can be sent in
+        :param ladder: QualityLadder
+        """
+        self.ladder = ladder
+        self.level = min(self.level, len(ladder) - 1)
 
     def setQuality(self, level):
         """
-        Set the quality of the video
-        :param level: 0 for blur and 1 for HD
+        Set the quality of the video, it takes effect from next frame
+        :param level: level of the ladder, 0 for the lowest
+        """
+        if 0 <= level < len(self.ladder):
+            self.level = level
+
+    def closeSocket(self):
+        """
+        Release the pre-encoded frames as well
         """
-        if level == HD:
-            self.quality = (480, 270)
-        elif level == BLUR:
-            self.quality = (320, 180)
+        super(VideoServerRtp, self).closeSocket()
+        self.pipeline.close()
+        # the memory maps are closed once no frame refers to them
+        self.frameStores = {}
@@ -0,0 +1,50 @@
+import multiprocessing
+
+# counters of each worker
+FIELDS = ['connections', 'accepted', 'sessions', 'bad_requests', 'restarts']
+
+
+class WorkerStats:
+    """
+    Counters of the workers in shared memory, created by the supervisor before forking,
+    each worker writes its own slot, and the sum of all the slots can be read by any of them
+    """
+
+    def __init__(self, workers):
+        """
+        :param workers: n slots
+        """
+        self.workers = workers
+        # a row of FIELDS per worker
+        self.values = multiprocessing.Array('q', workers * len(FIELDS))
+
+    def add(self, slot, field, n=1):
+        """
+        :param slot: index of the worker
+        :param field: one of FIELDS
+        """
+        with self.values.get_lock():
+            self.values[slot * len(FIELDS) + FIELDS.index(field)] += n
+
+    def set(self, slot, field, value):
+        with self.values.get_lock():
+            self.values[slot * len(FIELDS) + FIELDS.index(field)] = value
+
+    def get(self, slot):
+        """
+        :return: { field: value } of the worker
+        """
+        with self.values.get_lock():
+            row = self.values[slot * len(FIELDS):(slot + 1) * len(FIELDS)]
+        return dict(zip(FIELDS, row))
+
+    def getTotal(self):
+        """
+        :return: { 'server.field': sum of the workers }
+        """
+        with self.values.get_lock():
+            values = self.values[:]
+        stats = {'server.workers': self.workers}
+        for i, field in enumerate(FIELDS):
+            stats['server.{}'.format(field)] = sum(values[i::len(FIELDS)])
+        return stats